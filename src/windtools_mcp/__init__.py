@@ -1,9 +1,20 @@
-from .server import mcp
+# The server is imported lazily: embedding worker processes import this package to reach the model code
+# and must not build the server and its stores as a side effect.
 
 
 def main():
+    from .server import mcp
+
     mcp.run()
 
 
+def __getattr__(name):
+    if name == "mcp":
+        from .server import mcp
+
+        return mcp
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import os.path
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class CheckpointStore:
+    """
+    Records how far interrupted index runs got, per collection and set of target directories, in a
+    small JSON file.
+
+    A checkpoint holds the last walked file such that every file before it in walk order has been
+    written, so that the next run over the same directories resumes after it instead of starting over.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _make_key(target_directories: List[str]) -> str:
+        return os.pathsep.join(sorted(target_directories))
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable index checkpoints {self.path}: {str(e)}")
+            return {}
+
+    def _save(self, state: Dict[str, Any]):
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temporary_path, self.path)
+
+    def get(self, collection_name: str, target_directories: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Get the checkpoint of an interrupted run
+
+        Args:
+            collection_name: Name of the collection the run indexed into
+            target_directories: Absolute paths of the directories the run indexed
+
+        Returns:
+            Dictionary with the cursor, the force_reindex flag, the git states captured when the run
+            started and the time of the checkpoint, or None if there is no checkpoint
+        """
+        with self._lock:
+            return self._load().get(collection_name, {}).get(self._make_key(target_directories))
+
+    def set(
+        self,
+        collection_name: str,
+        target_directories: List[str],
+        cursor: str,
+        force_reindex: bool,
+        git_states: Dict[str, Dict[str, Any]],
+    ):
+        """
+        Record the progress of a run
+
+        Args:
+            collection_name: Name of the collection the run indexes into
+            target_directories: Absolute paths of the directories the run indexes
+            cursor: Last walked file such that every file before it in walk order has been written
+            force_reindex: Whether the run reindexes unchanged files
+            git_states: Commit and dirty files of each git work tree when the run started
+        """
+        with self._lock:
+            state = self._load()
+            state.setdefault(collection_name, {})[self._make_key(target_directories)] = {
+                "cursor": cursor,
+                "force_reindex": force_reindex,
+                "git_states": git_states,
+                "updated_at": time.time(),
+            }
+            self._save(state)
+
+    def delete(self, collection_name: str, target_directories: List[str]):
+        """
+        Forget the checkpoint of a run, once it completed
+
+        Args:
+            collection_name: Name of the collection the run indexed into
+            target_directories: Absolute paths of the directories the run indexed
+        """
+        with self._lock:
+            state = self._load()
+            if state.get(collection_name, {}).pop(self._make_key(target_directories), None) is not None:
+                self._save(state)
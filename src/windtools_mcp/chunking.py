@@ -0,0 +1,57 @@
+from dataclasses import dataclass
+from typing import List
+
+
+@dataclass
+class Chunk:
+    """A window of lines from a file, embedded and stored as its own document"""
+
+    start_line: int  # 1-based, inclusive
+    end_line: int  # 1-based, inclusive
+    text: str
+
+
+def _is_top_level(line: str) -> bool:
+    """Check if a line starts a top-level statement (a definition, a class, an import...)"""
+    return bool(line.strip()) and not line[0].isspace()
+
+
+def chunk_lines(content: str, max_lines: int = 60, overlap: int = 10) -> List[Chunk]:
+    """
+    Split file content into overlapping windows of lines.
+
+    Windows are cut right before a top-level statement found in their second half when
+    there is one, so that functions and classes are kept together as much as possible.
+    Content that fits in a single window is returned as one chunk.
+
+    Args:
+        content: File content
+        max_lines: Maximum number of lines per chunk
+        overlap: Number of lines shared by consecutive chunks
+
+    Returns:
+        List of chunks covering the whole content
+    """
+    lines = content.splitlines(keepends=True)
+    if len(lines) <= max_lines:
+        return [Chunk(start_line=1, end_line=max(len(lines), 1), text=content)]
+
+    overlap = max(0, min(overlap, max_lines - 1))
+    chunks = []
+    start = 0
+    while start < len(lines):
+        end = min(start + max_lines, len(lines))
+
+        # Prefer ending the window right before a top-level statement
+        if end < len(lines):
+            for candidate in range(end, start + max_lines // 2, -1):
+                if _is_top_level(lines[candidate]):
+                    end = candidate
+                    break
+
+        chunks.append(Chunk(start_line=start + 1, end_line=end, text="".join(lines[start:end])))
+        if end >= len(lines):
+            break
+        start = max(end - overlap, start + 1)
+
+    return chunks
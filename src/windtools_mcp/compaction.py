@@ -0,0 +1,149 @@
+import logging
+import os
+import os.path
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .vector_store import VectorCollection, VectorStore
+
+# Number of stored vectors used as queries to measure the query latency of a collection
+LATENCY_SAMPLE_QUERIES = 20
+
+# Number of neighbours fetched by each latency query
+LATENCY_RESULTS = 10
+
+# Number of records copied per page when rebuilding a collection
+COPY_PAGE_SIZE = 1000
+
+
+def get_directory_size(path: str) -> int:
+    """
+    Get the total size of the files under a directory
+
+    Args:
+        path: Absolute path of the directory
+
+    Returns:
+        Size in bytes
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                # Files can disappear while the database is being written
+                continue
+    return total
+
+
+def sample_query_embeddings(collection: VectorCollection, count: int = LATENCY_SAMPLE_QUERIES) -> List[List[float]]:
+    """
+    Take stored vectors of a collection to use as latency queries
+
+    Args:
+        collection: Collection to sample
+        count: Maximum number of vectors
+
+    Returns:
+        List of vectors
+    """
+    embeddings = collection.get(include=["embeddings"], limit=count)["embeddings"]
+    return [list(map(float, embedding)) for embedding in (embeddings if embeddings is not None else [])]
+
+
+def measure_query_latency(collection: VectorCollection, query_embeddings: List[List[float]]) -> Optional[float]:
+    """
+    Measure the median latency of nearest neighbour queries against a collection
+
+    Args:
+        collection: Collection to query
+        query_embeddings: Query vectors, each one timed as a separate query
+
+    Returns:
+        Median latency in milliseconds, or None if there is nothing to query
+    """
+    n_results = min(LATENCY_RESULTS, collection.count())
+    if not query_embeddings or n_results == 0:
+        return None
+
+    # The first query loads the index, keep it out of the measure
+    collection.query(query_embeddings=query_embeddings[:1], n_results=n_results, include=["distances"])
+    latencies = []
+    for embedding in query_embeddings:
+        start_time = time.perf_counter()
+        collection.query(query_embeddings=[embedding], n_results=n_results, include=["distances"])
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    return statistics.median(latencies)
+
+
+def recover_rebuild(store: VectorStore, name: str):
+    """
+    Clean up after a rebuild of a collection that was interrupted, leaving the collection under its name
+
+    A copy that never got renamed is deleted. If the rebuild stopped between the two renames, the copy was
+    complete and takes the name of the collection; an old collection left next to the collection is deleted.
+
+    Args:
+        store: Vector store of the collection
+        name: Name of the collection
+    """
+    names = set(store.list_collections())
+    staged_name, old_name = f"{name}_new", f"{name}_old"
+    if name not in names and old_name in names:
+        restored_name = staged_name if staged_name in names else old_name
+        logging.warning(f"Finishing the interrupted rebuild of {name} from {restored_name}")
+        store.get_collection(restored_name).modify(name=name)
+        names = set(store.list_collections())
+    for leftover_name in (staged_name, old_name):
+        if leftover_name in names:
+            logging.warning(f"Deleting {leftover_name}, left over by an interrupted rebuild of {name}")
+            store.delete_collection(leftover_name)
+
+
+def rebuild_collection(
+    store: VectorStore,
+    collection: VectorCollection,
+    metadata: Optional[Dict[str, Any]] = None,
+    embedding_function: Optional[Callable[[List[str]], Any]] = None,
+) -> VectorCollection:
+    """
+    Rebuild a collection from its live records, dropping what deleted records left in its index
+
+    The records are copied into a new collection, which then takes the name of the old one. The old
+    collection is renamed before it is deleted, so that the records stay under one of the two names
+    if the rebuild is interrupted; recover_rebuild puts them back under the name of the collection.
+
+    Args:
+        store: Vector store of the collection
+        collection: Collection to rebuild
+        metadata: Metadata of the new collection, with the HNSW parameters of its index; the metadata of the
+            old collection if not given
+        embedding_function: Embedding function of the new collection
+
+    Returns:
+        The new collection
+    """
+    name = collection.name
+    recover_rebuild(store, name)
+    rebuilt = store.create_collection(
+        name=f"{name}_new", metadata=metadata or collection.metadata, embedding_function=embedding_function
+    )
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=COPY_PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            break
+        rebuilt.add(
+            ids=page["ids"], embeddings=page["embeddings"], documents=page["documents"], metadatas=page["metadatas"]
+        )
+        offset += len(page["ids"])
+        if len(page["ids"]) < COPY_PAGE_SIZE:
+            break
+
+    logging.info(f"Copied {offset} records of {name}, replacing the collection")
+    collection.modify(name=f"{name}_old")
+    rebuilt.modify(name=name)
+    store.delete_collection(f"{name}_old")
+    return rebuilt
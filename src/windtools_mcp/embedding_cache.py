@@ -0,0 +1,236 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Content-addressed on-disk cache of embeddings.
+
+    Vectors are stored as raw float32 bytes in a SQLite database, keyed by the embedding model
+    and the hash of the embedded text, so identical content is only embedded once no matter
+    which repository, branch or file it comes from. When the cache grows over its size limit
+    the least recently used vectors are evicted.
+    """
+
+    def __init__(self, cache_folder: str, model_name: str, max_bytes: int):
+        os.makedirs(cache_folder, exist_ok=True)
+        self.path = os.path.join(cache_folder, "embeddings.sqlite3")
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, content_hash)
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+        # Running size of the stored vectors, so that writes do not scan the table to check the size limit
+        self._total_bytes = self._get_total_bytes()
+
+    def _get_total_bytes(self) -> int:
+        return self._connection.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, content_hashes: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up the cached vectors of several contents
+
+        Args:
+            content_hashes: Hashes of the embedded texts
+
+        Returns:
+            Dictionary of the cached vectors by content hash, missing hashes are left out
+        """
+        unique_hashes = list(dict.fromkeys(content_hashes))
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's limit on the number of query parameters
+            for start in range(0, len(unique_hashes), 500):
+                page = unique_hashes[start : start + 500]
+                placeholders = ",".join("?" * len(page))
+                rows = self._connection.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model = ? AND content_hash IN ({placeholders})",
+                    [self.model_name, *page],
+                ).fetchall()
+                found.update((content_hash, np.frombuffer(vector, dtype=np.float32)) for content_hash, vector in rows)
+
+            if found:
+                self._connection.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND content_hash = ?",
+                    [(time.time(), self.model_name, content_hash) for content_hash in found],
+                )
+                self._connection.commit()
+
+            self.hits += len(found)
+            self.misses += len(unique_hashes) - len(found)
+        return found
+
+    def put_many(self, vectors: Dict[str, Any]):
+        """
+        Store vectors in the cache and evict the least recently used ones if it grew too large
+
+        Args:
+            vectors: Dictionary of vectors by content hash
+        """
+        if not vectors:
+            return
+
+        now = time.time()
+        rows = [
+            (self.model_name, content_hash, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for content_hash, vector in vectors.items()
+        ]
+        with self._lock:
+            content_hashes = list(vectors)
+            replaced_bytes = 0
+            for start in range(0, len(content_hashes), 500):
+                page = content_hashes[start : start + 500]
+                placeholders = ",".join("?" * len(page))
+                replaced_bytes += self._connection.execute(
+                    "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings "
+                    f"WHERE model = ? AND content_hash IN ({placeholders})",
+                    [self.model_name, *page],
+                ).fetchone()[0]
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, content_hash, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._connection.commit()
+            self._total_bytes += sum(len(row[2]) for row in rows) - replaced_bytes
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete the least recently used vectors until the cache is back under its size limit"""
+        # Other processes sharing the cache file also write to it, start from the actual size
+        total_bytes = self._get_total_bytes()
+        if total_bytes <= self.max_bytes:
+            self._total_bytes = total_bytes
+            return
+
+        # Make some room below the limit so that eviction does not run on every write
+        target_bytes = int(self.max_bytes * 0.9)
+        evicted = 0
+        rows = self._connection.execute("SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used")
+        to_delete = []
+        for rowid, size in rows:
+            if total_bytes <= target_bytes:
+                break
+            to_delete.append((rowid,))
+            total_bytes -= size
+            evicted += 1
+
+        self._connection.executemany("DELETE FROM embeddings WHERE rowid = ?", to_delete)
+        self._connection.commit()
+        self._total_bytes = total_bytes
+        logging.info(f"Evicted {evicted} vectors from the embedding cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the cache
+
+        Returns:
+            Dictionary with the number of vectors, their size and the hit/miss counters
+        """
+        with self._lock:
+            count, total_bytes = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+        return {
+            "vectors": count,
+            "size_bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize the whitespace of a search query, which does not change what it means"""
+    return " ".join(query.split())
+
+
+class QueryEmbeddingCache:
+    """
+    In-memory LRU cache of search query embeddings.
+
+    Agents repeat the same queries within a session, and embedding a query runs a full
+    forward pass of the model. Vectors are keyed by the embedding model and the normalized
+    query text, and the least recently used ones are evicted past max_entries.
+    """
+
+    def __init__(self, model_name: str, max_entries: int):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._vectors: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+
+    def get(self, query: str) -> Optional[List[float]]:
+        """
+        Look up the cached vector of a query
+
+        Args:
+            query: Search query
+
+        Returns:
+            The vector of the query, or None if it is not cached
+        """
+        key = (self.model_name, normalize_query(query))
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._vectors.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, query: str, vector: List[float]):
+        """
+        Cache the vector of a query, evicting the least recently used vectors over the size limit
+
+        Args:
+            query: Search query
+            vector: Embedding of the query
+        """
+        key = (self.model_name, normalize_query(query))
+        with self._lock:
+            self._vectors[key] = vector
+            self._vectors.move_to_end(key)
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the cache
+
+        Returns:
+            Dictionary with the number of vectors, the size limit and the hit/miss counters
+        """
+        with self._lock:
+            vectors = len(self._vectors)
+        return {"vectors": vectors, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,114 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+# Embedding function of the current worker process, created once by the pool initializer
+_worker_embedding_function: Optional[Callable[[List[str]], Any]] = None
+
+
+def create_sentence_transformer(model_name: str, cache_folder: str) -> Callable[[List[str]], Any]:
+    """
+    Load a sentence transformer embedding function, in a worker process
+
+    Args:
+        model_name: Name or path of the sentence transformer model
+        cache_folder: Folder where the model is cached
+
+    Returns:
+        The embedding function
+    """
+    from chromadb.utils import embedding_functions
+
+    return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name, cache_folder=cache_folder)
+
+
+def _initialize_worker(embedding_function_factory: Callable[[], Callable[[List[str]], Any]], num_threads: int):
+    """Load the model copy of a worker process, limiting its threads so that workers don't oversubscribe the CPU"""
+    global _worker_embedding_function
+    try:
+        import torch
+
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+    _worker_embedding_function = embedding_function_factory()
+
+
+def _embed_in_worker(documents: List[str]) -> Tuple[str, Tuple[int, ...]]:
+    """Embed documents in a worker process and hand the vectors back through a shared memory block"""
+    vectors = np.asarray(_worker_embedding_function(documents), dtype=np.float32)
+    block = shared_memory.SharedMemory(create=True, size=max(vectors.nbytes, 1))
+    try:
+        np.ndarray(vectors.shape, dtype=np.float32, buffer=block.buf)[:] = vectors
+        return block.name, vectors.shape
+    finally:
+        # The parent process unlinks the block once it has copied the vectors
+        block.close()
+
+
+def _read_shared_vectors(name: str, shape: Tuple[int, ...]) -> np.ndarray:
+    """Copy vectors out of a shared memory block written by a worker and free the block"""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.float32, buffer=block.buf).copy()
+    finally:
+        block.close()
+        block.unlink()
+
+
+class EmbeddingWorkerPool:
+    """
+    Pool of embedding worker processes, each with its own copy of the model.
+
+    Each model call goes whole to one worker, so that the cost of handing documents and vectors
+    between processes stays small next to the model call. Callers keep the workers busy by
+    submitting several calls before waiting for their vectors, which come back through shared
+    memory rather than being pickled.
+    """
+
+    def __init__(self, embedding_function_factory: Callable[[], Callable[[List[str]], Any]], processes: int):
+        self.processes = processes
+        # Spawn rather than fork, forking a process that already runs model threads is unsafe
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initialize_worker,
+            initargs=(embedding_function_factory, max((os.cpu_count() or 1) // processes, 1)),
+        )
+        logging.info(f"Started {processes} embedding worker processes")
+
+    def submit(self, input: List[str]) -> Future:
+        """
+        Start embedding documents in the next free worker
+
+        Args:
+            input: Documents to embed with one model call
+
+        Returns:
+            Future of the vectors, in the order of the documents
+        """
+        result = Future()
+
+        def read_vectors(future: Future):
+            # Runs as soon as the worker is done, so that the shared memory block is freed even if nobody waits
+            try:
+                name, shape = future.result()
+                result.set_result(list(_read_shared_vectors(name, shape)))
+            except BaseException as e:
+                result.set_exception(e)
+
+        self._executor.submit(_embed_in_worker, input).add_done_callback(read_vectors)
+        return result
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        if not input:
+            return []
+        return self.submit(input).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
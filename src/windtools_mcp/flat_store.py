@@ -0,0 +1,618 @@
+import io
+import json
+import logging
+import os
+import os.path
+import shutil
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .hnsw_config import from_collection_metadata
+from .quantization import FLAT_STORE_QUANTIZATIONS, binarize, hamming_distances
+from .vector_store import VectorCollection, VectorStore
+
+# Data types the vectors can be stored as, float16 halves the matrix at a small cost in precision
+FLAT_STORE_DTYPES = ("float32", "float16")
+
+# Number of rows converted to float32 at a time when a query is scored against the matrix
+QUERY_BLOCK_ROWS = 65536
+
+# Number of IDs per SQL query, well below SQLite's limit on the number of query parameters
+ID_PAGE_SIZE = 500
+
+# Files of the folder of a collection
+VECTORS_FILE = "vectors.npy"
+RECORDS_FILE = "records.sqlite3"
+COLLECTION_FILE = "collection.json"
+
+# Metadata fields stored as columns of the records table, so that the filters of the index pipeline use an index
+_FILTER_COLUMNS = ("file_path", "chunk_index")
+
+
+def _make_npy_header(rows: int, dimension: int, dtype: np.dtype) -> bytes:
+    """Build the header of a .npy file holding a matrix of the given shape"""
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header,
+        {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (rows, dimension)},
+    )
+    return header.getvalue()
+
+
+def _where_to_sql(where: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """
+    Translate a ChromaDB metadata filter to an SQL condition on the records table
+
+    Only the filters used by the server are supported: equality and $in on the file path and chunk index,
+    combined with $and.
+    """
+    if not where:
+        return "1", []
+    if len(where) > 1:
+        return _where_to_sql({"$and": [{field: condition} for field, condition in where.items()]})
+
+    [(field, condition)] = where.items()
+    if field == "$and":
+        conditions = [_where_to_sql(part) for part in condition]
+        return " AND ".join(f"({sql})" for sql, _ in conditions), [p for _, params in conditions for p in params]
+    if field not in _FILTER_COLUMNS:
+        raise ValueError(f"Unsupported filter field: {field}, expected one of {', '.join(_FILTER_COLUMNS)}")
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    [(operator, value)] = condition.items()
+    if operator == "$eq":
+        return f"{field} = ?", [value]
+    if operator == "$in":
+        return (f"{field} IN ({','.join('?' * len(value))})", list(value)) if value else ("0", [])
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+
+class FlatVectorCollection(VectorCollection):
+    """
+    Collection of vectors in a memory-mapped .npy matrix, with their IDs, documents and metadata in a
+    SQLite table, searched exactly with a matrix-vector product or, with binary quantization, among
+    candidates found on binary codes.
+
+    Writes append rows to the matrix; replaced and deleted rows are masked out of searches, and dropped
+    when the collection is rebuilt with compact_index.
+    """
+
+    def __init__(self, store: "FlatVectorStore", folder: str, name: str, metadata: Optional[Dict[str, Any]]):
+        self._store = store
+        self.folder = folder
+        self._name = name
+        self._metadata = metadata
+        self._lock = threading.RLock()
+        self._connection = None
+        self._matrix = None
+        self._alive = None
+        self._squared_norms = None
+        self._codes = None
+        self._open()
+
+    def _open(self):
+        self._connection = sqlite3.connect(os.path.join(self.folder, RECORDS_FILE), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL,
+                file_path TEXT,
+                chunk_index INTEGER,
+                document TEXT,
+                metadata TEXT
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS records_file_path ON records (file_path, chunk_index)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS records_row ON records (row)")
+        self._connection.commit()
+
+    def _close(self):
+        self._connection.close()
+        self._matrix = None
+        self._codes = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def metadata(self) -> Optional[Dict[str, Any]]:
+        return self._metadata
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.folder, VECTORS_FILE)
+
+    def _get_matrix(self) -> Optional[np.ndarray]:
+        """Map the matrix in memory, pages are shared with the other processes through the page cache"""
+        if self._matrix is None and os.path.exists(self._vectors_path):
+            self._matrix = np.load(self._vectors_path, mmap_mode="r")
+        return self._matrix
+
+    def _get_alive(self) -> np.ndarray:
+        """Get the mask of the rows of the matrix holding a live record"""
+        if self._alive is None:
+            matrix = self._get_matrix()
+            self._alive = np.zeros(0 if matrix is None else matrix.shape[0], dtype=bool)
+            rows = [row for (row,) in self._connection.execute("SELECT row FROM records")]
+            self._alive[rows] = True
+        return self._alive
+
+    def _get_squared_norms(self) -> np.ndarray:
+        """Get the squared norm of every row of the matrix"""
+        if self._squared_norms is None:
+            self._squared_norms = self._compute_squared_norms(self._get_matrix())
+        return self._squared_norms
+
+    def _get_codes(self) -> np.ndarray:
+        """Get the binary code of every row, held in memory while the full-precision rows stay on disk"""
+        if self._codes is None:
+            matrix = self._get_matrix()
+            if matrix is None:
+                return np.zeros((0, 0), dtype=np.uint8)
+            blocks = range(0, matrix.shape[0], QUERY_BLOCK_ROWS)
+            self._codes = np.concatenate([binarize(matrix[start : start + QUERY_BLOCK_ROWS]) for start in blocks])
+        return self._codes
+
+    @staticmethod
+    def _compute_squared_norms(matrix: Optional[np.ndarray]) -> np.ndarray:
+        if matrix is None:
+            return np.zeros(0, dtype=np.float32)
+        squared_norms = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], QUERY_BLOCK_ROWS):
+            block = np.asarray(matrix[start : start + QUERY_BLOCK_ROWS], dtype=np.float32)
+            squared_norms[start : start + len(block)] = np.einsum("ij,ij->i", block, block)
+        return squared_norms
+
+    def _append_vectors(self, embeddings: Any) -> int:
+        """
+        Append vectors to the matrix, rewriting only its header
+
+        Returns:
+            The row of the first appended vector
+        """
+        vectors = np.asarray([np.asarray(embedding, dtype=np.float32) for embedding in embeddings])
+        matrix = self._get_matrix()
+        if matrix is None:
+            first_row = 0
+            with open(self._vectors_path, "wb") as f:
+                f.write(_make_npy_header(len(vectors), vectors.shape[1], self._store.dtype))
+                f.write(vectors.astype(self._store.dtype).tobytes())
+        else:
+            if vectors.shape[1] != matrix.shape[1]:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match the collection dimension {matrix.shape[1]}"
+                )
+            first_row = matrix.shape[0]
+            header = _make_npy_header(first_row + len(vectors), matrix.shape[1], matrix.dtype)
+            # NumPy pads the header so that the number of rows can grow without moving the data
+            if len(header) != matrix.offset:
+                raise ValueError(f"Cannot append to {self._vectors_path}, its header has no room to grow")
+            with open(self._vectors_path, "r+b") as f:
+                # Rows written by an append interrupted before its header are overwritten
+                f.seek(matrix.offset + matrix.nbytes)
+                f.write(vectors.astype(matrix.dtype).tobytes())
+                f.truncate()
+                f.flush()
+                f.seek(0)
+                f.write(header)
+
+        self._matrix = None
+        if self._alive is not None:
+            self._alive = np.concatenate([self._alive, np.zeros(len(vectors), dtype=bool)])
+        if self._squared_norms is not None:
+            stored = vectors.astype(self._get_matrix().dtype).astype(np.float32)
+            self._squared_norms = np.concatenate([self._squared_norms, np.einsum("ij,ij->i", stored, stored)])
+        if self._codes is not None:
+            self._codes = np.concatenate([self._codes, binarize(vectors)])
+        return first_row
+
+    def _select(
+        self,
+        columns: str,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+    ) -> List[tuple]:
+        """Select records by ID or by metadata filter, in row order"""
+        if ids is not None:
+            rows = []
+            for start in range(0, len(ids), ID_PAGE_SIZE):
+                page = ids[start : start + ID_PAGE_SIZE]
+                condition, parameters = _where_to_sql(where)
+                rows.extend(
+                    self._connection.execute(
+                        f"SELECT row, {columns} FROM records WHERE id IN ({','.join('?' * len(page))}) AND {condition}",
+                        [*page, *parameters],
+                    )
+                )
+            rows.sort()
+            return rows[offset or 0 :][:limit] if limit is not None else rows[offset or 0 :]
+
+        condition, parameters = _where_to_sql(where)
+        return list(
+            self._connection.execute(
+                f"SELECT row, {columns} FROM records WHERE {condition} ORDER BY row LIMIT ? OFFSET ?",
+                [*parameters, -1 if limit is None else limit, offset or 0],
+            )
+        )
+
+    def _read_vectors(self, rows: List[int]) -> np.ndarray:
+        matrix = self._get_matrix()
+        if matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.asarray(matrix[rows], dtype=np.float32)
+
+    def count(self) -> int:
+        """Get the number of records"""
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: Any = None,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ):
+        """
+        Insert records, replacing the ones with the same IDs
+
+        Args:
+            ids: IDs of the records
+            embeddings: Vectors of the records
+            documents: Documents of the records
+            metadatas: Metadata of the records
+        """
+        if embeddings is None:
+            raise ValueError("The flat vector store needs the embeddings of the records")
+        if len(ids) == 0:
+            return
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+
+        with self._lock:
+            first_row = self._append_vectors(embeddings)
+            replaced_rows = [row for row, _ in self._select("id", ids=list(ids))]
+            # The last occurrence of an ID wins, as with ChromaDB
+            last_index = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        chunk_id,
+                        first_row + i,
+                        (metadatas[i] or {}).get("file_path"),
+                        (metadatas[i] or {}).get("chunk_index"),
+                        documents[i],
+                        json.dumps(metadatas[i]) if metadatas[i] is not None else None,
+                    )
+                    for chunk_id, i in last_index.items()
+                ],
+            )
+            self._connection.commit()
+            alive = self._get_alive()
+            alive[replaced_rows] = False
+            alive[[first_row + i for i in last_index.values()]] = True
+
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        """
+        Update the metadata of records, keeping the fields not given and removing the ones set to None
+
+        Args:
+            ids: IDs of the records
+            metadatas: Metadata fields to update, for each record
+        """
+        updates = dict(zip(ids, metadatas))
+        with self._lock:
+            rows = self._select("id, metadata", ids=list(updates))
+            values = []
+            for _, chunk_id, metadata in rows:
+                merged = {**json.loads(metadata or "{}"), **updates[chunk_id]}
+                merged = {key: value for key, value in merged.items() if value is not None}
+                values.append((merged.get("file_path"), merged.get("chunk_index"), json.dumps(merged), chunk_id))
+            self._connection.executemany(
+                "UPDATE records SET file_path = ?, chunk_index = ?, metadata = ? WHERE id = ?", values
+            )
+            self._connection.commit()
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        """
+        Delete records by ID or by metadata filter
+
+        Args:
+            ids: IDs of the records to delete
+            where: Metadata filter of the records to delete
+        """
+        with self._lock:
+            rows = [row for row, _ in self._select("id", ids=list(ids) if ids is not None else None, where=where)]
+            for start in range(0, len(rows), ID_PAGE_SIZE):
+                page = rows[start : start + ID_PAGE_SIZE]
+                self._connection.execute(f"DELETE FROM records WHERE row IN ({','.join('?' * len(page))})", page)
+            self._connection.commit()
+            self._get_alive()[rows] = False
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Get records by ID or by metadata filter, in insertion order
+
+        Args:
+            ids: IDs of the records
+            where: Metadata filter of the records
+            limit: Maximum number of records
+            offset: Number of matching records to skip
+            include: Fields to return among "embeddings", "documents" and "metadatas"
+
+        Returns:
+            Dictionary with the IDs and the included fields of the records, as returned by ChromaDB
+        """
+        include = ["metadatas", "documents"] if include is None else include
+        with self._lock:
+            rows = self._select("id, document, metadata", ids, where, limit, offset)
+            return {
+                "ids": [chunk_id for _, chunk_id, _, _ in rows],
+                "embeddings": self._read_vectors([row for row, _, _, _ in rows]) if "embeddings" in include else None,
+                "documents": [document for _, _, document, _ in rows] if "documents" in include else None,
+                "metadatas": (
+                    [json.loads(metadata) if metadata else None for _, _, _, metadata in rows]
+                    if "metadatas" in include
+                    else None
+                ),
+                "include": include,
+            }
+
+    def _compute_distances(self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Compute the distance from a query to every row, or only to the given rows, in the space of the collection"""
+        if rows is None:
+            matrix = self._get_matrix()
+            dot_products = np.empty(matrix.shape[0], dtype=np.float32)
+            # float16 rows are converted a block at a time, so that the float32 copy stays small
+            for start in range(0, matrix.shape[0], QUERY_BLOCK_ROWS):
+                block = np.asarray(matrix[start : start + QUERY_BLOCK_ROWS], dtype=np.float32)
+                dot_products[start : start + len(block)] = block @ query_embedding
+            squared_norms = self._get_squared_norms()
+        else:
+            vectors = self._read_vectors(rows)
+            dot_products = vectors @ query_embedding
+            squared_norms = np.einsum("ij,ij->i", vectors, vectors)
+
+        # Same distances as ChromaDB's HNSW index, so that relevance scores do not depend on the store
+        space = from_collection_metadata(self.metadata)["space"]
+        if space == "ip":
+            return 1.0 - dot_products
+        if space == "cosine":
+            norms = np.sqrt(squared_norms) * np.linalg.norm(query_embedding)
+            return 1.0 - dot_products / np.maximum(norms, np.finfo(np.float32).tiny)
+        return squared_norms - 2.0 * dot_products + float(query_embedding @ query_embedding)
+
+    def find_nearest(
+        self, query_embedding: Any, k: int, rerank_factor: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the rows of the nearest live records of a query
+
+        Args:
+            query_embedding: Query vector
+            k: Number of rows
+            rerank_factor: If given, the k * rerank_factor rows nearest to the query in Hamming distance between
+                binary codes are the candidates, reranked exactly from the full-precision rows; all the rows are
+                scored exactly otherwise
+
+        Returns:
+            Tuple of the rows, nearest first, and of their distances
+        """
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        with self._lock:
+            alive = self._get_alive()
+            k = min(k, int(alive.sum()))
+            if k == 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+            if rerank_factor is not None and k * rerank_factor < len(alive):
+                hamming = hamming_distances(self._get_codes(), binarize(query_embedding[np.newaxis])[0])
+                hamming[~alive] = np.iinfo(np.int32).max
+                candidates = np.argpartition(hamming, k * rerank_factor - 1)[: k * rerank_factor]
+                # Sorted rows are read from the memory-mapped matrix in file order
+                candidates = np.sort(candidates[alive[candidates]])
+                distances = self._compute_distances(query_embedding, candidates)
+                nearest = np.argsort(distances)[:k]
+                return candidates[nearest], distances[nearest]
+
+            distances = self._compute_distances(query_embedding)
+            distances[~alive] = np.inf
+            nearest = np.argpartition(distances, k - 1)[:k]
+            nearest = nearest[np.argsort(distances[nearest])]
+            return nearest, distances[nearest]
+
+    def query(self, query_embeddings: Any, n_results: int = 10, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Find the nearest records of each query, exactly or among candidates found on binary codes and reranked exactly
+
+        Args:
+            query_embeddings: Query vectors
+            n_results: Number of records per query
+            include: Fields to return among "embeddings", "documents", "metadatas" and "distances"
+
+        Returns:
+            Dictionary with a list of IDs and of each included field per query, as returned by ChromaDB
+        """
+        include = ["metadatas", "documents", "distances"] if include is None else include
+
+        rerank_factor = self._store.rerank_factor if self._store.quantization == "binary" else None
+        results = {"ids": [], "distances": [], "documents": [], "metadatas": [], "embeddings": []}
+        with self._lock:
+            for query_embedding in query_embeddings:
+                rows, distances = self.find_nearest(query_embedding, n_results, rerank_factor=rerank_factor)
+                rows = rows.tolist()
+                records = {
+                    row: (chunk_id, document, metadata)
+                    for row, chunk_id, document, metadata in self._connection.execute(
+                        f"SELECT row, id, document, metadata FROM records WHERE row IN ({','.join('?' * len(rows))})",
+                        rows,
+                    )
+                }
+                results["ids"].append([records[row][0] for row in rows])
+                results["distances"].append(distances.tolist())
+                results["documents"].append([records[row][1] for row in rows])
+                results["metadatas"].append(
+                    [json.loads(records[row][2]) if records[row][2] else None for row in rows]
+                )
+                results["embeddings"].append(self._read_vectors(rows) if rows else np.zeros((0, 0)))
+
+        for field in ("distances", "documents", "metadatas", "embeddings"):
+            if field not in include:
+                results[field] = None
+        results["include"] = include
+        return results
+
+    def modify(self, name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+        """
+        Rename a collection or replace its metadata
+
+        Args:
+            name: New name of the collection
+            metadata: New metadata of the collection
+        """
+        with self._lock:
+            if metadata is not None:
+                self._metadata = metadata
+                self._store._write_collection_file(self.folder, self.name, metadata)
+            if name is not None and name != self.name:
+                self._store._rename_collection(self, name)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the number of records and of rows of the matrix, rows of replaced and deleted records included"""
+        with self._lock:
+            matrix = self._get_matrix()
+            rows = 0 if matrix is None else matrix.shape[0]
+            records = self.count()
+            return {
+                "records": records,
+                "rows": rows,
+                "dead_rows": rows - records,
+                "dimension": None if matrix is None else matrix.shape[1],
+                "dtype": str(self._store.dtype if matrix is None else matrix.dtype),
+                "quantization": self._store.quantization,
+                "vector_bytes": 0 if matrix is None else matrix.nbytes,
+                "code_bytes": 0 if matrix is None else rows * ((matrix.shape[1] + 7) // 8),
+            }
+
+
+class FlatVectorStore(VectorStore):
+    """
+    Store of flat collections, one folder per collection.
+
+    Selected with VECTOR_STORE=flat. On small and medium repositories a search scanning every vector is
+    faster than ChromaDB's HNSW and SQLite overhead, cold starts only map the matrices in memory, and
+    results are exact.
+
+    On large repositories, binary quantization keeps one bit per dimension of every vector in memory:
+    a search takes the rerank_factor * n_results rows nearest in Hamming distance, and reranks them
+    with their full-precision rows read from the matrix on disk.
+    """
+
+    backend = "flat"
+
+    def __init__(self, path: str, dtype: str = "float32", quantization: str = "none", rerank_factor: int = 10):
+        if dtype not in FLAT_STORE_DTYPES:
+            raise ValueError(f"Invalid flat store dtype: {dtype}, expected one of {', '.join(FLAT_STORE_DTYPES)}")
+        if quantization not in FLAT_STORE_QUANTIZATIONS:
+            expected = ", ".join(FLAT_STORE_QUANTIZATIONS)
+            raise ValueError(f"Invalid flat store quantization: {quantization}, expected one of {expected}")
+        if rerank_factor < 1:
+            raise ValueError(f"Invalid flat store rerank factor: {rerank_factor}, expected at least 1")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _get_folder(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @staticmethod
+    def _write_collection_file(folder: str, name: str, metadata: Optional[Dict[str, Any]]):
+        temporary_path = os.path.join(folder, f"{COLLECTION_FILE}.tmp")
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({"name": name, "metadata": metadata}, f, indent=2)
+        os.replace(temporary_path, os.path.join(folder, COLLECTION_FILE))
+
+    def _rename_collection(self, collection: FlatVectorCollection, name: str):
+        with self._lock:
+            folder = self._get_folder(name)
+            if os.path.exists(folder):
+                raise ValueError(f"Collection {name} already exists")
+            collection._close()
+            os.rename(collection.folder, folder)
+            self._collections.pop(collection.name, None)
+            collection.folder = folder
+            collection._name = name
+            self._write_collection_file(folder, name, collection.metadata)
+            collection._open()
+            self._collections[name] = collection
+
+    @property
+    def persist_directory(self) -> Optional[str]:
+        return self.path
+
+    def list_collections(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.path) if os.path.exists(os.path.join(self.path, name, COLLECTION_FILE))
+        )
+
+    def get_collection(
+        self, name: str, embedding_function: Optional[Callable[[List[str]], Any]] = None
+    ) -> FlatVectorCollection:
+        # Queries always come with their vectors, the embedding function is not needed
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                folder = self._get_folder(name)
+                try:
+                    with open(os.path.join(folder, COLLECTION_FILE), "r", encoding="utf-8") as f:
+                        metadata = json.load(f)["metadata"]
+                except FileNotFoundError:
+                    raise ValueError(f"Collection {name} does not exist") from None
+                collection = self._collections[name] = FlatVectorCollection(self, folder, name, metadata)
+            return collection
+
+    def create_collection(
+        self,
+        name: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        embedding_function: Optional[Callable[[List[str]], Any]] = None,
+    ) -> FlatVectorCollection:
+        with self._lock:
+            folder = self._get_folder(name)
+            if os.path.exists(os.path.join(folder, COLLECTION_FILE)):
+                raise ValueError(f"Collection {name} already exists")
+            os.makedirs(folder, exist_ok=True)
+            self._write_collection_file(folder, name, metadata)
+            logging.info(f"Created the flat collection {name} in {folder}")
+        return self.get_collection(name, embedding_function=embedding_function)
+
+    def delete_collection(self, name: str):
+        with self._lock:
+            folder = self._get_folder(name)
+            if not os.path.exists(os.path.join(folder, COLLECTION_FILE)):
+                raise ValueError(f"Collection {name} does not exist")
+            collection = self._collections.pop(name, None)
+            if collection is not None:
+                collection._close()
+            shutil.rmtree(folder)
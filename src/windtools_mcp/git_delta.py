@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import os.path
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+
+@dataclass
+class GitDelta:
+    """Files to re-index and to delete in a git work tree since the commit it was indexed at"""
+
+    changed: Set[str] = field(default_factory=set)
+    deleted: Set[str] = field(default_factory=set)
+
+
+def _run_git(directory: str, args: List[str]) -> Optional[str]:
+    """Run a git command in a directory and return its output, or None if it failed"""
+    try:
+        result = subprocess.run(
+            ["git", "-C", directory, *args], capture_output=True, text=True, check=False, timeout=60
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.info(f"Could not run git in {directory}: {str(e)}")
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def get_head_commit(directory: str) -> Optional[str]:
+    """
+    Get the commit checked out in the git work tree containing a directory
+
+    Args:
+        directory: Absolute path to a directory
+
+    Returns:
+        The commit hash, or None if the directory is not in a git work tree with at least one commit
+    """
+    output = _run_git(directory, ["rev-parse", "--verify", "HEAD"])
+    return output.strip() if output else None
+
+
+def _get_work_tree_root(directory: str) -> Optional[str]:
+    output = _run_git(directory, ["rev-parse", "--show-toplevel"])
+    return os.path.realpath(output.strip()) if output else None
+
+
+def _to_directory_path(root: str, directory: str, relative_path: str) -> str:
+    """Convert a path relative to the work tree root into an absolute path under the indexed directory"""
+    real_directory = os.path.realpath(directory)
+    absolute_path = os.path.join(root, relative_path)
+    # Keep the spelling of the indexed directory so that paths match the ones stored by the walk
+    return os.path.join(directory, os.path.relpath(absolute_path, real_directory))
+
+
+def list_dirty_files(directory: str) -> Optional[Set[str]]:
+    """
+    List the modified, added, deleted and untracked files of a directory in a git work tree
+
+    Args:
+        directory: Absolute path to a directory in a git work tree
+
+    Returns:
+        Set of absolute file paths, or None if git status failed
+    """
+    root = _get_work_tree_root(directory)
+    output = _run_git(directory, ["status", "--porcelain=v1", "-z", "--untracked-files=all", "--", "."])
+    if root is None or output is None:
+        return None
+
+    dirty = set()
+    entries = output.split("\0")
+    i = 0
+    while i < len(entries):
+        entry = entries[i]
+        i += 1
+        if len(entry) < 4:
+            continue
+        status, relative_path = entry[:2], entry[3:]
+        dirty.add(_to_directory_path(root, directory, relative_path))
+        # Renames and copies are followed by their original path
+        if "R" in status or "C" in status:
+            if i < len(entries) and entries[i]:
+                dirty.add(_to_directory_path(root, directory, entries[i]))
+            i += 1
+    return dirty
+
+
+def get_git_delta(
+    directory: str, since_commit: str, previously_dirty: List[str], currently_dirty: Set[str]
+) -> Optional[GitDelta]:
+    """
+    Find the files of a directory that changed since it was indexed at a given commit.
+
+    Combines the files changed between the commit and HEAD, the files currently modified or
+    untracked, and the files that were dirty when the directory was indexed (in case their
+    changes have been reverted since).
+
+    Args:
+        directory: Absolute path to a directory in a git work tree
+        since_commit: Commit the directory was indexed at
+        previously_dirty: Files that were dirty when the directory was indexed
+        currently_dirty: Files that are dirty now, as returned by list_dirty_files
+
+    Returns:
+        The files to re-index and to delete, or None if the delta can't be computed with git
+    """
+    root = _get_work_tree_root(directory)
+    if root is None:
+        return None
+
+    output = _run_git(directory, ["diff", "--name-only", "-z", "--no-renames", since_commit, "HEAD", "--", "."])
+    if output is None:
+        return None
+    candidates = {_to_directory_path(root, directory, path) for path in output.split("\0") if path}
+    candidates |= currently_dirty
+    candidates.update(previously_dirty)
+
+    delta = GitDelta()
+    for path in candidates:
+        if os.path.isfile(path):
+            delta.changed.add(path)
+        else:
+            delta.deleted.add(path)
+    return delta
+
+
+class GitStateStore:
+    """
+    Records the commit each directory was indexed at, per collection, in a small JSON file.
+
+    Only directories indexed without errors are recorded, so that a failed run is retried in
+    full by the next one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable git index state {self.path}: {str(e)}")
+            return {}
+
+    def get(self, collection_name: str, directory: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the recorded state of a directory
+
+        Args:
+            collection_name: Name of the collection the directory was indexed into
+            directory: Absolute path of the indexed directory
+
+        Returns:
+            Dictionary with the commit and the dirty files at indexing time, or None if not recorded
+        """
+        with self._lock:
+            return self._load().get(collection_name, {}).get(directory)
+
+    def set(self, collection_name: str, directory: str, commit: str, dirty_files: Set[str]):
+        """
+        Record the commit a directory was indexed at
+
+        Args:
+            collection_name: Name of the collection the directory was indexed into
+            directory: Absolute path of the indexed directory
+            commit: Commit checked out when the directory was indexed
+            dirty_files: Files that were modified or untracked when the directory was indexed
+        """
+        with self._lock:
+            state = self._load()
+            state.setdefault(collection_name, {})[directory] = {"commit": commit, "dirty": sorted(dirty_files)}
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(temporary_path, self.path)
+
+    def delete(self, collection_name: str):
+        """
+        Forget the recorded states of every directory indexed into a collection, so that they are walked again
+
+        Args:
+            collection_name: Name of the collection
+        """
+        with self._lock:
+            state = self._load()
+            if state.pop(collection_name, None) is None:
+                return
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(temporary_path, self.path)
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import os.path
+import threading
+from typing import Any, Dict, Optional
+
+# HNSW parameters of a collection, with ChromaDB's defaults
+HNSW_DEFAULTS = {
+    "space": "l2",
+    "M": 16,
+    "construction_ef": 100,
+    "search_ef": 100,
+    "batch_size": 100,
+    "sync_threshold": 1000,
+}
+
+# Distance functions supported by ChromaDB
+HNSW_SPACES = ("l2", "cosine", "ip")
+
+
+def validate_hnsw_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Check HNSW parameters and convert them to their types, e.g. when read from environment variables
+
+    Args:
+        config: Values by parameter name, a subset of HNSW_DEFAULTS
+
+    Returns:
+        The converted values
+
+    Raises:
+        ValueError: If a parameter is unknown or has an invalid value
+    """
+    validated = {}
+    for name, value in config.items():
+        if name not in HNSW_DEFAULTS:
+            raise ValueError(f"Unknown HNSW parameter: {name}, expected one of {', '.join(HNSW_DEFAULTS)}")
+        if name == "space":
+            if value not in HNSW_SPACES:
+                raise ValueError(f"Invalid HNSW space: {value}, expected one of {', '.join(HNSW_SPACES)}")
+            validated[name] = value
+            continue
+        try:
+            validated[name] = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid HNSW {name}: {value}, expected an integer") from None
+        # ChromaDB flushes batches and syncs the index to disk in steps of more than 2 vectors
+        minimum = 3 if name in ("batch_size", "sync_threshold") else 1
+        if validated[name] < minimum:
+            raise ValueError(f"Invalid HNSW {name}: {value}, expected at least {minimum}")
+    return validated
+
+
+def to_collection_metadata(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert HNSW parameters to the metadata ChromaDB creates the index of a collection with
+
+    Args:
+        config: Values by parameter name
+
+    Returns:
+        Collection metadata with "hnsw:" keys
+    """
+    return {f"hnsw:{name}": value for name, value in config.items()}
+
+
+def from_collection_metadata(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Get the HNSW parameters a collection was created with
+
+    Args:
+        metadata: Metadata of the collection, or None
+
+    Returns:
+        Values by parameter name, ChromaDB's defaults for the ones not set
+    """
+    metadata = metadata or {}
+    return {name: metadata.get(f"hnsw:{name}", default) for name, default in HNSW_DEFAULTS.items()}
+
+
+class HnswConfigStore:
+    """
+    HNSW parameters set at runtime with the configure_index tool, in a small JSON file.
+
+    They take precedence over the environment variables, and apply to the collections created
+    after they are set, since ChromaDB builds the index of a collection once, when it is created.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Get the parameters set at runtime
+
+        Returns:
+            Values by parameter name
+        """
+        with self._lock:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    return validate_hnsw_config(json.load(f))
+            except FileNotFoundError:
+                return {}
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring invalid HNSW configuration {self.path}: {str(e)}")
+                return {}
+
+    def update(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Set parameters, keeping the ones set before
+
+        Args:
+            config: Values by parameter name
+
+        Returns:
+            Every parameter set at runtime
+        """
+        config = validate_hnsw_config(config)
+        stored = self.load()
+        with self._lock:
+            stored.update(config)
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump(stored, f, indent=2)
+            os.replace(temporary_path, self.path)
+        return stored
@@ -0,0 +1,241 @@
+import logging
+import os
+import os.path
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+# Directories that never contain code worth indexing: version control, dependency and tool cache directories.
+# Generic names like build or dist can be real source trees, they are left to .gitignore or INDEX_EXCLUDE_DIRS.
+DEFAULT_EXCLUDED_DIRECTORIES = [
+    ".git",
+    ".hg",
+    ".svn",
+    "node_modules",
+    "bower_components",
+    ".venv",
+    "__pycache__",
+    ".mypy_cache",
+    ".pytest_cache",
+    ".ruff_cache",
+    ".tox",
+    ".nox",
+    ".idea",
+    ".gradle",
+    ".next",
+    ".nuxt",
+]
+
+# Files holding gitignore-style rules, read in every directory of the walk
+IGNORE_FILE_NAMES = (".gitignore", ".ignore")
+
+
+@dataclass
+class IgnoreRule:
+    """A compiled gitignore pattern"""
+
+    regex: Pattern[str]
+    negate: bool
+    directory_only: bool
+
+
+def _glob_to_regex(glob: str) -> str:
+    """Translate the glob syntax of a gitignore pattern into a regular expression"""
+    regex = ""
+    i = 0
+    while i < len(glob):
+        char = glob[i]
+        if glob.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif glob.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif char == "*":
+            regex += "[^/]*"
+            i += 1
+        elif char == "?":
+            regex += "[^/]"
+            i += 1
+        elif char == "[":
+            end = glob.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(char)
+                i += 1
+            else:
+                content = glob[i + 1 : end]
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                regex += f"[{content}]"
+                i = end + 1
+        elif char == "\\" and i + 1 < len(glob):
+            regex += re.escape(glob[i + 1])
+            i += 2
+        else:
+            regex += re.escape(char)
+            i += 1
+    return regex
+
+
+def compile_ignore_pattern(pattern: str) -> Optional[IgnoreRule]:
+    """
+    Compile one line of a gitignore file
+
+    Args:
+        pattern: Line of the ignore file
+
+    Returns:
+        The compiled rule, matching paths relative to the directory of the ignore file, or None for blank
+        lines and comments
+    """
+    pattern = pattern.rstrip("\n").rstrip("\r")
+    if not pattern.strip() or pattern.startswith("#"):
+        return None
+
+    # Trailing spaces are ignored unless escaped
+    if not pattern.endswith("\\ "):
+        pattern = pattern.rstrip(" ")
+
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+        pattern = pattern[1:]
+
+    directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+
+    # A pattern with a slash anywhere but at the end is relative to the ignore file directory
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    prefix = "^" if anchored else "^(?:.*/)?"
+    return IgnoreRule(
+        regex=re.compile(prefix + _glob_to_regex(pattern) + "$"), negate=negate, directory_only=directory_only
+    )
+
+
+class IgnoreRules:
+    """
+    Decides which files and directories the index walk skips.
+
+    Combines a list of excluded directory names with the .gitignore and .ignore files found
+    between the top of the repository (or the indexed directory when it is not in one) and
+    each path. Ignore files are read and compiled once per directory and cached.
+    """
+
+    def __init__(self, excluded_directories: Iterable[str] = DEFAULT_EXCLUDED_DIRECTORIES):
+        self.excluded_directories = set(excluded_directories)
+        self._rules: Dict[str, List[IgnoreRule]] = {}
+        self._rule_roots: Dict[str, str] = {}
+        self._ignored_directories: Dict[Tuple[str, str], bool] = {}
+
+    def _load_rules(self, directory: str) -> List[IgnoreRule]:
+        """Read and compile the ignore files of a directory"""
+        rules = self._rules.get(directory)
+        if rules is not None:
+            return rules
+
+        rules = []
+        for name in IGNORE_FILE_NAMES:
+            ignore_file = os.path.join(directory, name)
+            if not os.path.isfile(ignore_file):
+                continue
+            try:
+                with open(ignore_file, "r", encoding="utf-8", errors="replace") as f:
+                    rules.extend(rule for rule in map(compile_ignore_pattern, f) if rule is not None)
+            except OSError as e:
+                logging.warning(f"Could not read ignore file {ignore_file}: {str(e)}")
+        self._rules[directory] = rules
+        return rules
+
+    def _find_rule_root(self, directory: str) -> str:
+        """Find the top of the repository containing a directory, or the directory itself outside of one"""
+        rule_root = self._rule_roots.get(directory)
+        if rule_root is not None:
+            return rule_root
+
+        rule_root = directory
+        current = directory
+        while True:
+            if os.path.exists(os.path.join(current, ".git")):
+                rule_root = current
+                break
+            parent = os.path.dirname(current)
+            if parent == current:
+                break
+            current = parent
+        self._rule_roots[directory] = rule_root
+        return rule_root
+
+    def _matches_rules(self, path: str, is_directory: bool, rule_root: str) -> bool:
+        """Apply the rules of every directory from the rule root down to the parent of the path"""
+        parent = os.path.dirname(path)
+        relative_parent = os.path.relpath(parent, rule_root)
+        bases = [rule_root]
+        if relative_parent != ".":
+            for part in relative_parent.split(os.sep):
+                bases.append(os.path.join(bases[-1], part))
+
+        ignored = False
+        for base in bases:
+            rules = self._load_rules(base)
+            if not rules:
+                continue
+            relative_path = os.path.relpath(path, base).replace(os.sep, "/")
+            for rule in rules:
+                if rule.directory_only and not is_directory:
+                    continue
+                if rule.regex.match(relative_path):
+                    ignored = not rule.negate
+        return ignored
+
+    def is_ignored(self, path: str, is_directory: bool, top_directory: str) -> bool:
+        """
+        Check if a path met by a walk is ignored. The parent directories are assumed not to be ignored,
+        as the walk would not have entered them otherwise.
+
+        Args:
+            path: Absolute path of the file or directory
+            is_directory: Whether the path is a directory
+            top_directory: Directory the walk started from
+
+        Returns:
+            True if the path should be skipped
+        """
+        if is_directory and os.path.basename(path) in self.excluded_directories:
+            return True
+        return self._matches_rules(path, is_directory, self._find_rule_root(top_directory))
+
+    def is_file_ignored(self, file_path: str, top_directory: Optional[str] = None) -> bool:
+        """
+        Check if a file is ignored, or is inside an ignored directory, without walking to it
+
+        Args:
+            file_path: Absolute path of the file
+            top_directory: Indexed directory containing the file, used to find the ignore files above
+                it when it is not in a git work tree
+
+        Returns:
+            True if the file should be skipped
+        """
+        parent = os.path.dirname(file_path)
+        rule_root = self._find_rule_root(top_directory or parent)
+
+        # Check every directory between the rule root and the file, top down
+        relative_parent = os.path.relpath(parent, rule_root)
+        if relative_parent != ".":
+            current = rule_root
+            for part in relative_parent.split(os.sep):
+                current = os.path.join(current, part)
+                ignored = self._ignored_directories.get((rule_root, current))
+                if ignored is None:
+                    ignored = os.path.basename(current) in self.excluded_directories or self._matches_rules(
+                        current, True, rule_root
+                    )
+                    self._ignored_directories[(rule_root, current)] = ignored
+                if ignored:
+                    return True
+
+        return self._matches_rules(file_path, False, rule_root)
@@ -0,0 +1,1079 @@
+import hashlib
+import itertools
+import logging
+import os
+import os.path
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .chunking import chunk_lines
+from .embedding_workers import EmbeddingWorkerPool
+from .ignore import IgnoreRules
+from .manifest import FileManifest
+
+# Define file extensions considered as code
+CODE_EXTENSIONS = [
+    ".py",
+    ".js",
+    ".ts",
+    ".java",
+    ".cpp",
+    ".c",
+    ".h",
+    ".go",
+    ".rs",
+    ".jsx",
+    ".tsx",
+    ".php",
+    ".rb",
+    ".swift",
+    ".kt",
+    ".scala",
+    ".sh",
+]
+
+# Maximum number of file paths in the $in filter of one query or delete
+FILTER_PAGE_SIZE = 500
+
+# Number of records fetched per page when scanning the collection
+SCAN_PAGE_SIZE = 5000
+
+# Number of bytes read first to tell binary and minified files apart before reading the rest
+SNIFF_BLOCK_SIZE = 8192
+
+# Files smaller than this are never considered minified, a short one-liner is fine to embed
+MINIFIED_MIN_BYTES = 1024
+
+# Reasons for skipping a file without embedding it
+SKIP_TOO_LARGE = "too_large"
+SKIP_BINARY = "binary"
+SKIP_MINIFIED = "minified"
+
+# Marks the end of the stream of items flowing through a pipeline queue
+_END_OF_STREAM = object()
+
+
+def compute_content_hash(data: bytes) -> str:
+    """
+    Compute the content hash stored in the file fingerprint
+
+    Args:
+        data: Raw file content
+
+    Returns:
+        Hex digest of the content
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_stat_unchanged(metadata: Optional[Dict[str, Any]], stat_result: os.stat_result) -> bool:
+    """
+    Check if a file still matches the size, mtime and inode recorded when it was indexed
+
+    Args:
+        metadata: Metadata stored for the indexed document, or None if it is not indexed
+        stat_result: Current stat result of the file
+
+    Returns:
+        True if the size, modification time and inode (when recorded) are the same as when the file was indexed
+    """
+    if not metadata:
+        return False
+    return (
+        metadata.get("file_size") == stat_result.st_size
+        and metadata.get("last_modified") == stat_result.st_mtime
+        and metadata.get("inode", stat_result.st_ino) == stat_result.st_ino
+    )
+
+
+def is_in_directory(path: str, directory: str) -> bool:
+    """Check if a path is inside a directory, at any depth"""
+    return path.startswith(os.path.join(directory, ""))
+
+
+def walk_order_key(path: str, is_directory: bool = False) -> Tuple[Tuple[int, str], ...]:
+    """
+    Sort key following the order of the sorted walk of the indexing pipeline, which yields the files of
+    a directory before entering its subdirectories
+
+    Args:
+        path: Absolute path
+        is_directory: Whether the path is a directory rather than a file
+
+    Returns:
+        The components of the path, files ranked before directories at the same level
+    """
+    *directories, name = path.split(os.sep)
+    return (*((1, directory) for directory in directories), (1 if is_directory else 0, name))
+
+
+def _is_walked_before(directory_key: Tuple[Tuple[int, str], ...], cursor_key: Tuple[Tuple[int, str], ...]) -> bool:
+    """Whether a whole directory comes before the cursor of the walk, with the cursor not inside it"""
+    return directory_key < cursor_key and cursor_key[: len(directory_key)] != directory_key
+
+
+def make_chunk_id(file_path: str, start_line: int, end_line: int) -> str:
+    """
+    Generate the document ID of a chunk of a file
+
+    Args:
+        file_path: Absolute path of the file
+        start_line: First line of the chunk (1-based)
+        end_line: Last line of the chunk (1-based, inclusive)
+
+    Returns:
+        Document ID
+    """
+    return f"file:{file_path}#L{start_line}-{end_line}"
+
+
+def parse_chunk_id(chunk_id: str) -> Optional[str]:
+    """
+    Get the path of the file a chunk belongs to from its document ID
+
+    Args:
+        chunk_id: Document ID generated by make_chunk_id
+
+    Returns:
+        Absolute path of the file, or None if the ID is not a chunk ID
+    """
+    if not chunk_id.startswith("file:") or "#L" not in chunk_id:
+        return None
+    return chunk_id[len("file:") :].rsplit("#L", 1)[0]
+
+
+def _iter_pages(collection: Any, where: Optional[Dict[str, Any]], include: List[str]) -> Iterator[Dict[str, Any]]:
+    """Page through the records of a collection matching a filter"""
+    offset = 0
+    while True:
+        page = collection.get(where=where, include=include, limit=SCAN_PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        if len(page["ids"]) < SCAN_PAGE_SIZE:
+            return
+        offset += len(page["ids"])
+
+
+def _get_file_chunks(collection: Any, file_paths: List[str], include: List[str]) -> Dict[str, List[Any]]:
+    """Get the chunks of files, FILTER_PAGE_SIZE paths per query"""
+    chunks = {"ids": [], "metadatas": []}
+    for start in range(0, len(file_paths), FILTER_PAGE_SIZE):
+        where = {"file_path": {"$in": file_paths[start : start + FILTER_PAGE_SIZE]}}
+        page = collection.get(where=where, include=include)
+        chunks["ids"].extend(page["ids"])
+        if "metadatas" in include:
+            chunks["metadatas"].extend(page["metadatas"])
+    return chunks
+
+
+def _iter_first_chunks(collection: Any, where: Dict[str, Any], include: List[str]) -> Iterator[Dict[str, Any]]:
+    """Page through the first chunk of every indexed file matching a filter"""
+    # Every file has exactly one first chunk, and it carries the fingerprint of the whole file
+    return _iter_pages(collection, {"$and": [{"chunk_index": 0}, where]} if where else {"chunk_index": 0}, include)
+
+
+def iter_indexed_fingerprints(collection: Any, file_paths: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the fingerprints of indexed files page by page, without loading documents or every chunk's metadata
+
+    Args:
+        collection: Collection to scan
+        file_paths: If given, only the fingerprints of these files are fetched
+
+    Returns:
+        Iterator over the metadata of the first chunk of each indexed file
+    """
+    if file_paths is None:
+        filters = [{}]
+    else:
+        file_paths = list(file_paths)
+        filters = [
+            {"file_path": {"$in": file_paths[start : start + FILTER_PAGE_SIZE]}}
+            for start in range(0, len(file_paths), FILTER_PAGE_SIZE)
+        ]
+    for where in filters:
+        for page in _iter_first_chunks(collection, where, ["metadatas"]):
+            yield from (metadata for metadata in page["metadatas"] if metadata and "file_path" in metadata)
+
+
+def iter_indexed_file_paths(collection: Any) -> Iterator[str]:
+    """
+    Stream the paths of indexed files page by page, reading document IDs only
+
+    Args:
+        collection: Collection to scan
+
+    Returns:
+        Iterator over the absolute paths of the indexed files
+    """
+    for page in _iter_first_chunks(collection, {}, []):
+        yield from filter(None, map(parse_chunk_id, page["ids"]))
+
+
+def iter_indexed_chunk_ids(collection: Any) -> Iterator[Tuple[str, str]]:
+    """
+    Stream the IDs of every chunk in the collection page by page, with the path of their file
+
+    Args:
+        collection: Collection to scan
+
+    Returns:
+        Iterator over tuples of chunk ID and absolute file path
+    """
+    for page in _iter_pages(collection, None, []):
+        for chunk_id in page["ids"]:
+            file_path = parse_chunk_id(chunk_id)
+            if file_path is not None:
+                yield chunk_id, file_path
+
+
+def iter_record_file_paths(collection: Any) -> Iterator[str]:
+    """
+    Stream the file path of every record in the collection page by page, whether it is a chunk or a whole-file document
+
+    Args:
+        collection: Collection to scan
+
+    Returns:
+        Iterator over the absolute file path of each record, repeated for every chunk of a file
+    """
+    for page in _iter_pages(collection, None, ["metadatas"]):
+        yield from (metadata["file_path"] for metadata in page["metadatas"] if metadata and "file_path" in metadata)
+
+
+def delete_legacy_documents(collection: Any) -> int:
+    """
+    Delete the whole-file documents indexed before files were split into chunks
+
+    Their IDs have no line range and they have no chunk metadata, so the scans by first chunk and by chunk ID
+    never see them. Once deleted, their files are indexed again as new files.
+
+    Args:
+        collection: Collection to clean up
+
+    Returns:
+        Number of deleted documents
+    """
+    legacy_ids = [
+        doc_id
+        for page in _iter_pages(collection, None, [])
+        for doc_id in page["ids"]
+        if doc_id.startswith("file:") and parse_chunk_id(doc_id) is None
+    ]
+    for start in range(0, len(legacy_ids), FILTER_PAGE_SIZE):
+        collection.delete(ids=legacy_ids[start : start + FILTER_PAGE_SIZE])
+    return len(legacy_ids)
+
+
+def make_index_stats() -> Dict[str, int]:
+    """
+    Create the counters of an indexing run, all at zero
+
+    Returns:
+        Indexing statistics of a run that did nothing
+    """
+    return {
+        "files_scanned": 0,
+        "files_indexed": 0,
+        "files_updated": 0,
+        "files_skipped": 0,
+        "files_too_large": 0,
+        "files_binary": 0,
+        "files_minified": 0,
+        "chunks_indexed": 0,
+        "chunks_from_cache": 0,
+        "embedding_calls": 0,
+        "files_deleted": 0,
+        "directories_pruned": 0,
+        "errors": 0,
+        "total_tokens_processed": 0,
+    }
+
+
+def estimate_tokens(content: str) -> int:
+    """
+    Roughly estimate the number of tokens in a document
+
+    Args:
+        content: Document text
+
+    Returns:
+        Estimated token count
+    """
+    return len(content) // 4
+
+
+def plan_length_sorted_batches(documents: List[str], max_padded_tokens: int) -> List[List[int]]:
+    """
+    Group documents of similar length into model calls under a padded token budget.
+
+    The model pads every document of a call to the longest one, so documents are sorted by
+    length and a call is cut when its document count times the length of its longest
+    document would exceed the budget.
+
+    Args:
+        documents: Documents to embed
+        max_padded_tokens: Maximum estimated number of tokens of a call once padded, 0 for a single call
+
+    Returns:
+        Lists of document indexes, one per model call
+    """
+    if max_padded_tokens <= 0:
+        return [list(range(len(documents)))] if documents else []
+
+    batches = []
+    current = []
+    for index in sorted(range(len(documents)), key=lambda i: len(documents[i])):
+        # Sorted by length, so the current document is the longest of the call
+        padded_length = max(estimate_tokens(documents[index]), 1)
+        if current and (len(current) + 1) * padded_length > max_padded_tokens:
+            batches.append(current)
+            current = []
+        current.append(index)
+    if current:
+        batches.append(current)
+    return batches
+
+
+@dataclass
+class IndexBatch:
+    """
+    Chunks waiting to be embedded and written to the code collection in a single call.
+
+    All the chunks of a file are kept in the same batch, so that the chunks left over from a
+    previous version of the file can be deleted when the batch is written.
+    """
+
+    ids: List[str] = field(default_factory=list)
+    documents: List[str] = field(default_factory=list)
+    metadatas: List[Dict[str, Any]] = field(default_factory=list)
+    file_paths: List[str] = field(default_factory=list)
+    is_update: List[bool] = field(default_factory=list)
+    embeddings: Optional[List[Any]] = None
+    token_count: int = 0
+
+    def add_file(
+        self,
+        file_path: str,
+        is_update: bool,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        token_count: int,
+    ):
+        self.file_paths.append(file_path)
+        self.is_update.append(is_update)
+        self.ids.extend(ids)
+        self.documents.extend(documents)
+        self.metadatas.extend(metadatas)
+        self.token_count += token_count
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+@dataclass
+class FileCandidate:
+    """A code file found by the walk whose fingerprint may have changed since it was indexed"""
+
+    file_path: str
+    file_ext: str
+    stat_result: os.stat_result
+    previous_metadata: Optional[Dict[str, Any]]
+    is_indexed: bool
+
+
+@dataclass
+class FileContent:
+    """A code file read from disk, ready to be compared against its fingerprint and embedded"""
+
+    candidate: FileCandidate
+    content: str
+    content_hash: str
+    skip_reason: Optional[str] = None
+
+
+def is_minified(data: bytes, max_average_line_length: int) -> bool:
+    """
+    Check if content looks minified or generated from the average length of its lines
+
+    Args:
+        data: Raw content, or its first block
+        max_average_line_length: Average line length above which content is considered minified, 0 to disable
+
+    Returns:
+        True if the content should not be embedded
+    """
+    if max_average_line_length <= 0 or len(data) < MINIFIED_MIN_BYTES:
+        return False
+    return len(data) / (data.count(b"\n") + 1) > max_average_line_length
+
+
+def read_candidate(
+    candidate: FileCandidate, max_file_bytes: int = 0, max_average_line_length: int = 0
+) -> FileContent:
+    """
+    Read a candidate file from disk and hash its content.
+
+    Oversized files are skipped from their size alone, and binary and minified files from their
+    first block, so that none of them is ever read into memory in full.
+
+    Args:
+        candidate: File found by the walk
+        max_file_bytes: Size above which files are skipped, 0 to disable
+        max_average_line_length: Average line length above which files are skipped as minified, 0 to disable
+
+    Returns:
+        The decoded content and its hash, or an empty content and the reason if the file is skipped
+    """
+    if 0 < max_file_bytes < candidate.stat_result.st_size:
+        return FileContent(candidate=candidate, content="", content_hash="", skip_reason=SKIP_TOO_LARGE)
+
+    with open(candidate.file_path, "rb") as f:
+        block = f.read(SNIFF_BLOCK_SIZE)
+        skip_reason = None
+        if b"\0" in block:
+            skip_reason = SKIP_BINARY
+        elif is_minified(block, max_average_line_length):
+            skip_reason = SKIP_MINIFIED
+        if skip_reason is not None:
+            return FileContent(candidate=candidate, content="", content_hash="", skip_reason=skip_reason)
+        raw_content = block + f.read()
+    return FileContent(
+        candidate=candidate,
+        content=raw_content.decode("utf-8", errors="replace"),
+        content_hash=compute_content_hash(raw_content),
+    )
+
+
+class IndexPipeline:
+    """
+    Staged indexing pipeline so that disk I/O, embedding and database writes overlap.
+
+    - A walker thread walks the target directories and hands changed files to a thread pool that reads them
+    - The calling thread consumes read files from a bounded queue, batches them and runs the embedding model
+    - A writer thread consumes embedded batches from a second bounded queue and writes them to the collection
+    """
+
+    def __init__(
+        self,
+        collection: Any,
+        embedding_function: Callable[[List[str]], List[Any]],
+        existing_fingerprints: Dict[str, Dict[str, Any]],
+        force_reindex: bool = False,
+        batch_size: int = 64,
+        batch_max_tokens: int = 65536,
+        read_workers: int = 8,
+        queue_size: int = 256,
+        chunk_max_lines: int = 60,
+        chunk_overlap: int = 10,
+        embedding_cache: Optional[Any] = None,
+        ignore_rules: Optional[IgnoreRules] = None,
+        manifest: Optional[FileManifest] = None,
+        embedding_model: str = "",
+        max_file_bytes: int = 0,
+        max_average_line_length: int = 0,
+        embedding_max_tokens: int = 0,
+        resume_after: Optional[str] = None,
+        on_checkpoint: Optional[Callable[[str], None]] = None,
+        checkpoint_interval: float = 5.0,
+    ):
+        self.collection = collection
+        self.embedding_function = embedding_function
+        self.existing_fingerprints = existing_fingerprints
+        self.force_reindex = force_reindex
+        self.batch_size = batch_size
+        self.batch_max_tokens = batch_max_tokens
+        self.read_workers = read_workers
+        self.queue_size = queue_size
+        self.chunk_max_lines = chunk_max_lines
+        self.chunk_overlap = chunk_overlap
+        self.embedding_cache = embedding_cache
+        self.ignore_rules = ignore_rules
+        self.manifest = manifest
+        self.embedding_model = embedding_model
+        self.max_file_bytes = max_file_bytes
+        self.max_average_line_length = max_average_line_length
+        self.embedding_max_tokens = embedding_max_tokens
+        self.resume_after = resume_after
+        self.on_checkpoint = on_checkpoint
+        self.checkpoint_interval = checkpoint_interval
+
+        self.stats = make_index_stats()
+        self._stats_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # Set once every file to index has been found, until then the remaining work is a lower bound
+        self.walk_complete = False
+        self.cancelled = False
+        # Code files found by the walk, known to exist without checking them again
+        self.processed_files: Set[str] = set()
+        # Last walked file such that every file before it in walk order has been written or skipped
+        self.checkpoint_cursor: Optional[str] = None
+        self._checkpoint_saved_at = 0.0
+        self._checkpoint_frozen = False
+        self._walk_directories: List[str] = []
+
+    def cancel(self):
+        """Stop the pipeline as soon as possible, files already written stay indexed"""
+        self.cancelled = True
+        self._stop_event.set()
+
+    def progress(self) -> Dict[str, Any]:
+        """
+        Get the progress of a running pipeline
+
+        Returns:
+            Dictionary with the number of files found, done and remaining
+        """
+        with self._stats_lock:
+            files_done = sum(
+                self.stats[key] for key in ("files_indexed", "files_updated", "files_skipped", "errors")
+            )
+            files_found = self.stats["files_scanned"]
+        return {
+            "files_found": files_found,
+            "files_done": files_done,
+            "files_remaining": max(files_found - files_done, 0),
+            "walk_complete": self.walk_complete,
+        }
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+            if key == "errors":
+                # Failed files must be retried, so the checkpoint never moves past them
+                self._checkpoint_frozen = True
+
+    def _advance_checkpoint(self, file_paths: List[str]):
+        """Move the checkpoint cursor after written files and save it if it was not saved for a while"""
+        walked_paths = [path for path in file_paths if any(is_in_directory(path, d) for d in self._walk_directories)]
+        if self.on_checkpoint is None or self._checkpoint_frozen or not walked_paths:
+            return
+        self.checkpoint_cursor = max(walked_paths, key=walk_order_key)
+        if time.monotonic() - self._checkpoint_saved_at >= self.checkpoint_interval:
+            self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        try:
+            self.on_checkpoint(self.checkpoint_cursor)
+            self._checkpoint_saved_at = time.monotonic()
+        except Exception as e:
+            logging.warning(f"Could not save the indexing checkpoint: {str(e)}")
+
+    def _put(self, target_queue: queue.Queue, item: Any):
+        """Put an item on a bounded queue without blocking forever if the pipeline is stopping"""
+        while not self._stop_event.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, source_queue: queue.Queue) -> Any:
+        """Get an item from a queue, ending the stream if the pipeline is stopping"""
+        while not self._stop_event.is_set():
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END_OF_STREAM
+
+    def run(self, target_directories: Iterable[str], file_paths: Iterable[str] = ()) -> Dict[str, int]:
+        """
+        Run the pipeline over the target directories
+
+        Args:
+            target_directories: List of absolute paths to directories to walk and index
+            file_paths: List of absolute paths to additional files to index without walking their directory
+
+        Returns:
+            Indexing statistics
+        """
+        # Walk the directories in a stable order, so that an interrupted run can resume where it stopped
+        self._walk_directories = sorted(target_directories, key=lambda d: walk_order_key(d, True))
+        return self._run(
+            itertools.chain(
+                self._iter_directory_files(self._walk_directories), self._iter_listed_files(list(file_paths))
+            )
+        )
+
+    def run_files(self, file_paths: Iterable[str]) -> Dict[str, int]:
+        """
+        Run the pipeline over a list of files, e.g. the files reported as changed by a watcher
+
+        Args:
+            file_paths: List of absolute paths to files to index
+
+        Returns:
+            Indexing statistics
+        """
+        return self.run([], file_paths)
+
+    def delete_files(self, file_paths: Iterable[str]) -> Dict[str, int]:
+        """
+        Delete the chunks of files that no longer exist
+
+        Args:
+            file_paths: List of absolute paths to deleted files
+
+        Returns:
+            Indexing statistics
+        """
+        # Only code files can have been indexed
+        file_paths = [path for path in file_paths if os.path.splitext(path)[1].lower() in CODE_EXTENSIONS]
+        for start in range(0, len(file_paths), FILTER_PAGE_SIZE):
+            page = file_paths[start : start + FILTER_PAGE_SIZE]
+            try:
+                self.collection.delete(where={"file_path": {"$in": page}})
+                if self.manifest is not None:
+                    self.manifest.delete_files(self.collection.name, page)
+                self._count("files_deleted", len(page))
+            except Exception as e:
+                logging.error(f"Error deleting {len(page)} files from the index: {str(e)}")
+                self._count("errors", len(page))
+        return self.stats
+
+    def delete_missing_files(
+        self, target_directories: Optional[Iterable[str]] = None, indexed_files: Optional[Iterable[str]] = None
+    ) -> Dict[str, int]:
+        """
+        Delete the chunks of indexed files that were deleted, renamed or are ignored now
+
+        Files found by a completed walk of the pipeline are known to exist and are not checked again,
+        so after a walk only the indexed files it did not find are looked up on disk.
+
+        Args:
+            target_directories: List of absolute paths to directories to clean up, or None for every indexed file
+            indexed_files: Paths of the indexed files to check, the files with a loaded fingerprint by default
+
+        Returns:
+            Indexing statistics
+        """
+        directories = None if target_directories is None else list(target_directories)
+        missing_files = []
+        for file_path in self.existing_fingerprints if indexed_files is None else indexed_files:
+            if file_path in self.processed_files:
+                continue
+            top_directory = None
+            if directories is not None:
+                top_directory = next((d for d in directories if is_in_directory(file_path, d)), None)
+                if top_directory is None:
+                    continue
+            if not os.path.isfile(file_path) or (
+                self.ignore_rules is not None and self.ignore_rules.is_file_ignored(file_path, top_directory)
+            ):
+                missing_files.append(file_path)
+
+        if missing_files:
+            logging.info(f"Deleting {len(missing_files)} files that no longer exist from the index")
+        return self.delete_files(missing_files)
+
+    def _run(self, file_paths: Iterable[str]) -> Dict[str, int]:
+        """Run the walker, embedding and writer stages over a stream of file paths"""
+        read_queue = queue.Queue(maxsize=self.queue_size)
+        # Keep at most a couple of embedded batches waiting for the writer
+        write_queue = queue.Queue(maxsize=2)
+
+        with ThreadPoolExecutor(max_workers=self.read_workers, thread_name_prefix="index-reader") as executor:
+            walker = threading.Thread(target=self._walk, args=(file_paths, executor, read_queue), name="index-walker")
+            writer = threading.Thread(target=self._write, args=(write_queue,), name="index-writer")
+            walker.start()
+            writer.start()
+            try:
+                self._embed(read_queue, write_queue)
+            except BaseException:
+                self._stop_event.set()
+                raise
+            finally:
+                walker.join()
+                writer.join()
+                if self._stop_event.is_set():
+                    # Don't read files nobody is going to embed anymore
+                    executor.shutdown(wait=False, cancel_futures=True)
+                if self.on_checkpoint is not None and self.checkpoint_cursor is not None:
+                    self._save_checkpoint()
+
+        return self.stats
+
+    def _iter_directory_files(self, target_directories: List[str]) -> Iterator[str]:
+        """Walk the target directories and yield the code files they contain, after the resume cursor if any"""
+        resume_key = walk_order_key(self.resume_after) if self.resume_after else None
+        for directory in target_directories:
+            if not os.path.exists(directory) or not os.path.isdir(directory):
+                logging.warning(f"Directory does not exist or is not a directory: {directory}")
+                continue
+
+            # Walk through the directory tree in sorted order, without entering ignored directories
+            for root, dirs, files in os.walk(directory):
+                if self.ignore_rules is not None:
+                    kept = [d for d in dirs if not self.ignore_rules.is_ignored(os.path.join(root, d), True, directory)]
+                    self._count("directories_pruned", len(dirs) - len(kept))
+                    dirs[:] = kept
+                dirs.sort()
+                if resume_key is not None:
+                    # Don't enter directories that were done before the run was interrupted
+                    dirs[:] = [
+                        d
+                        for d in dirs
+                        if not _is_walked_before(walk_order_key(os.path.join(root, d), True), resume_key)
+                    ]
+
+                for file in sorted(files):
+                    file_path = os.path.join(root, file)
+                    if resume_key is not None and walk_order_key(file_path) <= resume_key:
+                        continue
+                    if self.ignore_rules is not None and self.ignore_rules.is_ignored(file_path, False, directory):
+                        continue
+                    yield file_path
+
+    def _iter_listed_files(self, file_paths: List[str]) -> Iterator[str]:
+        """Yield the listed files that still exist and are not ignored"""
+        for file_path in file_paths:
+            if not os.path.isfile(file_path):
+                continue
+            if self.ignore_rules is not None and self.ignore_rules.is_file_ignored(file_path):
+                continue
+            yield file_path
+
+    def _walk(self, file_paths: Iterable[str], executor: ThreadPoolExecutor, read_queue: queue.Queue):
+        """Walker stage: find changed code files and submit them to the reader pool"""
+        # Track processed files to avoid duplicates
+        processed_files = self.processed_files
+
+        try:
+            for file_path in file_paths:
+                if self._stop_event.is_set():
+                    return
+
+                # Skip if already processed (in case of overlapping directories)
+                if file_path in processed_files:
+                    continue
+
+                # Only consider files with code extensions
+                file_ext = os.path.splitext(file_path)[1].lower()
+                if file_ext not in CODE_EXTENSIONS:
+                    continue
+
+                self._count("files_scanned")
+                processed_files.add(file_path)
+
+                try:
+                    candidate = self._make_candidate(file_path, file_ext)
+                except Exception as e:
+                    logging.error(f"Error indexing file {file_path}: {str(e)}")
+                    self._count("errors")
+                    continue
+
+                if candidate is None:
+                    self._count("files_skipped")
+                    continue
+
+                self._put(
+                    read_queue,
+                    executor.submit(
+                        read_candidate, candidate, self.max_file_bytes, self.max_average_line_length
+                    ),
+                )
+
+            self.walk_complete = True
+        finally:
+            self._put(read_queue, _END_OF_STREAM)
+
+    def _make_candidate(self, file_path: str, file_ext: str) -> Optional[FileCandidate]:
+        """Stat a file and return it as a candidate, or None if its size and mtime are unchanged"""
+        previous_metadata = self.existing_fingerprints.get(file_path)
+
+        # Skip without reading the file if size and modification time are unchanged
+        stat_result = os.stat(file_path)
+        if (
+            not self.force_reindex
+            and is_stat_unchanged(previous_metadata, stat_result)
+            and self._has_current_model(previous_metadata)
+        ):
+            return None
+
+        return FileCandidate(
+            file_path=file_path,
+            file_ext=file_ext,
+            stat_result=stat_result,
+            previous_metadata=previous_metadata,
+            is_indexed=file_path in self.existing_fingerprints,
+        )
+
+    def _has_current_model(self, metadata: Dict[str, Any]) -> bool:
+        """Check if an indexed file was embedded with the model of the pipeline, assuming so when unrecorded"""
+        recorded_model = metadata.get("embedding_model")
+        return not self.embedding_model or recorded_model is None or recorded_model == self.embedding_model
+
+    def _embed(self, read_queue: queue.Queue, write_queue: queue.Queue):
+        """Embedding stage: batch read files and embed each batch with a single model call"""
+        # Changed files are embedded and written in batches, touched files only get their metadata refreshed
+        batch = IndexBatch()
+        touched_fingerprints = {}
+        # Indexed files that became too large, binary or minified are removed from the index
+        rejected_files = []
+
+        try:
+            while True:
+                item = self._get(read_queue)
+                if item is _END_OF_STREAM:
+                    break
+
+                future: Future = item
+                try:
+                    file_content = future.result()
+                except Exception as e:
+                    logging.error(f"Error reading file: {str(e)}")
+                    self._count("errors")
+                    continue
+
+                candidate = file_content.candidate
+                content = file_content.content
+
+                if file_content.skip_reason is not None:
+                    logging.info(f"Skipping {file_content.skip_reason} file {candidate.file_path}")
+                    self._count(f"files_{file_content.skip_reason}")
+                    self._count("files_skipped")
+                    if candidate.is_indexed:
+                        rejected_files.append(candidate.file_path)
+                    continue
+
+                # Skip empty files
+                if not content.strip():
+                    self._count("files_skipped")
+                    continue
+
+                # Prepare metadata, including the fingerprint used for change detection
+                metadata = {
+                    "file_path": candidate.file_path,
+                    "file_type": candidate.file_ext[1:],  # Remove the dot
+                    "file_size": candidate.stat_result.st_size,
+                    "last_modified": candidate.stat_result.st_mtime,
+                    "inode": candidate.stat_result.st_ino,
+                    "content_hash": file_content.content_hash,
+                    "indexed_at": time.time(),
+                }
+
+                # If only the mtime changed (e.g. a touch or a branch round trip), refresh the
+                # fingerprint without re-embedding the content
+                if (
+                    candidate.is_indexed
+                    and not self.force_reindex
+                    and candidate.previous_metadata
+                    and candidate.previous_metadata.get("content_hash") == file_content.content_hash
+                    and self._has_current_model(candidate.previous_metadata)
+                ):
+                    touched_fingerprints[candidate.file_path] = metadata
+                    self._count("files_skipped")
+                    continue
+
+                # Split the file into chunks, each stored with its line range and its own hash
+                ids = []
+                documents = []
+                metadatas = []
+                for chunk_index, chunk in enumerate(
+                    chunk_lines(content, max_lines=self.chunk_max_lines, overlap=self.chunk_overlap)
+                ):
+                    ids.append(make_chunk_id(candidate.file_path, chunk.start_line, chunk.end_line))
+                    documents.append(chunk.text)
+                    metadatas.append(
+                        {
+                            **metadata,
+                            "start_line": chunk.start_line,
+                            "end_line": chunk.end_line,
+                            "chunk_index": chunk_index,
+                            "chunk_hash": compute_content_hash(chunk.text.encode("utf-8")),
+                        }
+                    )
+                token_count = sum(estimate_tokens(document) for document in documents)
+
+                # Flush first if this file would push the batch over its document count or token budget
+                if batch and (
+                    len(batch) + len(ids) > self.batch_size
+                    or batch.token_count + token_count > self.batch_max_tokens
+                ):
+                    batch = self._flush(batch, write_queue, touched_fingerprints, rejected_files)
+
+                batch.add_file(candidate.file_path, candidate.is_indexed, ids, documents, metadatas, token_count)
+                if len(batch) >= self.batch_size:
+                    batch = self._flush(batch, write_queue, touched_fingerprints, rejected_files)
+
+            # Write whatever is left over
+            self._flush(batch, write_queue, touched_fingerprints, rejected_files)
+        finally:
+            self._put(write_queue, _END_OF_STREAM)
+
+    def _flush(
+        self,
+        batch: IndexBatch,
+        write_queue: queue.Queue,
+        touched_fingerprints: Dict[str, Dict[str, Any]],
+        rejected_files: List[str],
+    ) -> IndexBatch:
+        """
+        Start embedding a batch and hand it over to the writer stage, which waits for its vectors
+
+        The touched and rejected files seen so far are written first and the containers emptied: writing the batch
+        moves the checkpoint past them, so a resumed run would not see them again.
+        """
+        if touched_fingerprints:
+            self._put(write_queue, partial(self._write_fingerprints, dict(touched_fingerprints)))
+            touched_fingerprints.clear()
+        if rejected_files:
+            self._put(write_queue, partial(self.delete_files, list(rejected_files)))
+            rejected_files.clear()
+
+        if not batch:
+            return batch
+
+        try:
+            wait_embeddings = self._embed_documents(batch.documents, [m["chunk_hash"] for m in batch.metadatas])
+            self._put(write_queue, partial(self._write_batch, batch, wait_embeddings))
+        except Exception as e:
+            logging.error(f"Error embedding batch of {len(batch.file_paths)} files: {str(e)}")
+            self._count("errors", len(batch.file_paths))
+
+        return IndexBatch()
+
+    def _call_model(self, documents: List[str]) -> Callable[[], List[Any]]:
+        """
+        Embed documents in length-sorted model calls under the padded token budget
+
+        The worker pool runs the calls in the background, so the batches queued for the writer keep several calls in
+        flight across its workers.
+
+        Returns:
+            Function waiting for the vectors and returning them in the order of the documents
+        """
+        submit = self.embedding_function.submit if isinstance(self.embedding_function, EmbeddingWorkerPool) else None
+        calls = []
+        for indexes in plan_length_sorted_batches(documents, self.embedding_max_tokens):
+            self._count("embedding_calls")
+            texts = [documents[i] for i in indexes]
+            calls.append((indexes, submit(texts) if submit is not None else self.embedding_function(texts)))
+
+        def wait() -> List[Any]:
+            vectors = [None] * len(documents)
+            error = None
+            # Wait for every call even if one failed, so that none is left running behind the pipeline
+            for indexes, result in calls:
+                try:
+                    results = result.result() if isinstance(result, Future) else result
+                except Exception as e:
+                    error = error or e
+                    continue
+                for index, vector in zip(indexes, results):
+                    vectors[index] = vector
+            if error is not None:
+                raise error
+            return vectors
+
+        return wait
+
+    def _embed_documents(self, documents: List[str], content_hashes: List[str]) -> Callable[[], List[Any]]:
+        """Start embedding documents, reusing the cached vectors of already embedded content"""
+        if self.embedding_cache is None:
+            return self._call_model(documents)
+
+        cached = self.embedding_cache.get_many(content_hashes)
+        missing = [i for i, content_hash in enumerate(content_hashes) if content_hash not in cached]
+        self._count("chunks_from_cache", len(documents) - len(missing))
+        wait_missing = self._call_model([documents[i] for i in missing]) if missing else None
+
+        def wait() -> List[Any]:
+            if wait_missing is not None:
+                computed = {content_hashes[i]: vector for i, vector in zip(missing, wait_missing())}
+                self.embedding_cache.put_many(computed)
+                cached.update(computed)
+            return [cached[content_hash] for content_hash in content_hashes]
+
+        return wait
+
+    def _write(self, write_queue: queue.Queue):
+        """Writer stage: run queued writes against the collection in order"""
+        while True:
+            write = self._get(write_queue)
+            if write is _END_OF_STREAM:
+                return
+            write()
+
+    def _write_batch(self, batch: IndexBatch, wait_embeddings: Callable[[], List[Any]]):
+        """Write an embedded batch with a single upsert and drop the chunks left over from previous versions"""
+        try:
+            batch.embeddings = wait_embeddings()
+        except Exception as e:
+            logging.error(f"Error embedding batch of {len(batch.file_paths)} files: {str(e)}")
+            self._count("errors", len(batch.file_paths))
+            return
+
+        try:
+            # Find the chunks currently stored for the files being re-indexed
+            updated_paths = [path for path, is_update in zip(batch.file_paths, batch.is_update) if is_update]
+            previous_ids = []
+            if updated_paths and self.manifest is not None:
+                previous_records = self.manifest.get_files(self.collection.name, updated_paths)
+                previous_ids = [chunk_id for record in previous_records.values() for chunk_id in record["chunk_ids"]]
+            elif updated_paths:
+                previous_ids = _get_file_chunks(self.collection, updated_paths, [])["ids"]
+
+            self.collection.upsert(
+                ids=batch.ids, embeddings=batch.embeddings, documents=batch.documents, metadatas=batch.metadatas
+            )
+
+            stale_ids = set(previous_ids) - set(batch.ids)
+            if stale_ids:
+                self.collection.delete(ids=list(stale_ids))
+
+            if self.manifest is not None:
+                self.manifest.put_files(self.collection.name, self._make_manifest_records(batch))
+
+            self._count("files_updated", len(updated_paths))
+            self._count("files_indexed", len(batch.file_paths) - len(updated_paths))
+            self._count("chunks_indexed", len(batch))
+            self._count("total_tokens_processed", batch.token_count)
+            self._advance_checkpoint(batch.file_paths)
+        except Exception as e:
+            logging.error(f"Error writing batch of {len(batch.file_paths)} files: {str(e)}")
+            self._count("errors", len(batch.file_paths))
+
+    def _make_manifest_records(self, batch: IndexBatch) -> List[Dict[str, Any]]:
+        """Build the manifest records of the files of a written batch from the metadata of their chunks"""
+        records = {}
+        for chunk_id, metadata in zip(batch.ids, batch.metadatas):
+            record = records.get(metadata["file_path"])
+            if record is None:
+                record = records[metadata["file_path"]] = {
+                    **metadata,
+                    "chunk_ids": [],
+                    "embedding_model": self.embedding_model,
+                }
+            record["chunk_ids"].append(chunk_id)
+        return list(records.values())
+
+    def _write_fingerprints(self, fingerprints: Dict[str, Dict[str, Any]]):
+        """Refresh the fingerprints stored on the chunks of touched files without re-embedding them"""
+        try:
+            if self.manifest is not None:
+                # The manifest knows the chunks of every file, no need to look them up in the collection
+                records = self.manifest.get_files(self.collection.name, list(fingerprints))
+                ids = [chunk_id for record in records.values() for chunk_id in record["chunk_ids"]]
+                metadatas = [
+                    fingerprints[file_path] for file_path, record in records.items() for _ in record["chunk_ids"]
+                ]
+            else:
+                stored = _get_file_chunks(self.collection, list(fingerprints), ["metadatas"])
+                ids = stored["ids"]
+                metadatas = [fingerprints[metadata["file_path"]] for metadata in stored["metadatas"]]
+            if ids:
+                self.collection.update(ids=ids, metadatas=metadatas)
+            if self.manifest is not None:
+                self.manifest.update_fingerprints(self.collection.name, fingerprints)
+        except Exception as e:
+            logging.error(f"Error refreshing metadata of {len(fingerprints)} files: {str(e)}")
+            self._count("errors", len(fingerprints))
@@ -0,0 +1,113 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .indexing import IndexPipeline
+
+# Job states
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+
+@dataclass
+class IndexJob:
+    """An index_repository run executing in the background"""
+
+    target_directories: List[str]
+    force_reindex: bool = False
+    watch: bool = False
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = JOB_PENDING
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    # Pipelines of the repositories indexed by the job, in order
+    pipelines: List[IndexPipeline] = field(default_factory=list)
+    # Number of repositories the job indexes, known once its directories are grouped
+    repository_count: Optional[int] = None
+    result: Optional[Dict[str, Any]] = None
+    task: Optional[asyncio.Task] = None
+    cancel_requested: bool = False
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+    def attach_pipeline(self, pipeline: IndexPipeline):
+        """Attach the pipeline doing the work, cancelling it right away if the job was cancelled meanwhile"""
+        self.pipelines.append(pipeline)
+        if self.cancel_requested:
+            pipeline.cancel()
+
+    def cancel(self):
+        """Ask the job to stop as soon as possible"""
+        self.cancel_requested = True
+        for pipeline in self.pipelines:
+            pipeline.cancel()
+
+    def statistics(self) -> Dict[str, Any]:
+        """Get the statistics of the job: its result once finished, else the counts summed over its pipelines"""
+        if self.result is not None:
+            return self.result
+        stats = {}
+        for pipeline in self.pipelines:
+            for key, value in pipeline.stats.items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def status_report(self) -> Dict[str, Any]:
+        """
+        Get the status of the job
+
+        Returns:
+            Dictionary with the job state, progress, throughput, ETA and errors
+        """
+        report = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "target_directories": self.target_directories,
+            "force_reindex": self.force_reindex,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+        if not self.pipelines:
+            return report
+
+        progress = {"files_found": 0, "files_done": 0, "files_remaining": 0}
+        for pipeline in self.pipelines:
+            for key, value in pipeline.progress().items():
+                if key in progress:
+                    progress[key] += value
+        # Repositories are indexed one after the other, so the walk is complete once the last one is walked
+        progress["walk_complete"] = self.pipelines[-1].walk_complete and len(self.pipelines) == self.repository_count
+        end_time = self.finished_at or time.time()
+        elapsed = end_time - self.started_at if self.started_at else 0.0
+        files_per_second = progress["files_done"] / elapsed if elapsed > 0 else 0.0
+
+        eta_seconds = None
+        if self.status == JOB_RUNNING and files_per_second > 0:
+            # Until the walk completes the remaining work is a lower bound, and so is the ETA
+            eta_seconds = progress["files_remaining"] / files_per_second
+
+        report.update(
+            {
+                "files_done": progress["files_done"],
+                "files_remaining": progress["files_remaining"],
+                "files_found": progress["files_found"],
+                "walk_complete": progress["walk_complete"],
+                "elapsed_seconds": elapsed,
+                "files_per_second": files_per_second,
+                "eta_seconds": eta_seconds,
+                "errors": sum(pipeline.stats["errors"] for pipeline in self.pipelines),
+                "statistics": dict(self.statistics()),
+            }
+        )
+        return report
@@ -0,0 +1,207 @@
+import json
+import os
+import os.path
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+# Fingerprint fields stored for every indexed file, in column order
+_FINGERPRINT_COLUMNS = ("file_type", "file_size", "last_modified", "inode", "content_hash", "indexed_at")
+
+
+class FileManifest:
+    """
+    SQLite manifest of the indexed files of each collection.
+
+    Maps every indexed path to its fingerprint (size, mtime, inode and content hash), the IDs
+    of its chunks and the embedding model they were embedded with, so that change detection,
+    deletion detection and stats are answered by indexed queries instead of collection scans.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                collection TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                file_type TEXT,
+                file_size INTEGER,
+                last_modified REAL,
+                inode INTEGER,
+                content_hash TEXT,
+                indexed_at REAL,
+                chunk_ids TEXT NOT NULL,
+                embedding_model TEXT,
+                PRIMARY KEY (collection, file_path)
+            )
+            """
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _to_record(row: tuple) -> Dict[str, Any]:
+        file_path, *fingerprint, chunk_ids, embedding_model = row
+        return {
+            "file_path": file_path,
+            **dict(zip(_FINGERPRINT_COLUMNS, fingerprint)),
+            "chunk_ids": json.loads(chunk_ids),
+            "embedding_model": embedding_model,
+        }
+
+    def get_files(
+        self, collection_name: str, file_paths: Optional[Iterable[str]] = None, directory: Optional[str] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the records of indexed files
+
+        Args:
+            collection_name: Name of the collection the files were indexed into
+            file_paths: If given, only the records of these files are returned
+            directory: If given, only the records of the files under this directory are returned
+
+        Returns:
+            Dictionary of the records by file path, with the fingerprint, chunk IDs and embedding model
+        """
+        columns = ", ".join(("file_path", *_FINGERPRINT_COLUMNS, "chunk_ids", "embedding_model"))
+        queries = []
+        if file_paths is not None:
+            file_paths = list(file_paths)
+            # Stay well below SQLite's limit on the number of query parameters
+            for start in range(0, len(file_paths), 500):
+                page = file_paths[start : start + 500]
+                placeholders = ",".join("?" * len(page))
+                queries.append((f"file_path IN ({placeholders})", page))
+        elif directory is not None:
+            # A range on the primary key finds the files under the directory without a scan
+            prefix = os.path.join(directory, "")
+            queries.append(("file_path >= ? AND file_path < ?", [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]))
+        else:
+            queries.append(("1", []))
+
+        records = {}
+        with self._lock:
+            for condition, parameters in queries:
+                rows = self._connection.execute(
+                    f"SELECT {columns} FROM files WHERE collection = ? AND {condition}", [collection_name, *parameters]
+                )
+                records.update((row[0], self._to_record(row)) for row in rows)
+        return records
+
+    def put_files(self, collection_name: str, records: List[Dict[str, Any]]):
+        """
+        Insert or replace the records of indexed files
+
+        Args:
+            collection_name: Name of the collection the files were indexed into
+            records: Records with the file path, the fingerprint fields, the chunk IDs and the embedding model
+        """
+        if not records:
+            return
+        rows = [
+            (
+                collection_name,
+                record["file_path"],
+                *(record.get(column) for column in _FINGERPRINT_COLUMNS),
+                json.dumps(record["chunk_ids"]),
+                record.get("embedding_model"),
+            )
+            for record in records
+        ]
+        placeholders = ",".join("?" * len(rows[0]))
+        with self._lock:
+            self._connection.executemany(f"INSERT OR REPLACE INTO files VALUES ({placeholders})", rows)
+            self._connection.commit()
+
+    def update_fingerprints(self, collection_name: str, fingerprints: Dict[str, Dict[str, Any]]):
+        """
+        Refresh the fingerprints of files whose content did not change, keeping their chunks
+
+        Args:
+            collection_name: Name of the collection the files were indexed into
+            fingerprints: Dictionary of the new fingerprint fields by file path
+        """
+        assignments = ", ".join(f"{column} = ?" for column in _FINGERPRINT_COLUMNS)
+        rows = [
+            (*(fingerprint.get(column) for column in _FINGERPRINT_COLUMNS), collection_name, file_path)
+            for file_path, fingerprint in fingerprints.items()
+        ]
+        with self._lock:
+            self._connection.executemany(
+                f"UPDATE files SET {assignments} WHERE collection = ? AND file_path = ?", rows
+            )
+            self._connection.commit()
+
+    def delete_files(self, collection_name: str, file_paths: Optional[Iterable[str]] = None):
+        """
+        Delete the records of files removed from the index
+
+        Args:
+            collection_name: Name of the collection the files were indexed into
+            file_paths: Paths of the removed files, or None to delete every record of the collection
+        """
+        with self._lock:
+            if file_paths is None:
+                self._connection.execute("DELETE FROM files WHERE collection = ?", (collection_name,))
+            else:
+                self._connection.executemany(
+                    "DELETE FROM files WHERE collection = ? AND file_path = ?",
+                    [(collection_name, file_path) for file_path in file_paths],
+                )
+            self._connection.commit()
+
+    def count(self, collection_name: str) -> int:
+        """Get the number of files recorded for a collection"""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM files WHERE collection = ?", (collection_name,)
+            ).fetchone()[0]
+
+    def count_chunks(self, collection_name: str) -> int:
+        """Get the number of chunks recorded for a collection"""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COALESCE(SUM(json_array_length(chunk_ids)), 0) FROM files WHERE collection = ?",
+                (collection_name,),
+            ).fetchone()[0]
+
+    def stats(self, collection_name: str) -> Dict[str, Any]:
+        """
+        Get statistics about the indexed files of a collection
+
+        Args:
+            collection_name: Name of the collection
+
+        Returns:
+            Dictionary with the number of files and chunks, the total size of the files, the number of
+            files per embedding model and the time of the last indexing
+        """
+        with self._lock:
+            files, chunks, total_bytes, last_indexed_at = self._connection.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(json_array_length(chunk_ids)), 0), COALESCE(SUM(file_size), 0),
+                    MAX(indexed_at)
+                FROM files WHERE collection = ?
+                """,
+                (collection_name,),
+            ).fetchone()
+            models = self._connection.execute(
+                "SELECT embedding_model, COUNT(*) FROM files WHERE collection = ? GROUP BY embedding_model",
+                (collection_name,),
+            ).fetchall()
+        return {
+            "files": files,
+            "chunks": chunks,
+            "size_bytes": total_bytes,
+            "files_per_model": dict(models),
+            "last_indexed_at": last_indexed_at,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import os.path
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# Files of an exported model folder
+ONNX_MODEL_FILE = "model.int8.onnx"
+ONNX_CONFIG_FILE = "onnx_config.json"
+TOKENIZER_FILE = "tokenizer.json"
+RECALL_REPORT_FILE = "recall.json"
+
+# Number of nearest neighbours compared by the recall check
+RECALL_K = 10
+
+
+def pool_embeddings(hidden_states: np.ndarray, attention_mask: np.ndarray, pooling: str, normalize: bool) -> np.ndarray:
+    """
+    Turn the token embeddings of a batch into one vector per document, like the sentence transformer would
+
+    Args:
+        hidden_states: Token embeddings, of shape (batch, sequence, dimensions)
+        attention_mask: Mask of the real tokens, of shape (batch, sequence)
+        pooling: "mean" to average the real tokens, "cls" to take the first token
+        normalize: Whether to scale the vectors to unit length
+
+    Returns:
+        Array of shape (batch, dimensions)
+    """
+    if pooling == "cls":
+        vectors = hidden_states[:, 0]
+    else:
+        mask = attention_mask[:, :, None].astype(np.float32)
+        vectors = (hidden_states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    if normalize:
+        vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    return vectors.astype(np.float32)
+
+
+def measure_neighbor_recall(
+    reference_function: Callable[[List[str]], Any], candidate_function: Callable[[List[str]], Any], documents: List[str]
+) -> float:
+    """
+    Measure how well an embedding function preserves the nearest neighbours found with a reference one
+
+    Every document is used as a query against the others, and the top RECALL_K neighbours by cosine
+    similarity under both functions are compared.
+
+    Args:
+        reference_function: Embedding function taken as ground truth, e.g. the fp32 model
+        candidate_function: Embedding function to check, e.g. the quantized model
+        documents: Sample documents
+
+    Returns:
+        Average fraction of the reference neighbours also found by the candidate, from 0.0 to 1.0
+    """
+    k = min(RECALL_K, len(documents) - 1)
+    if k < 1:
+        return 1.0
+
+    def neighbours(embedding_function: Callable[[List[str]], Any]) -> np.ndarray:
+        vectors = np.asarray(embedding_function(documents), dtype=np.float32)
+        vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        similarities = vectors @ vectors.T
+        np.fill_diagonal(similarities, -np.inf)
+        return np.argsort(-similarities, axis=1)[:, :k]
+
+    reference, candidate = neighbours(reference_function), neighbours(candidate_function)
+    overlaps = [len(set(expected) & set(found)) / k for expected, found in zip(reference, candidate)]
+    return float(np.mean(overlaps))
+
+
+class OnnxEmbeddingFunction:
+    """
+    Embedding function running an exported, int8 quantized ONNX model on the CPU with onnxruntime.
+
+    Tokenization uses the fast tokenizer saved with the model, and pooling and normalization
+    follow the configuration of the sentence transformer it was exported from.
+    """
+
+    def __init__(self, model_folder: str, num_threads: int = 0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_folder, ONNX_CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_folder, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"])
+
+        options = onnxruntime.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_folder, ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        if not input:
+            return []
+
+        encodings = self.tokenizer.encode_batch(list(input))
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": np.zeros_like(input_ids)}
+
+        hidden_states = self.session.run(None, {name: inputs[name] for name in self.input_names})[0]
+        return list(pool_embeddings(hidden_states, attention_mask, self.config["pooling"], self.config["normalize"]))
+
+
+def load_recall_report(model_folder: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the report of the recall check run when a model was exported
+
+    Args:
+        model_folder: Folder of the exported model
+
+    Returns:
+        The report, or None if the model has not been exported yet
+    """
+    try:
+        with open(os.path.join(model_folder, RECALL_REPORT_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def export_quantized_model(
+    model_name: str, cache_folder: str, model_folder: str, sample_documents: List[str]
+) -> Dict[str, Any]:
+    """
+    Export a sentence transformer to ONNX, quantize its weights to int8 and check its recall against the fp32 model.
+
+    Requires torch and transformers (installed with sentence-transformers) and the onnx package.
+
+    Args:
+        model_name: Name or path of the sentence transformer model
+        cache_folder: Folder where the model is cached
+        model_folder: Folder where the quantized model is written
+        sample_documents: Documents used for the recall and latency check
+
+    Returns:
+        The recall report, also written to the model folder
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    logging.info(f"Exporting {model_name} to an int8 ONNX model in {model_folder}")
+    os.makedirs(model_folder, exist_ok=True)
+    model = SentenceTransformer(model_name, cache_folder=cache_folder, device="cpu", trust_remote_code=True)
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    pooling = next((module for module in model if isinstance(module, Pooling)), None)
+
+    config = {
+        "model_name": model_name,
+        "pooling": "cls" if pooling is not None and pooling.pooling_mode_cls_token else "mean",
+        "normalize": any(isinstance(module, Normalize) for module in model),
+        "max_seq_length": model.max_seq_length,
+        "pad_token_id": tokenizer.pad_token_id or 0,
+    }
+    with open(os.path.join(model_folder, ONNX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    tokenizer.backend_tokenizer.save(os.path.join(model_folder, TOKENIZER_FILE))
+
+    fp32_path = os.path.join(model_folder, "model.fp32.onnx")
+    example = tokenizer(["def example():\n    return 1"], return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (example["input_ids"], example["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=17,
+        )
+    quantize_dynamic(fp32_path, os.path.join(model_folder, ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    def reference_function(documents: List[str]) -> Any:
+        return model.encode(documents, convert_to_numpy=True, normalize_embeddings=False)
+
+    quantized_function = OnnxEmbeddingFunction(model_folder)
+    report = {
+        "model_name": model_name,
+        "documents": len(sample_documents),
+        "k": min(RECALL_K, max(len(sample_documents) - 1, 0)),
+        "recall": measure_neighbor_recall(reference_function, quantized_function, sample_documents),
+        "fp32_seconds": _time_embedding(reference_function, sample_documents),
+        "int8_seconds": _time_embedding(quantized_function, sample_documents),
+    }
+    with open(os.path.join(model_folder, RECALL_REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Quantized model recall@{report['k']}: {report['recall']:.3f}, report: {report}")
+    return report
+
+
+def _time_embedding(embedding_function: Callable[[List[str]], Any], documents: List[str]) -> float:
+    start_time = time.perf_counter()
+    embedding_function(documents)
+    return time.perf_counter() - start_time
@@ -0,0 +1,115 @@
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Quantizations of the flat store: "binary" keeps one bit per dimension in memory to find the candidates of a search
+FLAT_STORE_QUANTIZATIONS = ("none", "binary")
+
+# Rerank factors compared by the recall and latency report
+REPORT_RERANK_FACTORS = (2, 5, 10, 20)
+
+# Number of rows compared with a query code at a time, so that the XOR of a block stays small
+HAMMING_BLOCK_ROWS = 65536
+
+# Number of set bits of every byte value
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def binarize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Quantize vectors to one bit per dimension, set when the component is positive
+
+    Args:
+        vectors: Matrix of vectors, one per row
+
+    Returns:
+        Matrix of uint8 codes, 32 times smaller than float32 vectors
+    """
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+def hamming_distances(codes: np.ndarray, query_code: np.ndarray) -> np.ndarray:
+    """
+    Count the bits that differ between a query code and every code
+
+    Args:
+        codes: Matrix of codes, one per row
+        query_code: Code of the query
+
+    Returns:
+        Hamming distance of every row
+    """
+    # NumPy 2 counts the bits of 64-bit words natively, older versions go through a lookup table per byte
+    use_words = hasattr(np, "bitwise_count") and codes.shape[1] % 8 == 0 and codes.flags.c_contiguous
+    if use_words:
+        codes = codes.view(np.uint64)
+        query_code = np.ascontiguousarray(query_code).view(np.uint64)
+    distances = np.empty(len(codes), dtype=np.int32)
+    for start in range(0, len(codes), HAMMING_BLOCK_ROWS):
+        block = np.bitwise_xor(codes[start : start + HAMMING_BLOCK_ROWS], query_code)
+        counts = np.bitwise_count(block) if use_words else _POPCOUNT[block]
+        distances[start : start + len(block)] = counts.sum(axis=1, dtype=np.int32)
+    return distances
+
+
+def _median_latency(search: Any, query_embeddings: List[List[float]]) -> Optional[float]:
+    """Time a search function over the queries and return the median latency in milliseconds"""
+    latencies = []
+    for embedding in query_embeddings:
+        start_time = time.perf_counter()
+        search(embedding)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    return statistics.median(latencies) if latencies else None
+
+
+def measure_quantized_search(
+    collection: Any,
+    query_embeddings: List[List[float]],
+    n_results: int,
+    rerank_factors: List[int] = REPORT_RERANK_FACTORS,
+) -> Dict[str, Any]:
+    """
+    Compare searches on binary codes with exact rerank against exact searches of a flat collection
+
+    Args:
+        collection: Flat collection to search
+        query_embeddings: Query vectors
+        n_results: Number of nearest records per query
+        rerank_factors: Numbers of candidates per result reranked with the full-precision vectors
+
+    Returns:
+        Report with the median latency of exact searches and, for each rerank factor, the recall@n_results
+        and median latency of quantized searches, along with the memory held by the codes
+    """
+    # Load the codes and norms before timing, so that the first query does not pay for them
+    storage = collection.stats()
+    collection.find_nearest(query_embeddings[0], n_results)
+    collection.find_nearest(query_embeddings[0], n_results, rerank_factor=rerank_factors[0])
+    exact = [set(collection.find_nearest(embedding, n_results)[0].tolist()) for embedding in query_embeddings]
+
+    report = {
+        "records": storage["records"],
+        "queries": len(query_embeddings),
+        "n_results": n_results,
+        "vector_bytes": storage["vector_bytes"],
+        "code_bytes": storage["code_bytes"],
+        "exact_latency_ms": _median_latency(lambda e: collection.find_nearest(e, n_results), query_embeddings),
+        "quantized": [],
+    }
+    for rerank_factor in rerank_factors:
+        hits = 0
+        for embedding, expected in zip(query_embeddings, exact):
+            rows, _ = collection.find_nearest(embedding, n_results, rerank_factor=rerank_factor)
+            hits += len(expected.intersection(rows.tolist()))
+        report["quantized"].append(
+            {
+                "rerank_factor": rerank_factor,
+                "recall": hits / max(sum(len(expected) for expected in exact), 1),
+                "latency_ms": _median_latency(
+                    lambda e: collection.find_nearest(e, n_results, rerank_factor=rerank_factor), query_embeddings
+                ),
+            }
+        )
+    return report
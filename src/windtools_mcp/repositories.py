@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import os.path
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Prefix of the collections holding one repository each
+REPOSITORY_COLLECTION_PREFIX = "repo_"
+
+
+def make_collection_name(root: str) -> str:
+    """
+    Generate the name of the collection of a repository, readable and unique per root directory
+
+    Args:
+        root: Absolute path of the repository root
+
+    Returns:
+        A valid ChromaDB collection name (3 to 63 characters of [a-zA-Z0-9._-], alphanumeric at both ends)
+    """
+    base_name = re.sub(r"[^a-zA-Z0-9_-]+", "_", os.path.basename(root.rstrip(os.sep)))[:40].strip("_-")
+    digest = hashlib.sha1(root.encode("utf-8")).hexdigest()[:10]
+    return f"{REPOSITORY_COLLECTION_PREFIX}{base_name or 'root'}_{digest}"
+
+
+class RepositoryRegistry:
+    """
+    Registry of the indexed repositories and of the collection holding each one, in a small JSON file.
+
+    Every directory passed to index_repository becomes a repository root with its own collection,
+    unless it lies inside a root that is already registered.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable repository registry {self.path}: {str(e)}")
+            return {}
+
+    def _save(self, repositories: Dict[str, Any]):
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(repositories, f, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def list(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get every registered repository
+
+        Returns:
+            Dictionary of the records by repository root, with the collection name and the registration time
+        """
+        with self._lock:
+            return self._load()
+
+    def find(self, path: str) -> Optional[str]:
+        """
+        Find the registered repository containing a path
+
+        Args:
+            path: Absolute path of a file or directory
+
+        Returns:
+            The root of the innermost repository containing the path, or None if there is none
+        """
+        with self._lock:
+            roots = [root for root in self._load() if path == root or path.startswith(os.path.join(root, ""))]
+        return max(roots, key=len, default=None)
+
+    def register(self, root: str) -> Dict[str, Any]:
+        """
+        Register a repository, if not registered yet
+
+        Args:
+            root: Absolute path of the repository root
+
+        Returns:
+            The record of the repository, with its collection name
+        """
+        with self._lock:
+            repositories = self._load()
+            if root not in repositories:
+                repositories[root] = {"collection": make_collection_name(root), "registered_at": time.time()}
+                self._save(repositories)
+            return repositories[root]
+
+    def remove(self, root: str):
+        """
+        Forget a repository
+
+        Args:
+            root: Absolute path of the repository root
+        """
+        with self._lock:
+            repositories = self._load()
+            if repositories.pop(root, None) is not None:
+                self._save(repositories)
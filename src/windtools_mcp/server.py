@@ -3,14 +3,60 @@ import json
 import logging
 import os
 import os.path
+import time
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from datetime import time
+from functools import partial
 from logging import INFO, basicConfig
-from typing import Any, AsyncIterator, Dict, List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
 
 from mcp.server.fastmcp import FastMCP
 
+from .checkpoint import CheckpointStore
+from .chunking import chunk_lines
+from .compaction import (
+    LATENCY_RESULTS,
+    get_directory_size,
+    measure_query_latency,
+    rebuild_collection,
+    recover_rebuild,
+    sample_query_embeddings,
+)
+from .flat_store import FlatVectorStore
+from .git_delta import GitStateStore, get_git_delta, get_head_commit, list_dirty_files
+from .hnsw_config import (
+    HNSW_DEFAULTS,
+    HnswConfigStore,
+    from_collection_metadata,
+    to_collection_metadata,
+    validate_hnsw_config,
+)
+from .ignore import DEFAULT_EXCLUDED_DIRECTORIES, IgnoreRules
+from .indexing import (
+    IndexPipeline,
+    delete_legacy_documents,
+    is_in_directory,
+    iter_indexed_chunk_ids,
+    iter_indexed_file_paths,
+    iter_indexed_fingerprints,
+    iter_record_file_paths,
+    make_index_stats,
+)
+from .jobs import JOB_CANCELLED, JOB_COMPLETED, JOB_FAILED, JOB_RUNNING, IndexJob
+from .manifest import FileManifest
+from .quantization import measure_quantized_search
+from .repositories import RepositoryRegistry
+from .snapshot import (
+    export_snapshot,
+    iter_snapshot_pages,
+    read_snapshot_header,
+    read_snapshot_manifest,
+    remap_chunk_id,
+    remap_path,
+)
+from .vector_store import ChromaVectorStore, VectorStore
+from .watcher import DirectoryWatcher
+
 basicConfig(
     level=INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(filename)s - %(message)s",
@@ -26,26 +72,150 @@ SENTENCE_TRANSFORMER_PATH = os.environ.get(
 os.makedirs(DATA_ROOT, exist_ok=True)
 CHROMA_DB_PATH = os.path.join(DATA_ROOT, CHROMA_DB_FOLDER_NAME)
 SENTENCE_TRANSFORMER_CACHE_FOLDER = os.path.join(DATA_ROOT, "embedding_cache")
+# Content-addressed cache of computed vectors, set EMBEDDING_CACHE_MAX_MB to 0 to disable it
+EMBEDDING_VECTOR_CACHE_FOLDER = os.path.join(DATA_ROOT, "vector_cache")
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "1024"))
+# In-memory LRU cache of search query vectors, so that repeated queries skip the model; set to 0 to disable it
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", "1024"))
+# Number of worker processes embedding documents during indexing, each with its own copy of the model.
+# With 0 indexing embeds in the server process, queries are always embedded in the server process.
+EMBEDDING_WORKERS = int(os.environ.get("EMBEDDING_WORKERS", "0"))
+# Embedding backend: "sentence_transformers" runs the fp32 model with PyTorch, "onnx_int8" runs an int8 quantized
+# ONNX export of it on the CPU, used only if its recall against the fp32 model is at least EMBEDDING_ONNX_MIN_RECALL
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "sentence_transformers")
+EMBEDDING_ONNX_MIN_RECALL = float(os.environ.get("EMBEDDING_ONNX_MIN_RECALL", "0.9"))
+ONNX_MODEL_FOLDER = os.path.join(DATA_ROOT, "onnx", SENTENCE_TRANSFORMER_PATH.replace("/", "__"))
+
+# Indexing batches are flushed when either the document count or the estimated token count is reached
+INDEX_BATCH_SIZE = int(os.environ.get("INDEX_BATCH_SIZE", "64"))
+INDEX_BATCH_MAX_TOKENS = int(os.environ.get("INDEX_BATCH_MAX_TOKENS", "65536"))
+# Each batch is embedded in length-sorted model calls whose estimated padded token count stays under this budget
+EMBEDDING_BATCH_MAX_TOKENS = int(os.environ.get("EMBEDDING_BATCH_MAX_TOKENS", "16384"))
+# Number of threads reading files and maximum number of read files waiting to be embedded
+INDEX_READ_WORKERS = int(os.environ.get("INDEX_READ_WORKERS", "8"))
+INDEX_QUEUE_SIZE = int(os.environ.get("INDEX_QUEUE_SIZE", "256"))
+# Files are split into overlapping windows of lines, each embedded as its own document
+INDEX_CHUNK_LINES = int(os.environ.get("INDEX_CHUNK_LINES", "60"))
+INDEX_CHUNK_OVERLAP = int(os.environ.get("INDEX_CHUNK_OVERLAP", "10"))
+# Files over this size, or whose lines are this long on average (minified or generated code), are not indexed
+INDEX_MAX_FILE_BYTES = int(os.environ.get("INDEX_MAX_FILE_BYTES", str(1024 * 1024)))
+INDEX_MAX_AVERAGE_LINE_LENGTH = int(os.environ.get("INDEX_MAX_AVERAGE_LINE_LENGTH", "300"))
+# Directory names never entered by the index walk, on top of the .gitignore and .ignore rules
+INDEX_EXCLUDE_DIRS = [
+    name.strip()
+    for name in os.environ.get("INDEX_EXCLUDE_DIRS", ",".join(DEFAULT_EXCLUDED_DIRECTORIES)).split(",")
+    if name.strip()
+]
+# Watch mode: "auto" uses native notifications (inotify) when watchfiles is installed, "poll" forces mtime polling
+INDEX_WATCH_BACKEND = os.environ.get("INDEX_WATCH_BACKEND", "auto")
+INDEX_WATCH_DEBOUNCE_SECONDS = float(os.environ.get("INDEX_WATCH_DEBOUNCE_SECONDS", "2"))
+INDEX_WATCH_POLL_SECONDS = float(os.environ.get("INDEX_WATCH_POLL_SECONDS", "5"))
+# Directories in git work trees are re-indexed from the git delta since the commit they were indexed at
+INDEX_GIT_DELTA = os.environ.get("INDEX_GIT_DELTA", "true").lower() in ("1", "true", "yes")
+GIT_STATE_PATH = os.path.join(DATA_ROOT, f"{CHROMA_DB_FOLDER_NAME}_git_state.json")
+# Manifest of the indexed files, next to the ChromaDB folder
+MANIFEST_PATH = os.path.join(DATA_ROOT, f"{CHROMA_DB_FOLDER_NAME}_manifest.sqlite3")
+# Interrupted index runs save how far they got at most this often, and the next run over the same directories resumes
+CHECKPOINT_PATH = os.path.join(DATA_ROOT, f"{CHROMA_DB_FOLDER_NAME}_checkpoints.json")
+INDEX_CHECKPOINT_SECONDS = float(os.environ.get("INDEX_CHECKPOINT_SECONDS", "5"))
+# Each indexed directory gets its own collection, listed in the repository registry, so that searches can be scoped
+INDEX_COLLECTION_PER_REPOSITORY = (
+    os.environ.get("INDEX_COLLECTION_PER_REPOSITORY", "true").lower() in ("1", "true", "yes")
+)
+REPOSITORY_REGISTRY_PATH = os.path.join(DATA_ROOT, f"{CHROMA_DB_FOLDER_NAME}_repositories.json")
+# HNSW parameters of new collections (HNSW_SPACE, HNSW_M, ...), ChromaDB's defaults when not set; values set with the
+# configure_index tool are saved next to the ChromaDB folder and take precedence
+HNSW_ENV_CONFIG = {
+    name: os.environ[f"HNSW_{name.upper()}"] for name in HNSW_DEFAULTS if f"HNSW_{name.upper()}" in os.environ
+}
+HNSW_CONFIG_PATH = os.path.join(DATA_ROOT, f"{CHROMA_DB_FOLDER_NAME}_hnsw_config.json")
+# Vector store: "chroma" keeps the vectors in ChromaDB's HNSW indexes, "flat" in a memory-mapped float32 or float16
+# matrix per collection searched exactly, with less startup and query overhead on small and medium repositories
+VECTOR_STORE = os.environ.get("VECTOR_STORE", "chroma")
+FLAT_STORE_PATH = os.path.join(DATA_ROOT, f"{CHROMA_DB_FOLDER_NAME}_flat")
+FLAT_STORE_DTYPE = os.environ.get("FLAT_STORE_DTYPE", "float32")
+# "binary" keeps one bit per dimension of the flat vectors in memory to find search candidates, reranked exactly with
+# FLAT_STORE_RERANK_FACTOR * limit full-precision vectors read from disk; measure_quantization reports its recall
+FLAT_STORE_QUANTIZATION = os.environ.get("FLAT_STORE_QUANTIZATION", "none")
+FLAT_STORE_RERANK_FACTOR = int(os.environ.get("FLAT_STORE_RERANK_FACTOR", "10"))
 
 
 # Server lifespan context for ChromaDB initialization and project directory
 @dataclass
 class ServerContext:
-    chroma_client: Optional[Any] = None
+    vector_store: Optional[VectorStore] = None
     code_collection: Optional[Any] = None
+    repository_registry: Optional[RepositoryRegistry] = None
+    repository_collections: Dict[str, Any] = None
+    embedding_function: Optional[Any] = None
+    query_embedding_function: Optional[Any] = None
+    embedding_cache: Optional[Any] = None
+    query_embedding_cache: Optional[Any] = None
+    embedding_worker_pool: Optional[Any] = None
+    git_state_store: Optional[GitStateStore] = None
+    file_manifest: Optional[FileManifest] = None
+    checkpoint_store: Optional[CheckpointStore] = None
+    hnsw_config_store: Optional[HnswConfigStore] = None
+    hnsw_config: Dict[str, Any] = None
     embedding_model: str = ""
     is_initialized: bool = False
     initialization_error: Optional[str] = None
     command_registry: Dict[str, Dict[str, Any]] = None
+    index_jobs: Dict[str, IndexJob] = None
+    watchers: Dict[str, DirectoryWatcher] = None
+    # Names of the collections checked for documents indexed before files were split into chunks
+    migrated_collections: Set[str] = None
 
     def __post_init__(self):
         self.command_registry = {}
+        self.repository_collections = {}
+        self.hnsw_config = {}
+        self.index_jobs = {}
+        self.watchers = {}
+        self.migrated_collections = set()
 
 
 # Create a global context object
 ctx = ServerContext(embedding_model=SENTENCE_TRANSFORMER_PATH)
 
 
+def _get_recall_sample_documents() -> List[str]:
+    """Helper function to get the documents of the recall check: the chunks of this package's own source code"""
+    documents = []
+    package_folder = os.path.dirname(__file__)
+    for file_name in sorted(os.listdir(package_folder)):
+        if file_name.endswith(".py"):
+            with open(os.path.join(package_folder, file_name), "r", encoding="utf-8") as f:
+                documents.extend(chunk.text for chunk in chunk_lines(f.read(), max_lines=20, overlap=0))
+    return documents
+
+
+def _load_onnx_embedding_function() -> Optional[Any]:
+    """
+    Helper function to load the int8 ONNX embedding function, exporting the model and checking its recall on first use
+
+    Returns:
+        The embedding function, or None if the quantized model loses too much recall against the fp32 model
+    """
+    from .onnx_embedding import OnnxEmbeddingFunction, export_quantized_model, load_recall_report
+
+    report = load_recall_report(ONNX_MODEL_FOLDER)
+    if report is None:
+        report = export_quantized_model(
+            SENTENCE_TRANSFORMER_PATH,
+            SENTENCE_TRANSFORMER_CACHE_FOLDER,
+            ONNX_MODEL_FOLDER,
+            _get_recall_sample_documents(),
+        )
+    if report["recall"] < EMBEDDING_ONNX_MIN_RECALL:
+        logging.warning(
+            f"Quantized model recall {report['recall']:.3f} is below {EMBEDDING_ONNX_MIN_RECALL}, "
+            "falling back to the sentence transformer"
+        )
+        return None
+    return OnnxEmbeddingFunction(ONNX_MODEL_FOLDER)
+
+
 async def initialize_resources():
     """Initialize ChromaDB and embedding model in background"""
     try:
@@ -62,18 +232,53 @@ async def initialize_resources():
         from chromadb.utils import embedding_functions
 
         # Run potentially blocking operations in executor
-        chroma_client = await loop.run_in_executor(None, lambda: chromadb.PersistentClient(path=CHROMA_DB_PATH))
-        embedding_function = await loop.run_in_executor(
-            None,
-            lambda: embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name=SENTENCE_TRANSFORMER_PATH,
-                cache_folder=SENTENCE_TRANSFORMER_CACHE_FOLDER,
-            ),
-        )
+        if VECTOR_STORE == "flat":
+            logging.info(f"Using the flat vector store at {FLAT_STORE_PATH}")
+            vector_store = FlatVectorStore(
+                FLAT_STORE_PATH,
+                dtype=FLAT_STORE_DTYPE,
+                quantization=FLAT_STORE_QUANTIZATION,
+                rerank_factor=FLAT_STORE_RERANK_FACTOR,
+            )
+        elif VECTOR_STORE == "chroma":
+            chroma_client = await loop.run_in_executor(None, lambda: chromadb.PersistentClient(path=CHROMA_DB_PATH))
+            vector_store = ChromaVectorStore(chroma_client)
+        else:
+            raise ValueError(f"Unknown vector store: {VECTOR_STORE}")
+        if EMBEDDING_BACKEND not in ("sentence_transformers", "onnx_int8"):
+            raise ValueError(f"Unknown embedding backend: {EMBEDDING_BACKEND}")
+        hnsw_config_store = HnswConfigStore(HNSW_CONFIG_PATH)
+        hnsw_config = {**validate_hnsw_config(HNSW_ENV_CONFIG), **hnsw_config_store.load()}
+        embedding_function = None
+        if EMBEDDING_BACKEND == "onnx_int8":
+            embedding_function = await loop.run_in_executor(None, _load_onnx_embedding_function)
+
+        if embedding_function is not None:
+            from .onnx_embedding import OnnxEmbeddingFunction
+
+            # Quantized vectors differ from the fp32 ones, so they are cached and tracked as another model
+            embedding_model = f"{SENTENCE_TRANSFORMER_PATH}#onnx-int8"
+            worker_threads = max((os.cpu_count() or 1) // max(EMBEDDING_WORKERS, 1), 1)
+            worker_factory = partial(OnnxEmbeddingFunction, ONNX_MODEL_FOLDER, num_threads=worker_threads)
+        else:
+            from .embedding_workers import create_sentence_transformer
+
+            embedding_function = await loop.run_in_executor(
+                None,
+                lambda: embedding_functions.SentenceTransformerEmbeddingFunction(
+                    model_name=SENTENCE_TRANSFORMER_PATH,
+                    cache_folder=SENTENCE_TRANSFORMER_CACHE_FOLDER,
+                ),
+            )
+            embedding_model = SENTENCE_TRANSFORMER_PATH
+            worker_factory = partial(
+                create_sentence_transformer, SENTENCE_TRANSFORMER_PATH, SENTENCE_TRANSFORMER_CACHE_FOLDER
+            )
 
         # Create or get the code collection
+        recover_rebuild(vector_store, "code_collection")
         try:
-            code_collection = chroma_client.get_collection(
+            code_collection = vector_store.get_collection(
                 name="code_collection", embedding_function=embedding_function
             )
             logging.info(
@@ -81,14 +286,54 @@ async def initialize_resources():
             )
         except Exception as e:
             logging.info(f"Collection not found, creating new one. Error: {str(e)}")
-            code_collection = chroma_client.create_collection(
-                name="code_collection", embedding_function=embedding_function
+            code_collection = vector_store.create_collection(
+                name="code_collection",
+                embedding_function=embedding_function,
+                metadata=to_collection_metadata(hnsw_config) or None,
             )
             logging.info("Created new code collection")
 
+        embedding_cache = None
+        if EMBEDDING_CACHE_MAX_MB > 0:
+            from .embedding_cache import EmbeddingCache
+
+            embedding_cache = await loop.run_in_executor(
+                None,
+                lambda: EmbeddingCache(
+                    cache_folder=EMBEDDING_VECTOR_CACHE_FOLDER,
+                    model_name=embedding_model,
+                    max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+                ),
+            )
+
+        query_embedding_cache = None
+        if QUERY_CACHE_MAX_ENTRIES > 0:
+            from .embedding_cache import QueryEmbeddingCache
+
+            query_embedding_cache = QueryEmbeddingCache(model_name=embedding_model, max_entries=QUERY_CACHE_MAX_ENTRIES)
+
+        embedding_worker_pool = None
+        if EMBEDDING_WORKERS > 0:
+            from .embedding_workers import EmbeddingWorkerPool
+
+            embedding_worker_pool = EmbeddingWorkerPool(worker_factory, processes=EMBEDDING_WORKERS)
+
         # Update global context
-        ctx.chroma_client = chroma_client
+        ctx.vector_store = vector_store
         ctx.code_collection = code_collection
+        ctx.embedding_function = embedding_function if embedding_worker_pool is None else embedding_worker_pool
+        ctx.query_embedding_function = embedding_function
+        ctx.embedding_worker_pool = embedding_worker_pool
+        ctx.embedding_model = embedding_model
+        ctx.embedding_cache = embedding_cache
+        ctx.query_embedding_cache = query_embedding_cache
+        ctx.git_state_store = GitStateStore(GIT_STATE_PATH) if INDEX_GIT_DELTA else None
+        ctx.file_manifest = await loop.run_in_executor(None, lambda: FileManifest(MANIFEST_PATH))
+        ctx.checkpoint_store = CheckpointStore(CHECKPOINT_PATH)
+        ctx.hnsw_config_store = hnsw_config_store
+        ctx.hnsw_config = hnsw_config
+        if INDEX_COLLECTION_PER_REPOSITORY:
+            ctx.repository_registry = RepositoryRegistry(REPOSITORY_REGISTRY_PATH)
         ctx.is_initialized = True
         logging.info("Background initialization completed successfully")
     except Exception as e:
@@ -116,6 +361,23 @@ async def server_lifespan(server: FastMCP) -> AsyncIterator[ServerContext]:
             except asyncio.CancelledError:
                 logging.info("Initialization task was cancelled")
 
+        # Stop background index jobs so that their threads don't outlive the server
+        job_tasks = []
+        for job in ctx.index_jobs.values():
+            if not job.is_finished:
+                job.cancel()
+            if job.task is not None and not job.task.done():
+                job_tasks.append(job.task)
+        if job_tasks:
+            logging.info(f"Waiting for {len(job_tasks)} background index jobs to stop...")
+            await asyncio.gather(*job_tasks, return_exceptions=True)
+
+        for watcher in ctx.watchers.values():
+            watcher.stop(timeout=5)
+
+        if ctx.embedding_worker_pool is not None:
+            ctx.embedding_worker_pool.close()
+
 
 mcp = FastMCP(
     "WindCodeAssistant",
@@ -196,30 +458,530 @@ def get_initialization_status() -> str:
     The background initialization process includes initializing ChromaDB and embedding model.
 
     Returns:
-        JSON string with initialization status
+        JSON string with initialization status, and the hit/miss counters of the query embedding cache
     """
     status = {
         "is_initialized": ctx.is_initialized,
         "error": ctx.initialization_error
     }
+    if ctx.query_embedding_cache is not None:
+        status["query_cache"] = ctx.query_embedding_cache.stats()
     return json.dumps(status)
 
 
+def _migrate_legacy_documents(collection: Any):
+    """Helper function to delete the whole-file documents of a collection indexed before files were split into chunks"""
+    collection_name = collection.name
+    if collection_name in ctx.migrated_collections:
+        return
+    # A manifest is only filled once the collection was migrated
+    if ctx.file_manifest is None or ctx.file_manifest.count(collection_name) == 0:
+        deleted = delete_legacy_documents(collection)
+        if deleted:
+            logging.info(f"Deleted {deleted} whole-file documents from {collection_name}, to re-index their files")
+            # Their files may be unchanged since the recorded commits, so the next run has to walk
+            if ctx.git_state_store is not None:
+                ctx.git_state_store.delete(collection_name)
+    ctx.migrated_collections.add(collection_name)
+
+
+def _sync_manifest(collection: Any):
+    """
+    Helper function to fill the file manifest from a collection indexed before the manifest existed
+
+    The manifest lives outside the vector store, so it is rebuilt from the collection when their numbers of
+    chunks differ, e.g. once the collection was deleted or recreated; otherwise unchanged files would be
+    skipped forever without being in the collection.
+
+    Args:
+        collection: Collection the manifest records the files of
+    """
+    collection_name = collection.name
+    collection_size = collection.count()
+    manifest_chunks = ctx.file_manifest.count_chunks(collection_name)
+    if manifest_chunks == collection_size:
+        return
+    if manifest_chunks > 0:
+        logging.warning(
+            f"The file manifest records {manifest_chunks} chunks of {collection_name} but the collection holds "
+            f"{collection_size}, rebuilding the manifest from the collection"
+        )
+        ctx.file_manifest.delete_files(collection_name)
+    if collection_size == 0:
+        return
+
+    logging.info(f"Building the file manifest of {collection_name} from the collection")
+    chunk_ids = {}
+    for chunk_id, file_path in iter_indexed_chunk_ids(collection):
+        chunk_ids.setdefault(file_path, []).append(chunk_id)
+    ctx.file_manifest.put_files(
+        collection_name,
+        [
+            {**metadata, "chunk_ids": chunk_ids.get(metadata["file_path"], []), "embedding_model": ctx.embedding_model}
+            for metadata in iter_indexed_fingerprints(collection)
+        ],
+    )
+
+
+def _load_fingerprints(
+    collection: Any, file_paths: Optional[Set[str]] = None, directories: Optional[List[str]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Helper function to load the fingerprints (size, mtime and content hash) of indexed files
+
+    Args:
+        collection: Collection the files are indexed into
+        file_paths: If given, only the fingerprints of these files are loaded, plus the ones under directories
+        directories: If given, the fingerprints of the files under these directories are loaded too
+
+    Returns:
+        Dictionary of the stored metadata by file path
+    """
+    load_all = file_paths is None and directories is None
+    _migrate_legacy_documents(collection)
+
+    if ctx.file_manifest is not None:
+        _sync_manifest(collection)
+        collection_name = collection.name
+        if load_all:
+            return ctx.file_manifest.get_files(collection_name)
+        fingerprints = ctx.file_manifest.get_files(collection_name, file_paths=file_paths or set())
+        for directory in directories or []:
+            fingerprints.update(ctx.file_manifest.get_files(collection_name, directory=directory))
+        return fingerprints
+
+    # Without a manifest the collection can't be filtered by directory, so walks load every fingerprint.
+    # Only the first chunk of each file is fetched, it carries the fingerprint of the whole file.
+    if load_all or directories:
+        return {metadata["file_path"]: metadata for metadata in iter_indexed_fingerprints(collection)}
+    return {metadata["file_path"]: metadata for metadata in iter_indexed_fingerprints(collection, file_paths or set())}
+
+
+def _create_index_pipeline(
+    collection: Any,
+    force_reindex: bool,
+    file_paths: Optional[Set[str]] = None,
+    directories: Optional[List[str]] = None,
+    resume_after: Optional[str] = None,
+    on_checkpoint: Optional[Callable[[str], None]] = None,
+) -> IndexPipeline:
+    """
+    Helper function to create the indexing pipeline of a collection
+
+    Args:
+        collection: Collection to index into
+        force_reindex: If true, the pipeline will reindex all files even if they are unchanged
+        file_paths: If given, only the fingerprints of these files are loaded, plus the ones under directories
+        directories: If given, the fingerprints of the files under these directories are loaded too
+        resume_after: Checkpoint cursor of an interrupted run, the walk skips the files up to it
+        on_checkpoint: Called with the checkpoint cursor as the walked files get written
+
+    Returns:
+        Indexing pipeline ready to run
+    """
+    # Get the fingerprints of indexed files for update/skip logic
+    existing_fingerprints = _load_fingerprints(collection, file_paths, directories)
+
+    # Walk, read, embed and write in overlapping stages
+    return IndexPipeline(
+        collection=collection,
+        embedding_function=ctx.embedding_function,
+        existing_fingerprints=existing_fingerprints,
+        force_reindex=force_reindex,
+        batch_size=INDEX_BATCH_SIZE,
+        batch_max_tokens=INDEX_BATCH_MAX_TOKENS,
+        read_workers=INDEX_READ_WORKERS,
+        queue_size=INDEX_QUEUE_SIZE,
+        chunk_max_lines=INDEX_CHUNK_LINES,
+        chunk_overlap=INDEX_CHUNK_OVERLAP,
+        embedding_cache=ctx.embedding_cache,
+        ignore_rules=IgnoreRules(INDEX_EXCLUDE_DIRS),
+        manifest=ctx.file_manifest,
+        embedding_model=ctx.embedding_model,
+        max_file_bytes=INDEX_MAX_FILE_BYTES,
+        max_average_line_length=INDEX_MAX_AVERAGE_LINE_LENGTH,
+        embedding_max_tokens=EMBEDDING_BATCH_MAX_TOKENS,
+        resume_after=resume_after,
+        on_checkpoint=on_checkpoint,
+        checkpoint_interval=INDEX_CHECKPOINT_SECONDS,
+    )
+
+
+def _get_collection(collection_name: str) -> Any:
+    """Helper function to get a repository collection, creating it on first use"""
+    collection = ctx.repository_collections.get(collection_name)
+    if collection is None:
+        recover_rebuild(ctx.vector_store, collection_name)
+        # The HNSW parameters only apply when the collection is created, an existing one keeps its own
+        collection = ctx.vector_store.get_or_create_collection(
+            name=collection_name,
+            embedding_function=ctx.query_embedding_function,
+            metadata=to_collection_metadata(ctx.hnsw_config) or None,
+        )
+        ctx.repository_collections[collection_name] = collection
+    return collection
+
+
+def _drop_repository(root: str):
+    """Helper function to forget a repository and delete its collection"""
+    collection_name = ctx.repository_registry.list()[root]["collection"]
+    logging.info(f"Dropping the collection {collection_name} of {root}")
+    ctx.repository_collections.pop(collection_name, None)
+    try:
+        ctx.vector_store.delete_collection(collection_name)
+    except Exception as e:
+        logging.warning(f"Could not delete the collection {collection_name}: {str(e)}")
+    if ctx.file_manifest is not None:
+        ctx.file_manifest.delete_files(collection_name)
+    if ctx.git_state_store is not None:
+        ctx.git_state_store.delete(collection_name)
+    ctx.repository_registry.remove(root)
+
+
+def _group_by_repository(target_directories: List[str]) -> List[Tuple[Optional[str], Any, List[str]]]:
+    """
+    Helper function to find the collection each directory is indexed into
+
+    A directory inside a registered repository goes to the collection of that repository; any other
+    existing directory is registered as a new repository with its own collection, replacing the
+    repositories registered inside it. Without a repository registry everything goes to the code collection.
+
+    Args:
+        target_directories: List of absolute paths to directories
+
+    Returns:
+        List of tuples of repository root, collection and the directories to index into it
+    """
+    if ctx.repository_registry is None:
+        return [(None, ctx.code_collection, list(target_directories))]
+
+    groups = {}
+    for directory in target_directories:
+        root = ctx.repository_registry.find(directory)
+        if root is None:
+            if not os.path.isdir(directory):
+                logging.warning(f"Directory does not exist or is not a directory: {directory}")
+                continue
+            for inner_root in ctx.repository_registry.list():
+                if is_in_directory(inner_root, directory):
+                    _drop_repository(inner_root)
+            ctx.repository_registry.register(directory)
+            root = directory
+        groups.setdefault(root, []).append(directory)
+
+    repositories = ctx.repository_registry.list()
+    return [
+        (root, _get_collection(repositories[root]["collection"]), directories)
+        for root, directories in groups.items()
+    ]
+
+
+def _get_repository_collections(repositories: Optional[List[str]] = None) -> List[Tuple[Optional[str], Any]]:
+    """
+    Helper function to get the collections of indexed repositories
+
+    Args:
+        repositories: Absolute paths inside the repositories or containing them, or directory names of their roots,
+            all repositories if not given
+
+    Returns:
+        List of tuples of repository root and collection; files indexed before repositories had their own
+        collection are in the code collection, returned with no root when all repositories are requested
+
+    Raises:
+        ValueError: If one of the repositories is not indexed
+    """
+    if ctx.repository_registry is None:
+        return [(None, ctx.code_collection)]
+
+    registered = ctx.repository_registry.list()
+    if repositories is None:
+        roots = list(registered)
+    else:
+        roots = []
+        for repository in repositories:
+            if os.path.isabs(repository):
+                root = ctx.repository_registry.find(repository)
+                # A directory containing repositories stands for all of them
+                matches = [root] if root is not None else [r for r in registered if is_in_directory(r, repository)]
+            else:
+                matches = [r for r in registered if os.path.basename(r.rstrip(os.sep)) == repository][:1]
+            if not matches:
+                raise ValueError(f"Repository not indexed: {repository}")
+            roots.extend(root for root in matches if root not in roots)
+
+    collections = [(root, _get_collection(registered[root]["collection"])) for root in roots]
+    if repositories is None and ctx.code_collection.count() > 0:
+        collections.append((None, ctx.code_collection))
+    return collections
+
+
+def _run_indexing(
+    target_directories: List[str], force_reindex: bool, job: Optional[IndexJob] = None
+) -> Dict[str, Any]:
+    """
+    Helper function to index directories into the collections of their repositories
+
+    Args:
+        target_directories: List of absolute paths to directories to index
+        force_reindex: If true, walk and reindex all files even if they are unchanged
+        job: Background job to attach the pipelines to, if any
+
+    Returns:
+        Indexing statistics summed over the repositories, with the root and collection of each one
+    """
+    # Start from zero counters, so that a run without any repository to index reports them too
+    stats = {**make_index_stats(), "git_delta_directories": [], "resumed_after": [], "repositories": []}
+    groups = _group_by_repository(target_directories)
+    if job is not None:
+        job.repository_count = len(groups)
+    for root, collection, directories in groups:
+        if job is not None and job.cancel_requested:
+            break
+        repository_stats = _index_collection(collection, directories, force_reindex, job)
+        for key, value in repository_stats.items():
+            if isinstance(value, int):
+                stats[key] = stats.get(key, 0) + value
+        stats["git_delta_directories"].extend(repository_stats["git_delta_directories"])
+        if repository_stats["resumed_after"] is not None:
+            stats["resumed_after"].append(repository_stats["resumed_after"])
+        if root is not None:
+            stats["repositories"].append({"root": root, "collection": collection.name})
+            if not (job is not None and job.cancel_requested):
+                _drop_shared_collection_files(root)
+    return stats
+
+
+def _drop_shared_collection_files(root: str):
+    """Helper function to delete the files of a repository from the code collection, once it has its own collection"""
+    if ctx.code_collection.count() == 0:
+        return
+    # Every record is scanned rather than the fingerprints, so that documents without chunk metadata go too
+    file_paths = sorted(
+        {file_path for file_path in iter_record_file_paths(ctx.code_collection) if is_in_directory(file_path, root)}
+    )
+    if file_paths:
+        logging.info(f"Removing {len(file_paths)} files of {root} from {ctx.code_collection.name}")
+        pipeline = _create_index_pipeline(ctx.code_collection, False, file_paths=set())
+        pipeline.delete_files(file_paths)
+
+
+def _index_collection(
+    collection: Any, target_directories: List[str], force_reindex: bool, job: Optional[IndexJob] = None
+) -> Dict[str, Any]:
+    """
+    Helper function to index directories into a collection, from their git delta when possible.
+
+    Directories in a git work tree that were indexed before at a known commit are not walked:
+    only the files changed since that commit, plus the modified and untracked files, are
+    re-indexed or deleted. Other directories are walked in full.
+
+    The walk saves a checkpoint as it goes. If a run over the same directories was cancelled or
+    crashed, this run resumes its walk after the checkpoint, and records the git states captured
+    when the interrupted run started.
+
+    Args:
+        collection: Collection to index into
+        target_directories: List of absolute paths to directories to index
+        force_reindex: If true, walk and reindex all files even if they are unchanged
+        job: Background job to attach the pipeline to, if any
+
+    Returns:
+        Indexing statistics
+    """
+    _migrate_legacy_documents(collection)
+    collection_name = collection.name
+    walk_directories = []
+    delta_directories = []
+    changed_files = set()
+    deleted_files = set()
+    # Commit and dirty files of each git work tree, captured before indexing starts
+    git_states = {}
+
+    # Resume the walk of an interrupted run over the same directories
+    checkpoint = None
+    if ctx.checkpoint_store is not None:
+        checkpoint = ctx.checkpoint_store.get(collection_name, target_directories)
+        if checkpoint is not None and checkpoint["force_reindex"] != force_reindex:
+            checkpoint = None
+
+    for directory in target_directories:
+        if ctx.git_state_store is None or not os.path.isdir(directory):
+            walk_directories.append(directory)
+            continue
+
+        commit = get_head_commit(directory)
+        dirty = list_dirty_files(directory) if commit else None
+        if dirty is None:
+            walk_directories.append(directory)
+            continue
+        git_states[directory] = (commit, dirty)
+
+        recorded = None if force_reindex else ctx.git_state_store.get(collection_name, directory)
+        delta = get_git_delta(directory, recorded["commit"], recorded["dirty"], dirty) if recorded else None
+        if delta is None:
+            walk_directories.append(directory)
+            continue
+
+        logging.info(f"Indexing {directory} from the git delta since {recorded['commit']}")
+        delta_directories.append(directory)
+        changed_files |= delta.changed
+        deleted_files |= delta.deleted
+
+    on_checkpoint = None
+    if checkpoint is not None:
+        logging.info(f"Resuming the interrupted indexing of {target_directories} after {checkpoint['cursor']}")
+        # Files before the cursor were indexed at the states captured by the interrupted run
+        git_states = {
+            directory: (state["commit"], set(state["dirty"])) for directory, state in checkpoint["git_states"].items()
+        }
+    if ctx.checkpoint_store is not None:
+        on_checkpoint = partial(
+            ctx.checkpoint_store.set,
+            collection_name,
+            target_directories,
+            force_reindex=force_reindex,
+            git_states={
+                directory: {"commit": commit, "dirty": sorted(dirty)}
+                for directory, (commit, dirty) in git_states.items()
+            },
+        )
+
+    # Only the fingerprints of the walked directories and of the changed files are needed
+    pipeline = _create_index_pipeline(
+        collection,
+        force_reindex,
+        file_paths=changed_files,
+        directories=walk_directories,
+        resume_after=checkpoint["cursor"] if checkpoint is not None else None,
+        on_checkpoint=on_checkpoint,
+    )
+    if job is not None:
+        job.attach_pipeline(pipeline)
+    pipeline.run(walk_directories, changed_files)
+    if not pipeline.cancelled:
+        pipeline.delete_files(deleted_files)
+        # Indexed files the walk did not find were deleted or renamed since
+        if walk_directories:
+            pipeline.delete_missing_files(walk_directories)
+        if ctx.checkpoint_store is not None:
+            ctx.checkpoint_store.delete(collection_name, target_directories)
+
+    # Record the commits only if everything was indexed, so that a failed run is retried next time
+    if not pipeline.cancelled and pipeline.stats["errors"] == 0:
+        for directory, (commit, dirty) in git_states.items():
+            ctx.git_state_store.set(collection_name, directory, commit, dirty)
+
+    return {
+        **pipeline.stats,
+        "git_delta_directories": delta_directories,
+        "resumed_after": checkpoint["cursor"] if checkpoint is not None else None,
+    }
+
+
+def _index_changed_files(directory: str, changed_files: Set[str], deleted_files: Set[str]):
+    """
+    Helper function to re-index the files reported by a directory watcher
+
+    Args:
+        directory: Absolute path of the watched directory
+        changed_files: Absolute paths of changed or added files
+        deleted_files: Absolute paths of deleted files
+    """
+    # The collection is looked up on every change, since compaction, imports and enclosing repositories replace it
+    groups = _group_by_repository([directory])
+    if not groups:
+        return
+    pipeline = _create_index_pipeline(groups[0][1], False, file_paths=changed_files)
+    pipeline.run_files(changed_files)
+    pipeline.delete_files(deleted_files)
+    logging.info(f"Re-indexed watched changes: {pipeline.stats}")
+
+
+def _start_watching(target_directories: List[str]) -> List[str]:
+    """
+    Helper function to start watching directories for changes after they have been indexed
+
+    Args:
+        target_directories: List of absolute paths to directories to watch
+
+    Returns:
+        List of all the watched directories
+    """
+    for directory in target_directories:
+        if directory in ctx.watchers or not os.path.isdir(directory):
+            continue
+        watcher = DirectoryWatcher(
+            [directory],
+            on_changes=partial(_index_changed_files, directory),
+            debounce_seconds=INDEX_WATCH_DEBOUNCE_SECONDS,
+            poll_seconds=INDEX_WATCH_POLL_SECONDS,
+            backend=INDEX_WATCH_BACKEND,
+            excluded_directories=INDEX_EXCLUDE_DIRS,
+        )
+        watcher.start()
+        ctx.watchers[directory] = watcher
+    return list(ctx.watchers)
+
+
+async def _run_index_job(job: IndexJob):
+    """Run an index job in background, keeping the blocking work in an executor"""
+    loop = asyncio.get_running_loop()
+    job.status = JOB_RUNNING
+    job.started_at = time.time()
+    try:
+        job.result = await loop.run_in_executor(None, _run_indexing, job.target_directories, job.force_reindex, job)
+        job.status = JOB_CANCELLED if job.cancel_requested else JOB_COMPLETED
+        if job.watch and job.status == JOB_COMPLETED:
+            _start_watching(job.target_directories)
+        logging.info(f"Index job {job.job_id} {job.status}")
+    except asyncio.CancelledError:
+        job.cancel()
+        job.status = JOB_CANCELLED
+        raise
+    except Exception as e:
+        logging.error(f"Error during index job {job.job_id}: {str(e)}")
+        job.status = JOB_FAILED
+        job.error = str(e)
+    finally:
+        job.finished_at = time.time()
+
+
 @mcp.tool()
-def index_repository(target_directories: List[str], force_reindex: bool = False) -> str:
+def index_repository(
+    target_directories: List[str], force_reindex: bool = False, background: bool = False, watch: bool = False
+) -> str:
     """
     Index code files from the specified directories into ChromaDB for later search.
 
-    This tool scans the specified directories for code files, indexes their content
-    in ChromaDB, and updates existing entries if they have changed. This enables
-    high-quality semantic search over the codebase.
+    This tool scans the specified directories for code files, splits them into
+    overlapping chunks of lines, indexes the chunks in ChromaDB, and updates
+    existing entries if they have changed. A file is only re-embedded when its
+    fingerprint (size, modification time and content hash) differs from the one
+    recorded when it was indexed. Directories in a git work tree that were indexed
+    before are not walked again: only the files changed since the indexed commit,
+    plus modified and untracked files, are checked. This enables high-quality
+    semantic search over the codebase.
+
+    Large repositories can take minutes to index. With background set to true the
+    indexing runs as a background job and this tool returns its job ID right away;
+    use get_index_job_status to follow its progress and cancel_index_job to stop it.
+
+    With watch set to true the directories keep being watched once indexed, and
+    changed, added or deleted files are re-indexed automatically until
+    stop_watching is called.
+
+    Each directory is indexed into its own collection as a repository, unless it
+    is inside a repository indexed before; see list_repositories.
 
     Args:
         target_directories: List of absolute paths to directories to index
-        force_reindex: If true, will reindex all files even if they already exist in the index
+        force_reindex: If true, will reindex all files even if they are unchanged since they were indexed
+        background: If true, start a background index job and return its job ID immediately
+        watch: If true, keep watching the directories and re-index changed files automatically
 
     Returns:
-        JSON string containing indexing statistics and results
+        JSON string containing indexing statistics and results, or the job ID of the background job
     """
     if not ctx.is_initialized:
         return json.dumps({"error": "ChromaDB and embedding model not yet initialized"})
@@ -227,143 +989,602 @@ def index_repository(target_directories: List[str], force_reindex: bool = False)
     try:
         logging.info(f"Indexing code repositories: {target_directories}")
 
-        # Statistics to track
-        stats = {
-            "files_scanned": 0,
-            "files_indexed": 0,
-            "files_updated": 0,
-            "files_skipped": 0,
-            "errors": 0,
-            "total_tokens_processed": 0,
+        if background:
+            job = IndexJob(target_directories=list(target_directories), force_reindex=force_reindex, watch=watch)
+            ctx.index_jobs[job.job_id] = job
+            job.task = asyncio.get_running_loop().create_task(_run_index_job(job))
+            return json.dumps(
+                {
+                    "status": "started",
+                    "message": "Background index job started. Use get_index_job_status to follow its progress.",
+                    "job_id": job.job_id,
+                },
+                indent=2,
+            )
+
+        stats = _run_indexing(target_directories, force_reindex)
+
+        result = {
+            "status": "success",
+            "message": "Repository indexing completed successfully",
+            "statistics": stats,
         }
+        if ctx.repository_registry is None:
+            result["collection_size"] = ctx.code_collection.count()
+            if ctx.file_manifest is not None:
+                result["indexed_files"] = ctx.file_manifest.stats(ctx.code_collection.name)
+        else:
+            for repository in stats["repositories"]:
+                repository["collection_size"] = _get_collection(repository["collection"]).count()
+                if ctx.file_manifest is not None:
+                    repository["indexed_files"] = ctx.file_manifest.stats(repository["collection"])
+            result["collection_size"] = sum(repository["collection_size"] for repository in stats["repositories"])
+        if watch:
+            result["watched_directories"] = _start_watching(target_directories)
+        return json.dumps(result, indent=2)
+
+    except Exception as e:
+        logging.error(f"Error during repository indexing: {str(e)}")
+        return json.dumps({"error": str(e)})
+
+
+@mcp.tool()
+def get_index_job_status(job_id: Optional[str] = None) -> str:
+    """
+    Get the status of background index jobs started with index_repository.
+
+    For each job the output reports its state (pending, running, completed, failed
+    or cancelled), the number of files done and remaining, the throughput in files
+    per second, an estimate of the remaining time and the number of errors.
+
+    Args:
+        job_id: ID of the job returned by index_repository, or empty to list all jobs
+
+    Returns:
+        JSON string with the status of the job, or of all jobs
+    """
+    if job_id is None:
+        return json.dumps({"jobs": [job.status_report() for job in ctx.index_jobs.values()]}, indent=2)
+
+    job = ctx.index_jobs.get(job_id)
+    if job is None:
+        return json.dumps({"error": f"Index job not found: {job_id}"})
+    return json.dumps(job.status_report(), indent=2)
+
+
+@mcp.tool()
+def cancel_index_job(job_id: str) -> str:
+    """
+    Cancel a background index job started with index_repository.
+
+    Files written before the job stops stay indexed, so running index_repository
+    again later only processes the remaining files.
+
+    Args:
+        job_id: ID of the job returned by index_repository
+
+    Returns:
+        JSON string with the status of the job
+    """
+    job = ctx.index_jobs.get(job_id)
+    if job is None:
+        return json.dumps({"error": f"Index job not found: {job_id}"})
+    if job.is_finished:
+        return json.dumps({"error": f"Index job already {job.status}: {job_id}"})
+
+    logging.info(f"Cancelling index job {job_id}")
+    job.cancel()
+    return json.dumps({"status": "cancelling", "job_id": job_id})
+
+
+@mcp.tool()
+def stop_watching(target_directories: Optional[List[str]] = None) -> str:
+    """
+    Stop watching directories that were indexed with watch mode enabled.
+
+    Args:
+        target_directories: List of absolute paths to directories to stop watching, or empty to stop all
+
+    Returns:
+        JSON string with the directories that stopped being watched and the ones still watched
+    """
+    directories = list(ctx.watchers) if target_directories is None else target_directories
+    stopped = []
+    for directory in directories:
+        watcher = ctx.watchers.pop(directory, None)
+        if watcher is not None:
+            watcher.stop(timeout=5)
+            stopped.append(directory)
 
-        # Get existing document IDs for update/skip logic
-        existing_ids = set()
-        if ctx.code_collection.count() > 0:
-            # Fetch all existing IDs - this could be optimized for large collections
-            existing_ids = set(ctx.code_collection.get()["ids"])
-
-        # Define file extensions considered as code
-        code_extensions = [
-            ".py",
-            ".js",
-            ".ts",
-            ".java",
-            ".cpp",
-            ".c",
-            ".h",
-            ".go",
-            ".rs",
-            ".jsx",
-            ".tsx",
-            ".php",
-            ".rb",
-            ".swift",
-            ".kt",
-            ".scala",
-            ".sh",
+    logging.info(f"Stopped watching {stopped}")
+    return json.dumps({"stopped": stopped, "watched_directories": list(ctx.watchers)}, indent=2)
+
+
+def _prune_collection(collection: Any, target_directories: Optional[List[str]]) -> Dict[str, int]:
+    """
+    Helper function to delete the missing files of a collection
+
+    Args:
+        collection: Collection to clean up
+        target_directories: List of absolute paths to directories to clean up, all indexed files if not given
+
+    Returns:
+        Dictionary with the number of files checked and of files and chunks deleted
+    """
+    _migrate_legacy_documents(collection)
+    collection_size_before = collection.count()
+    if ctx.file_manifest is not None:
+        pipeline = _create_index_pipeline(collection, False, directories=target_directories)
+        indexed_files = list(pipeline.existing_fingerprints)
+    else:
+        # Only the existence of the files is checked, so their IDs are enough
+        indexed_files = [
+            file_path
+            for file_path in iter_indexed_file_paths(collection)
+            if target_directories is None or any(is_in_directory(file_path, d) for d in target_directories)
         ]
+        pipeline = _create_index_pipeline(collection, False, file_paths=set())
+    stats = pipeline.delete_missing_files(target_directories, indexed_files)
+    collection_size = collection.count()
+    return {
+        "files_checked": len(indexed_files),
+        "files_deleted": stats["files_deleted"],
+        "chunks_deleted": collection_size_before - collection_size,
+        "errors": stats["errors"],
+        "collection_size": collection_size,
+    }
 
-        # Track processed files to avoid duplicates
-        processed_files = set()
 
-        # Process each directory
-        for directory in target_directories:
-            if not os.path.exists(directory) or not os.path.isdir(directory):
-                logging.warning(f"Directory does not exist or is not a directory: {directory}")
-                continue
+@mcp.tool()
+def prune_index(target_directories: Optional[List[str]] = None) -> str:
+    """
+    Remove deleted, renamed and newly ignored files from the index.
+
+    Indexed files that no longer exist on disk keep showing up in search results
+    until they are removed. index_repository removes the ones it notices while
+    walking the directories; this tool checks every indexed file under the target
+    directories without indexing anything, and deletes the missing ones in bulk.
+
+    Args:
+        target_directories: List of absolute paths to directories to clean up, all indexed files if not given
+
+    Returns:
+        JSON string containing the number of deleted files and chunks
+    """
+    if not ctx.is_initialized:
+        return json.dumps({"error": "ChromaDB and embedding model not yet initialized"})
+
+    try:
+        logging.info(f"Pruning deleted files from the index: {target_directories or 'all directories'}")
+        result = {"files_checked": 0, "files_deleted": 0, "chunks_deleted": 0, "errors": 0, "collection_size": 0}
+        for _, collection in _get_repository_collections(target_directories):
+            for key, value in _prune_collection(collection, target_directories).items():
+                result[key] += value
+
+        return json.dumps({"status": "success", **result}, indent=2)
+
+    except Exception as e:
+        logging.error(f"Error while pruning the index: {str(e)}")
+        return json.dumps({"error": str(e)})
+
+
+@mcp.tool()
+def compact_index(repositories: Optional[List[str]] = None) -> str:
+    """
+    Rebuild the vector indexes from their live vectors and vacuum the database.
+
+    Updating and deleting files leaves deleted vectors in the HNSW graphs and old
+    entries in the SQLite store, so the database keeps growing and queries slow down.
+    This tool copies the live vectors of each collection into a fresh index, built
+    with the parameters set with configure_index (or its current ones if none are
+    set), then vacuums the SQLite store.
+    It blocks searches and indexing while it runs, so schedule it in a maintenance
+    window; it refuses to run while background index jobs are running or directories
+    are watched, since their writes could go to a collection being replaced.
+
+    Args:
+        repositories: Absolute paths of indexed directories, or directory names of indexed repositories, to
+            compact; all repositories if not given
+
+    Returns:
+        JSON string with the space reclaimed and the median query latency of each collection before and after
+    """
+    if not ctx.is_initialized:
+        return json.dumps({"error": "ChromaDB and embedding model not yet initialized"})
+    if any(not job.is_finished for job in ctx.index_jobs.values()):
+        return json.dumps({"error": "Background index jobs are running, wait for them or cancel them first"})
+    if ctx.watchers:
+        return json.dumps({"error": "Directories are being watched, stop watching them first with stop_watching"})
+
+    try:
+        logging.info(f"Compacting the index: {repositories or 'all repositories'}")
+        persist_directory = ctx.vector_store.persist_directory
+        bytes_before = get_directory_size(persist_directory) if persist_directory else None
+        metadata = to_collection_metadata(ctx.hnsw_config) or None
+
+        collections = []
+        for root, collection in _get_repository_collections(repositories):
+            query_embeddings = sample_query_embeddings(collection)
+            latency_before = measure_query_latency(collection, query_embeddings)
+            rebuilt = rebuild_collection(ctx.vector_store, collection, metadata, ctx.query_embedding_function)
+            if collection is ctx.code_collection:
+                ctx.code_collection = rebuilt
+            else:
+                ctx.repository_collections[rebuilt.name] = rebuilt
+            collections.append(
+                {
+                    "collection": rebuilt.name,
+                    "repository": root,
+                    "records": rebuilt.count(),
+                    "latency_before_ms": latency_before,
+                    "latency_after_ms": measure_query_latency(rebuilt, query_embeddings),
+                }
+            )
 
-            # Walk through the directory tree
-            for root, _, files in os.walk(directory):
-                for file in files:
-                    file_path = os.path.join(root, file)
-
-                    # Skip if already processed (in case of overlapping directories)
-                    if file_path in processed_files:
-                        continue
-
-                    # Only consider files with code extensions
-                    file_ext = os.path.splitext(file_path)[1].lower()
-                    if file_ext not in code_extensions:
-                        continue
-
-                    stats["files_scanned"] += 1
-                    processed_files.add(file_path)
-
-                    try:
-                        # Generate a unique document ID based on file path
-                        doc_id = f"file:{file_path}"
-
-                        # Check if file already exists in index
-                        if doc_id in existing_ids and not force_reindex:
-                            # Check if file has been modified since last indexing
-                            # In a real implementation, we would store and check modification times
-                            # For simplicity, we'll assume no change and skip
-                            stats["files_skipped"] += 1
-                            continue
-
-                        # Read file content
-                        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
-                            content = f.read()
-
-                        # Skip empty files
-                        if not content.strip():
-                            stats["files_skipped"] += 1
-                            continue
-
-                        # Prepare metadata
-                        metadata = {
-                            "file_path": file_path,
-                            "file_type": file_ext[1:],  # Remove the dot
-                            "file_size": os.path.getsize(file_path),
-                            "last_modified": os.path.getmtime(file_path),
-                            "indexed_at": time(),
-                        }
-
-                        # If document exists, update it
-                        if doc_id in existing_ids:
-                            ctx.code_collection.update(ids=[doc_id], documents=[content], metadatas=[metadata])
-                            stats["files_updated"] += 1
-                        else:
-                            # Otherwise, add new document
-                            ctx.code_collection.add(ids=[doc_id], documents=[content], metadatas=[metadata])
-                            stats["files_indexed"] += 1
-
-                        # Rough estimate of tokens processed
-                        stats["total_tokens_processed"] += len(content) // 4
-
-                    except Exception as e:
-                        logging.error(f"Error indexing file {file_path}: {str(e)}")
-                        stats["errors"] += 1
+        ctx.vector_store.vacuum()
+        bytes_after = get_directory_size(persist_directory) if persist_directory else None
 
         return json.dumps(
             {
                 "status": "success",
-                "message": "Repository indexing completed successfully",
-                "statistics": stats,
-                "collection_size": ctx.code_collection.count(),
+                "collections": collections,
+                "bytes_before": bytes_before,
+                "bytes_after": bytes_after,
+                "bytes_reclaimed": bytes_before - bytes_after if persist_directory else None,
             },
             indent=2,
         )
 
     except Exception as e:
-        logging.error(f"Error during repository indexing: {str(e)}")
+        logging.error(f"Error while compacting the index: {str(e)}")
+        return json.dumps({"error": str(e)})
+
+
+@mcp.tool()
+def configure_index(
+    space: Optional[str] = None,
+    M: Optional[int] = None,
+    construction_ef: Optional[int] = None,
+    search_ef: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    sync_threshold: Optional[int] = None,
+) -> str:
+    """
+    Get or set the HNSW parameters of the vector indexes.
+
+    Higher M and construction_ef build a better connected graph, with higher recall
+    but slower indexing and more memory. Higher search_ef raises recall at the cost
+    of query latency. ChromaDB builds the index of a collection when it is created,
+    so new parameters apply to the repositories indexed for the first time afterwards,
+    and to existing collections once they are rebuilt with compact_index. Called
+    without arguments, this tool only reports the configuration.
+
+    Args:
+        space: Distance function, "l2", "cosine" or "ip" (inner product)
+        M: Maximum number of neighbours of each node of the graph
+        construction_ef: Number of candidates explored when inserting a vector
+        search_ef: Number of candidates explored when searching
+        batch_size: Number of vectors buffered before they are added to the index
+        sync_threshold: Number of vectors added before the index is saved to disk
+
+    Returns:
+        JSON string with the configured parameters and the parameters of each existing collection
+    """
+    if not ctx.is_initialized:
+        return json.dumps({"error": "ChromaDB and embedding model not yet initialized"})
+
+    try:
+        updates = {
+            name: value
+            for name, value in (
+                ("space", space),
+                ("M", M),
+                ("construction_ef", construction_ef),
+                ("search_ef", search_ef),
+                ("batch_size", batch_size),
+                ("sync_threshold", sync_threshold),
+            )
+            if value is not None
+        }
+        if updates:
+            logging.info(f"Setting the HNSW parameters {updates}")
+            stored = ctx.hnsw_config_store.update(updates)
+            ctx.hnsw_config = {**validate_hnsw_config(HNSW_ENV_CONFIG), **stored}
+
+        config = {**HNSW_DEFAULTS, **ctx.hnsw_config}
+        collections = []
+        for root, collection in _get_repository_collections():
+            hnsw = from_collection_metadata(collection.metadata)
+            collections.append(
+                {"collection": collection.name, "repository": root, "hnsw": hnsw, "matches_config": hnsw == config}
+            )
+        return json.dumps({"status": "success", "config": config, "collections": collections}, indent=2)
+
+    except Exception as e:
+        logging.error(f"Error while configuring the index: {str(e)}")
+        return json.dumps({"error": str(e)})
+
+
+@mcp.tool()
+def list_repositories() -> str:
+    """
+    List the indexed repositories.
+
+    Every directory indexed with index_repository is a repository with its own
+    index, unless it is inside a repository indexed before. The repositories can
+    be passed to codebase_search to search only some of them.
+
+    Returns:
+        JSON string with the root directory, collection, size and storage statistics of each repository
+    """
+    if not ctx.is_initialized:
+        return json.dumps({"error": "ChromaDB and embedding model not yet initialized"})
+    if ctx.repository_registry is None:
+        return json.dumps({"error": "Per-repository collections are disabled (INDEX_COLLECTION_PER_REPOSITORY)"})
+
+    try:
+        repositories = []
+        for root, record in ctx.repository_registry.list().items():
+            collection = _get_collection(record["collection"])
+            repository = {
+                "root": root,
+                "collection": record["collection"],
+                "registered_at": record["registered_at"],
+                "collection_size": collection.count(),
+                "storage": collection.stats(),
+            }
+            if ctx.file_manifest is not None:
+                repository["indexed_files"] = ctx.file_manifest.stats(record["collection"])
+            repositories.append(repository)
+        return json.dumps({"repositories": repositories}, indent=2)
+
+    except Exception as e:
+        logging.error(f"Error while listing repositories: {str(e)}")
         return json.dumps({"error": str(e)})
 
 
 @mcp.tool()
-def codebase_search(query: str, limit: int = 10, min_relevance: float = 0.0) -> str:
+def export_index(repository: str, output_path: str) -> str:
+    """
+    Export the index of a repository to a portable snapshot file.
+
+    The snapshot holds the vectors, chunks and metadata of the repository, the
+    records of its indexed files, the embedding model, the HNSW parameters and the
+    commit it was indexed at. It can be loaded with import_index into another
+    data root, e.g. to index a branch once in CI and load it on every machine
+    instead of embedding the same files again.
+
+    Args:
+        repository: Absolute path inside the repository, or directory name of its root
+        output_path: Absolute path of the snapshot file to write
+
+    Returns:
+        JSON string with the snapshot path and its description
+    """
+    if not ctx.is_initialized:
+        return json.dumps({"error": "ChromaDB and embedding model not yet initialized"})
+    if ctx.repository_registry is None:
+        return json.dumps({"error": "Per-repository collections are disabled (INDEX_COLLECTION_PER_REPOSITORY)"})
+    if any(not job.is_finished for job in ctx.index_jobs.values()):
+        return json.dumps({"error": "Background index jobs are running, wait for them or cancel them first"})
+
+    try:
+        collections = _get_repository_collections([repository])
+        if len(collections) > 1:
+            return json.dumps({"error": f"{repository} contains several repositories, export them one at a time"})
+        [(root, collection)] = collections
+        logging.info(f"Exporting the index of {root} to {output_path}")
+        manifest_records = None
+        if ctx.file_manifest is not None:
+            manifest_records = list(ctx.file_manifest.get_files(collection.name).values())
+        header = export_snapshot(
+            collection,
+            output_path,
+            {
+                "repository": root,
+                "collection": collection.name,
+                "embedding_model": ctx.embedding_model,
+                "git_state": ctx.git_state_store.get(collection.name, root) if ctx.git_state_store else None,
+            },
+            manifest_records,
+        )
+        return json.dumps({"status": "success", "snapshot_path": output_path, "snapshot": header}, indent=2)
+
+    except Exception as e:
+        logging.error(f"Error while exporting the index: {str(e)}")
+        return json.dumps({"error": str(e)})
+
+
+@mcp.tool()
+def import_index(snapshot_path: str, target_directory: Optional[str] = None) -> str:
+    """
+    Import the index of a repository from a snapshot written by export_index.
+
+    The snapshot replaces the index of the repository, if it was indexed before.
+    Its paths are moved to target_directory, so that a snapshot built in another
+    checkout, e.g. in CI, matches the local one. Files changed since the snapshot
+    was taken are reindexed by the next index_repository call, without embedding
+    the unchanged ones again.
+
+    Args:
+        snapshot_path: Absolute path of the snapshot file
+        target_directory: Absolute path of the local checkout of the repository; the root the snapshot was
+            taken from if not given
+
+    Returns:
+        JSON string with the imported repository and the number of imported chunks and files
+    """
+    if not ctx.is_initialized:
+        return json.dumps({"error": "ChromaDB and embedding model not yet initialized"})
+    if ctx.repository_registry is None:
+        return json.dumps({"error": "Per-repository collections are disabled (INDEX_COLLECTION_PER_REPOSITORY)"})
+    if any(not job.is_finished for job in ctx.index_jobs.values()):
+        return json.dumps({"error": "Background index jobs are running, wait for them or cancel them first"})
+
+    try:
+        header = read_snapshot_header(snapshot_path)
+        if header["embedding_model"] != ctx.embedding_model:
+            return json.dumps(
+                {
+                    "error": f"The snapshot was embedded with {header['embedding_model']}, "
+                    f"the server uses {ctx.embedding_model}"
+                }
+            )
+        source_root = header["repository"]
+        root = os.path.abspath(target_directory) if target_directory else source_root
+        if not os.path.isdir(root):
+            return json.dumps({"error": f"Directory does not exist or is not a directory: {root}"})
+        enclosing_root = ctx.repository_registry.find(root)
+        if enclosing_root is not None and enclosing_root != root:
+            return json.dumps({"error": f"{root} is part of the indexed repository {enclosing_root}"})
+
+        logging.info(f"Importing the index of {source_root} from {snapshot_path} into {root}")
+        # The snapshot replaces the repository indexed at the same root, and the ones inside it
+        for registered_root in ctx.repository_registry.list():
+            if registered_root == root or is_in_directory(registered_root, root):
+                _drop_repository(registered_root)
+        collection_name = ctx.repository_registry.register(root)["collection"]
+        collection = ctx.vector_store.create_collection(
+            name=collection_name,
+            embedding_function=ctx.query_embedding_function,
+            metadata=header["collection_metadata"],
+        )
+        ctx.repository_collections[collection_name] = collection
+
+        for ids, vectors, documents, metadatas in iter_snapshot_pages(snapshot_path):
+            collection.add(
+                ids=[remap_chunk_id(chunk_id, source_root, root) for chunk_id in ids],
+                embeddings=vectors,
+                documents=documents,
+                metadatas=[
+                    {**metadata, "file_path": remap_path(metadata["file_path"], source_root, root)}
+                    for metadata in metadatas
+                ],
+            )
+
+        manifest_records = read_snapshot_manifest(snapshot_path)
+        if ctx.file_manifest is not None and manifest_records is not None:
+            ctx.file_manifest.put_files(
+                collection_name,
+                [
+                    {
+                        **record,
+                        "file_path": remap_path(record["file_path"], source_root, root),
+                        "chunk_ids": [remap_chunk_id(chunk_id, source_root, root) for chunk_id in record["chunk_ids"]],
+                    }
+                    for record in manifest_records
+                ],
+            )
+        elif ctx.file_manifest is not None:
+            _sync_manifest(collection)
+
+        # The next run indexes the git delta since the snapshot's commit instead of walking the repository
+        if ctx.git_state_store is not None and header.get("git_state"):
+            ctx.git_state_store.set(
+                collection_name,
+                root,
+                header["git_state"]["commit"],
+                {remap_path(file_path, source_root, root) for file_path in header["git_state"]["dirty"]},
+            )
+        _drop_shared_collection_files(root)
+
+        return json.dumps(
+            {
+                "status": "success",
+                "repository": root,
+                "collection": collection_name,
+                "snapshot_repository": source_root,
+                "collection_size": collection.count(),
+                "indexed_files": len(manifest_records) if manifest_records is not None else None,
+            },
+            indent=2,
+        )
+
+    except Exception as e:
+        logging.error(f"Error while importing the index: {str(e)}")
+        return json.dumps({"error": str(e)})
+
+
+@mcp.tool()
+def measure_quantization(repositories: Optional[List[str]] = None) -> str:
+    """
+    Measure the recall and latency of searches on binary quantized vectors against exact searches.
+
+    Only available with the flat vector store (VECTOR_STORE=flat). Stored vectors of
+    each collection are searched exactly, then on binary codes with candidates
+    reranked from the full-precision vectors, for several rerank factors. Use it to
+    pick FLAT_STORE_QUANTIZATION and FLAT_STORE_RERANK_FACTOR on a large index.
+
+    Args:
+        repositories: Repositories to measure, as for codebase_search, or empty for all of them
+
+    Returns:
+        JSON string with the memory held by the vectors and by their binary codes, the median latency of exact
+        searches, and the recall and median latency of each rerank factor, for each collection
+    """
+    if not ctx.is_initialized:
+        return json.dumps({"error": "ChromaDB and embedding model not yet initialized"})
+    if ctx.vector_store.backend != "flat":
+        return json.dumps({"error": "Quantized searches need the flat vector store (VECTOR_STORE=flat)"})
+
+    try:
+        collections = []
+        for root, collection in _get_repository_collections(repositories):
+            query_embeddings = sample_query_embeddings(collection)
+            if not query_embeddings:
+                continue
+            report = measure_quantized_search(collection, query_embeddings, LATENCY_RESULTS)
+            collections.append({"collection": collection.name, "repository": root, **report})
+        return json.dumps({"quantization": ctx.vector_store.quantization, "collections": collections}, indent=2)
+
+    except Exception as e:
+        logging.error(f"Error while measuring quantization: {str(e)}")
+        return json.dumps({"error": str(e)})
+
+
+def _embed_query(query: str) -> List[float]:
+    """Helper function to embed a search query in the server process, or to get its vector from the query cache"""
+    if ctx.query_embedding_cache is not None:
+        cached = ctx.query_embedding_cache.get(query)
+        if cached is not None:
+            return cached
+    embedding_function = ctx.query_embedding_function or ctx.embedding_function
+    query_embedding = [float(value) for value in embedding_function([query])[0]]
+    if ctx.query_embedding_cache is not None:
+        ctx.query_embedding_cache.put(query, query_embedding)
+    return query_embedding
+
+
+@mcp.tool()
+def codebase_search(
+    query: str,
+    limit: int = 10,
+    min_relevance: float = 0.0,
+    repositories: Optional[List[str]] = None,
+    search_ef: Optional[int] = None,
+) -> str:
     """
     Find snippets of code from the indexed codebase most relevant to the search query.
 
-    This performs semantic search over previously indexed code files.
-    Results are ranked by relevance to the query. For best results, index your
-    repositories first using the index_repository tool.
+    This performs semantic search over previously indexed code files. Files are
+    indexed as overlapping chunks of lines, so each result is a chunk of a file
+    together with its start and end line. Results are ranked by relevance to the
+    query. For best results, index your repositories first using the
+    index_repository tool.
+
+    Every indexed repository has its own index. Pass repositories to search only
+    some of them, which is faster and leaves out results from unrelated code.
+
+    The index search is approximate. Pass a search_ef higher than the configured one
+    (see configure_index) for high-recall queries, at the cost of latency.
 
     Args:
         query: Search query describing what you're looking for
         limit: Maximum number of results to return (default: 10)
         min_relevance: Minimum relevance score threshold (0.0 to 1.0)
+        repositories: Absolute paths of indexed directories, or directory names of indexed repositories, to search
+            in; all repositories if not given
+        search_ef: Number of candidates explored in each index for this query, the configured search_ef if not given
 
     Returns:
         JSON string containing search results with relevant code snippets
@@ -373,60 +1594,93 @@ def codebase_search(query: str, limit: int = 10, min_relevance: float = 0.0) ->
 
     try:
         logging.info(f"Searching codebase for: {query}")
+        collections = [
+            (root, collection, collection.count()) for root, collection in _get_repository_collections(repositories)
+        ]
 
         # Check if we have any indexed documents
-        if ctx.code_collection.count() == 0:
+        if not any(count for _, _, count in collections):
             return json.dumps(
                 {"message": "No code has been indexed yet. Use the index_repository tool first.", "results": []}
             )
 
-        # Process the search query with ChromaDB
+        # Process the search query with ChromaDB, embedding it once for every collection
         results = []
+        query_embedding = _embed_query(query)
 
-        # Search in collection
-        search_results = ctx.code_collection.query(
-            query_texts=[query], n_results=min(limit, ctx.code_collection.count())
-        )
-
-        # Format results
-        for i, (doc_id, distance) in enumerate(zip(search_results["ids"][0], search_results["distances"][0])):
-            metadata = (
-                search_results["metadatas"][0][i]
-                if "metadatas" in search_results and search_results["metadatas"]
-                else {}
-            )
-            document = (
-                search_results["documents"][0][i]
-                if "documents" in search_results and search_results["documents"]
-                else ""
-            )
-
-            # Calculate relevance score (1.0 is perfect match, 0.0 is completely irrelevant)
-            relevance_score = 1.0 - (distance if distance else 0)
-
-            # Skip results below minimum relevance threshold
-            if relevance_score < min_relevance:
+        # The HNSW search explores max(search_ef, n_results) candidates, so fetching search_ef neighbours raises
+        # the recall of this query without rebuilding the index
+        n_results = max(limit, search_ef or 0)
+        for root, collection, count in collections:
+            if count == 0:
                 continue
-
-            # Extract a snippet of the document (context around the most relevant part)
-            snippet = document[:1000] + "..." if len(document) > 1000 else document
-
-            results.append(
-                {
-                    "id": doc_id,
-                    "relevance_score": relevance_score,
-                    "file_path": metadata.get("file_path", "Unknown"),
-                    "file_type": metadata.get("file_type", "Unknown"),
-                    "last_modified": metadata.get("last_modified", 0),
-                    "snippet": snippet,
-                }
-            )
+            results.extend(_query_collection(collection, root, query_embedding, min(n_results, count), min_relevance))
 
         # Sort by relevance score (highest first)
         results.sort(key=lambda x: x["relevance_score"], reverse=True)
+        results = results[:limit]
 
         return json.dumps({"query": query, "total_results": len(results), "results": results}, indent=2)
 
     except Exception as e:
         logging.error(f"Error during codebase search: {str(e)}")
-        return json.dumps({"error": str(e)})
\ No newline at end of file
+        return json.dumps({"error": str(e)})
+
+
+def _query_collection(
+    collection: Any, root: Optional[str], query_embedding: List[float], n_results: int, min_relevance: float
+) -> List[Dict[str, Any]]:
+    """
+    Helper function to search a collection and format the results
+
+    Args:
+        collection: Collection to search
+        root: Root of the repository indexed into the collection, if any
+        query_embedding: Embedding of the search query
+        n_results: Number of nearest chunks to fetch
+        min_relevance: Minimum relevance score threshold (0.0 to 1.0)
+
+    Returns:
+        List of results above the relevance threshold
+    """
+    results = []
+    search_results = collection.query(query_embeddings=[query_embedding], n_results=n_results)
+
+    # Format results
+    for i, (doc_id, distance) in enumerate(zip(search_results["ids"][0], search_results["distances"][0])):
+        metadata = (
+            search_results["metadatas"][0][i]
+            if "metadatas" in search_results and search_results["metadatas"]
+            else {}
+        )
+        document = (
+            search_results["documents"][0][i]
+            if "documents" in search_results and search_results["documents"]
+            else ""
+        )
+
+        # Calculate relevance score (1.0 is perfect match, 0.0 is completely irrelevant)
+        relevance_score = 1.0 - (distance if distance else 0)
+
+        # Skip results below minimum relevance threshold
+        if relevance_score < min_relevance:
+            continue
+
+        # Extract a snippet of the document (context around the most relevant part)
+        snippet = document[:1000] + "..." if len(document) > 1000 else document
+
+        results.append(
+            {
+                "id": doc_id,
+                "relevance_score": relevance_score,
+                "file_path": metadata.get("file_path", "Unknown"),
+                "file_type": metadata.get("file_type", "Unknown"),
+                "start_line": metadata.get("start_line"),
+                "end_line": metadata.get("end_line"),
+                "last_modified": metadata.get("last_modified", 0),
+                "snippet": snippet,
+                "repository": root,
+            }
+        )
+
+    return results
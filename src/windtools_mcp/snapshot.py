@@ -0,0 +1,161 @@
+import io
+import json
+import os
+import os.path
+import time
+import zipfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .indexing import SCAN_PAGE_SIZE, parse_chunk_id
+
+# Version of the snapshot layout, bumped when it changes incompatibly
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Members of a snapshot archive
+HEADER_FILE = "snapshot.json"
+MANIFEST_FILE = "manifest.json"
+PAGES_FOLDER = "pages"
+
+
+def remap_path(path: str, old_root: str, new_root: str) -> str:
+    """
+    Move a path from one repository root to another, e.g. from the CI checkout to a developer's one
+
+    Args:
+        path: Absolute path under the old root
+        old_root: Root the path was indexed under
+        new_root: Root the path is imported under
+
+    Returns:
+        The path under the new root, or the path unchanged if it is not under the old root
+    """
+    if path == old_root:
+        return new_root
+    if not path.startswith(os.path.join(old_root, "")):
+        return path
+    return os.path.join(new_root, os.path.relpath(path, old_root))
+
+
+def remap_chunk_id(chunk_id: str, old_root: str, new_root: str) -> str:
+    """Move the file path in a chunk ID from one repository root to another"""
+    file_path = parse_chunk_id(chunk_id)
+    if file_path is None:
+        return chunk_id
+    return f"file:{remap_path(file_path, old_root, new_root)}{chunk_id[len('file:') + len(file_path):]}"
+
+
+def export_snapshot(
+    collection: Any, path: str, header: Dict[str, Any], manifest_records: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    """
+    Write the records of a collection to a self-contained snapshot archive
+
+    Vectors are stored as float32 NumPy arrays and documents and metadata as JSON, one page of
+    records at a time, so that neither exporting nor importing loads the whole collection in memory.
+
+    Args:
+        collection: Collection to export
+        path: Path of the archive to write
+        header: Description of the snapshot, e.g. the repository root and the embedding model
+        manifest_records: Records of the indexed files of the collection, if there is a manifest
+
+    Returns:
+        The header written to the archive, with the number of records and pages
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    records = 0
+    pages = 0
+    with zipfile.ZipFile(temporary_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        while True:
+            page = collection.get(
+                include=["embeddings", "documents", "metadatas"], limit=SCAN_PAGE_SIZE, offset=records
+            )
+            if not page["ids"]:
+                break
+            vectors = io.BytesIO()
+            np.save(vectors, np.asarray(page["embeddings"], dtype=np.float32))
+            # Vectors hardly compress, store them as they are so that they load fast
+            archive.writestr(f"{PAGES_FOLDER}/{pages:05d}.npy", vectors.getvalue(), compress_type=zipfile.ZIP_STORED)
+            archive.writestr(
+                f"{PAGES_FOLDER}/{pages:05d}.json",
+                json.dumps({"ids": page["ids"], "documents": page["documents"], "metadatas": page["metadatas"]}),
+            )
+            records += len(page["ids"])
+            pages += 1
+            if len(page["ids"]) < SCAN_PAGE_SIZE:
+                break
+
+        if manifest_records is not None:
+            archive.writestr(MANIFEST_FILE, json.dumps(manifest_records))
+        header = {
+            **header,
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "collection_metadata": collection.metadata,
+            "records": records,
+            "pages": pages,
+            "has_manifest": manifest_records is not None,
+            "created_at": time.time(),
+        }
+        archive.writestr(HEADER_FILE, json.dumps(header, indent=2))
+    os.replace(temporary_path, path)
+    return header
+
+
+def read_snapshot_header(path: str) -> Dict[str, Any]:
+    """
+    Read the description of a snapshot archive
+
+    Args:
+        path: Path of the archive
+
+    Returns:
+        The header of the snapshot
+
+    Raises:
+        ValueError: If the file is not a snapshot or was written in an unsupported format
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            header = json.loads(archive.read(HEADER_FILE))
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise ValueError(f"Not an index snapshot: {path}") from e
+    if header.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format version: {header.get('format_version')}")
+    return header
+
+
+def iter_snapshot_pages(path: str) -> Iterator[Tuple[List[str], np.ndarray, List[str], List[Dict[str, Any]]]]:
+    """
+    Read the records of a snapshot archive page by page
+
+    Args:
+        path: Path of the archive
+
+    Returns:
+        Iterator over tuples of IDs, vectors, documents and metadata
+    """
+    with zipfile.ZipFile(path) as archive:
+        pages = json.loads(archive.read(HEADER_FILE))["pages"]
+        for page_number in range(pages):
+            records = json.loads(archive.read(f"{PAGES_FOLDER}/{page_number:05d}.json"))
+            vectors = np.load(io.BytesIO(archive.read(f"{PAGES_FOLDER}/{page_number:05d}.npy")))
+            yield records["ids"], vectors, records["documents"], records["metadatas"]
+
+
+def read_snapshot_manifest(path: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Read the records of the indexed files stored in a snapshot archive
+
+    Args:
+        path: Path of the archive
+
+    Returns:
+        The manifest records, or None if the snapshot was exported without a manifest
+    """
+    with zipfile.ZipFile(path) as archive:
+        if MANIFEST_FILE not in archive.namelist():
+            return None
+        return json.loads(archive.read(MANIFEST_FILE))
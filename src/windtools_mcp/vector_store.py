@@ -0,0 +1,356 @@
+import logging
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Number of IDs fetched per page when iterating over a collection
+ID_SCAN_PAGE_SIZE = 5000
+
+
+class VectorCollection(ABC):
+    """
+    Collection of vectors with their IDs, documents and metadata, the storage interface of the index.
+
+    Results follow ChromaDB's formats, which the server was written against: get returns a dictionary of
+    parallel lists and query a list of them per query vector. Metadata filters are ChromaDB's "where"
+    filters; implementations need to support equality and $in on "file_path" and "chunk_index",
+    combined with $and.
+    """
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Name of the collection"""
+
+    @property
+    @abstractmethod
+    def metadata(self) -> Optional[Dict[str, Any]]:
+        """Metadata of the collection, with the "hnsw:" parameters of its index"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Get the number of records"""
+
+    @abstractmethod
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: Any = None,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ):
+        """Insert records, replacing the ones with the same IDs"""
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings: Any = None,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ):
+        """Insert new records"""
+        self.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    @abstractmethod
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        """Update the metadata of records, keeping the fields not given and removing the ones set to None"""
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        """Delete records by ID or by metadata filter"""
+
+    @abstractmethod
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Get records by ID or by metadata filter, in a stable order so that they can be paged with offsets
+
+        Args:
+            ids: IDs of the records
+            where: Metadata filter of the records
+            limit: Maximum number of records
+            offset: Number of matching records to skip
+            include: Fields to return among "embeddings", "documents" and "metadatas"
+
+        Returns:
+            Dictionary with the IDs and the included fields of the records
+        """
+
+    @abstractmethod
+    def query(self, query_embeddings: Any, n_results: int = 10, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Find the nearest records of each query vector
+
+        Args:
+            query_embeddings: Query vectors
+            n_results: Number of records per query
+            include: Fields to return among "embeddings", "documents", "metadatas" and "distances"
+
+        Returns:
+            Dictionary with a list of IDs and of each included field per query, nearest first
+        """
+
+    @abstractmethod
+    def modify(self, name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+        """Rename the collection or replace its metadata"""
+
+    def iter_ids(self, where: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Stream the IDs of the records page by page
+
+        Args:
+            where: Metadata filter of the records
+
+        Returns:
+            Iterator over record IDs
+        """
+        offset = 0
+        while True:
+            ids = self.get(where=where, include=[], limit=ID_SCAN_PAGE_SIZE, offset=offset)["ids"]
+            yield from ids
+            if len(ids) < ID_SCAN_PAGE_SIZE:
+                return
+            offset += len(ids)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get statistics about the storage of the collection"""
+        return {"records": self.count()}
+
+
+class VectorStore(ABC):
+    """
+    Store of vector collections, selected with VECTOR_STORE.
+
+    Implementations: ChromaVectorStore and FlatVectorStore (flat_store.py).
+    """
+
+    # Name of the backend, as set in VECTOR_STORE
+    backend = ""
+
+    @property
+    @abstractmethod
+    def persist_directory(self) -> Optional[str]:
+        """Directory holding the files of the store, or None if it is kept in memory"""
+
+    @abstractmethod
+    def list_collections(self) -> List[str]:
+        """Get the names of the collections"""
+
+    @abstractmethod
+    def get_collection(
+        self, name: str, embedding_function: Optional[Callable[[List[str]], Any]] = None
+    ) -> VectorCollection:
+        """
+        Get an existing collection
+
+        Raises:
+            ValueError: If the collection does not exist
+        """
+
+    @abstractmethod
+    def create_collection(
+        self,
+        name: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        embedding_function: Optional[Callable[[List[str]], Any]] = None,
+    ) -> VectorCollection:
+        """
+        Create a collection
+
+        Raises:
+            ValueError: If the collection already exists
+        """
+
+    def get_or_create_collection(
+        self,
+        name: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        embedding_function: Optional[Callable[[List[str]], Any]] = None,
+    ) -> VectorCollection:
+        """Get a collection, creating it if it does not exist; an existing collection keeps its metadata"""
+        try:
+            return self.get_collection(name, embedding_function=embedding_function)
+        except ValueError:
+            return self.create_collection(name, metadata=metadata, embedding_function=embedding_function)
+
+    @abstractmethod
+    def delete_collection(self, name: str):
+        """
+        Delete a collection
+
+        Raises:
+            ValueError: If the collection does not exist
+        """
+
+    def vacuum(self):
+        """Give the space of deleted records back to the file system, once collections were rebuilt"""
+
+    def stats(self) -> Dict[str, Any]:
+        """Get statistics about the store"""
+        return {
+            "backend": self.backend,
+            "persist_directory": self.persist_directory,
+            "collections": len(self.list_collections()),
+        }
+
+
+class ChromaVectorCollection(VectorCollection):
+    """Collection of a ChromaDB client"""
+
+    def __init__(self, collection: Any):
+        self._collection = collection
+
+    @property
+    def name(self) -> str:
+        return self._collection.name
+
+    @property
+    def metadata(self) -> Optional[Dict[str, Any]]:
+        return self._collection.metadata
+
+    @property
+    def id(self) -> Any:
+        """ID of the collection in ChromaDB's database"""
+        return self._collection.id
+
+    def count(self) -> int:
+        return self._collection.count()
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: Any = None,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self._collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings: Any = None,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self._collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        self._collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        self._collection.delete(ids=ids, where=where)
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        if include is None:
+            return self._collection.get(ids=ids, where=where, limit=limit, offset=offset)
+        return self._collection.get(ids=ids, where=where, limit=limit, offset=offset, include=include)
+
+    def query(self, query_embeddings: Any, n_results: int = 10, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        if include is None:
+            return self._collection.query(query_embeddings=query_embeddings, n_results=n_results)
+        return self._collection.query(query_embeddings=query_embeddings, n_results=n_results, include=include)
+
+    def modify(self, name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+        self._collection.modify(name=name, metadata=metadata)
+
+
+class ChromaVectorStore(VectorStore):
+    """Store of collections in a ChromaDB client, searched with their HNSW index"""
+
+    backend = "chroma"
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    @property
+    def persist_directory(self) -> Optional[str]:
+        settings = self.client.get_settings()
+        return settings.persist_directory if settings.is_persistent else None
+
+    def list_collections(self) -> List[str]:
+        # ChromaDB 0.6 returns the names, earlier versions the collections
+        return [
+            str(collection) if isinstance(collection, str) else collection.name
+            for collection in self.client.list_collections()
+        ]
+
+    def get_collection(
+        self, name: str, embedding_function: Optional[Callable[[List[str]], Any]] = None
+    ) -> ChromaVectorCollection:
+        try:
+            return ChromaVectorCollection(self.client.get_collection(name=name, embedding_function=embedding_function))
+        except ValueError:
+            raise
+        except Exception as e:
+            # ChromaDB raises its own NotFoundError or InvalidCollectionException depending on the version
+            raise ValueError(f"Collection {name} does not exist: {str(e)}") from e
+
+    def create_collection(
+        self,
+        name: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        embedding_function: Optional[Callable[[List[str]], Any]] = None,
+    ) -> ChromaVectorCollection:
+        return ChromaVectorCollection(
+            self.client.create_collection(name=name, metadata=metadata, embedding_function=embedding_function)
+        )
+
+    def get_or_create_collection(
+        self,
+        name: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        embedding_function: Optional[Callable[[List[str]], Any]] = None,
+    ) -> ChromaVectorCollection:
+        return ChromaVectorCollection(
+            self.client.get_or_create_collection(name=name, metadata=metadata, embedding_function=embedding_function)
+        )
+
+    def delete_collection(self, name: str):
+        self.client.delete_collection(name)
+
+    def vacuum(self):
+        """
+        Delete the index folders left by deleted collections and vacuum the SQLite database of a persistent client
+
+        ChromaDB drops the segments of a deleted collection from its database before it deletes their index
+        folders, so the folders stay on disk; every folder named after a segment that no longer exists goes.
+        """
+        # An in-memory database has no file to shrink
+        if self.persist_directory is None:
+            return
+        from chromadb.db.impl.sqlite import SqliteDB
+
+        # Go through the client's own connections, a second connection could not vacuum while they are in use
+        database = self.client._system.instance(SqliteDB)
+        with database.tx() as cursor:
+            segment_ids = {row[0] for row in cursor.execute("SELECT id FROM segments").fetchall()}
+        for entry in os.scandir(self.persist_directory):
+            if entry.is_dir() and _is_uuid(entry.name) and entry.name not in segment_ids:
+                logging.info(f"Deleting the index folder of deleted segment {entry.name}")
+                shutil.rmtree(entry.path)
+
+        logging.info(f"Vacuuming the ChromaDB database of {self.persist_directory}")
+        database.vacuum()
+
+
+def _is_uuid(name: str) -> bool:
+    """Check if a folder name is a UUID, like the index folders of ChromaDB segments"""
+    try:
+        return str(uuid.UUID(name)) == name
+    except ValueError:
+        return False
@@ -0,0 +1,158 @@
+import logging
+import os
+import os.path
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .ignore import DEFAULT_EXCLUDED_DIRECTORIES, IgnoreRules
+from .indexing import CODE_EXTENSIONS, is_in_directory
+
+# Callback receiving the changed or added files and the deleted files
+ChangeHandler = Callable[[Set[str], Set[str]], None]
+
+
+def _is_code_file(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in CODE_EXTENSIONS
+
+
+class DirectoryWatcher:
+    """
+    Watch directories and report debounced batches of changed and deleted code files.
+
+    Uses native filesystem notifications (inotify on Linux) through watchfiles when it is
+    installed, and falls back to polling the size and mtime of the files otherwise.
+    """
+
+    def __init__(
+        self,
+        directories: List[str],
+        on_changes: ChangeHandler,
+        debounce_seconds: float = 2.0,
+        poll_seconds: float = 5.0,
+        backend: str = "auto",
+        excluded_directories: Iterable[str] = DEFAULT_EXCLUDED_DIRECTORIES,
+    ):
+        self.directories = directories
+        self.on_changes = on_changes
+        self.debounce_seconds = debounce_seconds
+        self.poll_seconds = poll_seconds
+        self.backend = self._resolve_backend(backend)
+        self.excluded_directories = list(excluded_directories)
+        self.batches_processed = 0
+        self.last_change_at: Optional[float] = None
+
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _resolve_backend(backend: str) -> str:
+        if backend not in ("auto", "native", "poll"):
+            raise ValueError(f"Unknown watch backend: {backend}")
+        if backend == "poll":
+            return "poll"
+        try:
+            import watchfiles  # noqa: F401
+
+            return "native"
+        except ImportError:
+            if backend == "native":
+                raise
+            logging.info("watchfiles is not installed, watching directories by polling")
+            return "poll"
+
+    def start(self):
+        if self.backend == "native":
+            target = self._watch_native
+        else:
+            # Take the first snapshot before returning, so that changes made right after start are not part of it
+            target = partial(self._watch_polling, self._snapshot())
+        self._thread = threading.Thread(target=target, name="index-watcher", daemon=True)
+        self._thread.start()
+        logging.info(f"Watching {self.directories} for changes ({self.backend})")
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _watched_directory(self, path: str) -> Optional[str]:
+        for directory in self.directories:
+            if is_in_directory(path, directory):
+                return directory
+        return None
+
+    def _dispatch(self, paths: Set[str]):
+        """Split the paths of a debounced batch into changed and deleted files and hand them over"""
+        # Read the ignore files again for every batch, they may have changed too
+        ignore_rules = IgnoreRules(self.excluded_directories)
+        code_paths = {
+            path
+            for path in paths
+            if _is_code_file(path) and not ignore_rules.is_file_ignored(path, self._watched_directory(path))
+        }
+        if not code_paths:
+            return
+
+        changed = {path for path in code_paths if os.path.isfile(path)}
+        deleted = code_paths - changed
+        self.last_change_at = time.time()
+        try:
+            self.on_changes(changed, deleted)
+        except Exception as e:
+            logging.error(f"Error handling changes in {self.directories}: {str(e)}")
+        self.batches_processed += 1
+
+    def _watch_native(self):
+        import watchfiles
+
+        # watchfiles debounces the events itself and yields them as one set per batch
+        for changes in watchfiles.watch(
+            *self.directories,
+            debounce=int(self.debounce_seconds * 1000),
+            stop_event=self._stop_event,
+            raise_interrupt=False,
+        ):
+            self._dispatch({path for _, path in changes})
+
+    def _snapshot(self) -> Dict[str, Tuple[int, float]]:
+        """Take the size and mtime of every code file under the watched directories"""
+        snapshot = {}
+        ignore_rules = IgnoreRules(self.excluded_directories)
+        for directory in self.directories:
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [d for d in dirs if not ignore_rules.is_ignored(os.path.join(root, d), True, directory)]
+                for file in files:
+                    file_path = os.path.join(root, file)
+                    if not _is_code_file(file_path):
+                        continue
+                    try:
+                        stat_result = os.stat(file_path)
+                    except OSError:
+                        continue
+                    snapshot[file_path] = (stat_result.st_size, stat_result.st_mtime)
+        return snapshot
+
+    def _watch_polling(self, previous: Dict[str, Tuple[int, float]]):
+        pending: Set[str] = set()
+        last_event_at = 0.0
+
+        while not self._stop_event.wait(self.poll_seconds):
+            current = self._snapshot()
+            changed = {path for path, fingerprint in current.items() if previous.get(path) != fingerprint}
+            changed |= previous.keys() - current.keys()
+            previous = current
+
+            if changed:
+                pending |= changed
+                last_event_at = time.monotonic()
+
+            # Wait until the directories have been quiet for the debounce period
+            if pending and time.monotonic() - last_event_at >= self.debounce_seconds:
+                self._dispatch(pending)
+                pending = set()
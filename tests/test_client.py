@@ -39,4 +39,14 @@ async def test_tools_available():
             assert "list_dir" in tool_names, "list_dir tool should be available"
             assert "get_initialization_status" in tool_names, "get_initialization_status tool should be available"
             assert "codebase_search" in tool_names, "codebase_search tool should be available"
-            assert "index_repository" in tool_names, "index_repository tool should be available"
\ No newline at end of file
+            assert "index_repository" in tool_names, "index_repository tool should be available"
+            assert "get_index_job_status" in tool_names, "get_index_job_status tool should be available"
+            assert "cancel_index_job" in tool_names, "cancel_index_job tool should be available"
+            assert "stop_watching" in tool_names, "stop_watching tool should be available"
+            assert "prune_index" in tool_names, "prune_index tool should be available"
+            assert "list_repositories" in tool_names, "list_repositories tool should be available"
+            assert "configure_index" in tool_names, "configure_index tool should be available"
+            assert "compact_index" in tool_names, "compact_index tool should be available"
+            assert "export_index" in tool_names, "export_index tool should be available"
+            assert "import_index" in tool_names, "import_index tool should be available"
+            assert "measure_quantization" in tool_names, "measure_quantization tool should be available"
@@ -1,18 +1,58 @@
 import json
 import os
+import subprocess
+import sys
 import tempfile
+import threading
+import time
 import uuid
+from contextlib import contextmanager
 from unittest.mock import MagicMock, patch
 
+import numpy as np
 import pytest
 
+from windtools_mcp.checkpoint import CheckpointStore
+from windtools_mcp.chunking import chunk_lines
+from windtools_mcp.compaction import get_directory_size, rebuild_collection, recover_rebuild
+from windtools_mcp.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from windtools_mcp.embedding_workers import EmbeddingWorkerPool
+from windtools_mcp.flat_store import FlatVectorStore
+from windtools_mcp.git_delta import GitStateStore, get_head_commit
+from windtools_mcp.hnsw_config import HnswConfigStore, validate_hnsw_config
+from windtools_mcp.ignore import IgnoreRules, compile_ignore_pattern
+from windtools_mcp.indexing import (
+    IndexPipeline,
+    compute_content_hash,
+    iter_indexed_file_paths,
+    iter_indexed_fingerprints,
+    parse_chunk_id,
+    plan_length_sorted_batches,
+    read_candidate,
+)
+from windtools_mcp.manifest import FileManifest
+from windtools_mcp.onnx_embedding import measure_neighbor_recall, pool_embeddings
+from windtools_mcp.quantization import binarize, hamming_distances
+from windtools_mcp.repositories import RepositoryRegistry, make_collection_name
 from windtools_mcp.server import (
-    ctx,  # Global context object
+    cancel_index_job,
     codebase_search,
+    compact_index,
+    configure_index,
+    ctx,  # Global context object
+    export_index,
+    get_index_job_status,
     get_initialization_status,
+    import_index,
     index_repository,
     list_dir,
+    list_repositories,
+    measure_quantization,
+    prune_index,
+    stop_watching,
 )
+from windtools_mcp.vector_store import ChromaVectorStore
+from windtools_mcp.watcher import DirectoryWatcher
 
 # ========== Test Fixtures ==========
 
@@ -42,6 +82,15 @@ def setup_test_directory():
     shutil.rmtree(test_dir)
 
 
+@pytest.fixture
+def temp_folder():
+    """Fixture that creates an empty temporary folder, removed after the test"""
+    folder = tempfile.mkdtemp()
+    yield folder
+    import shutil
+    shutil.rmtree(folder)
+
+
 @pytest.fixture
 def setup_code_directory():
     """Fixture that creates a temporary directory with sample code files"""
@@ -115,8 +164,9 @@ def search_function(data, term):
 def mock_chroma_db():
     """Fixture that mocks ChromaDB client and collection"""
     original_is_initialized = ctx.is_initialized
-    original_chroma_client = ctx.chroma_client
+    original_vector_store = ctx.vector_store
     original_code_collection = ctx.code_collection
+    original_embedding_function = ctx.embedding_function
 
     # Create mock collection
     mock_collection = MagicMock()
@@ -142,15 +192,61 @@ def mock_chroma_db():
 
     # Set mocks in context
     ctx.is_initialized = True
-    ctx.chroma_client = mock_client
+    ctx.vector_store = mock_client
     ctx.code_collection = mock_collection
+    ctx.embedding_function = MagicMock(side_effect=lambda documents: [[0.1, 0.2, 0.3] for _ in documents])
 
     yield
 
     # Restore original values
     ctx.is_initialized = original_is_initialized
-    ctx.chroma_client = original_chroma_client
+    ctx.vector_store = original_vector_store
     ctx.code_collection = original_code_collection
+    ctx.embedding_function = original_embedding_function
+
+
+class _FakeEmbeddingFunction:
+    """Deterministic embeddings derived from the document text"""
+
+    def __call__(self, input):
+        return [[float(len(document) % 97), float(document.count("def")), 1.0] for document in input]
+
+
+@contextmanager
+def _code_collection(store, collection_name):
+    """Set a new collection of a vector store as the code collection, with a deterministic embedding function"""
+    original_is_initialized = ctx.is_initialized
+    original_vector_store = ctx.vector_store
+    original_code_collection = ctx.code_collection
+    original_embedding_function = ctx.embedding_function
+    original_migrated_collections = ctx.migrated_collections
+
+    embedding_function = _FakeEmbeddingFunction()
+    collection = store.create_collection(name=collection_name, embedding_function=embedding_function)
+
+    ctx.is_initialized = True
+    ctx.vector_store = store
+    ctx.code_collection = collection
+    ctx.embedding_function = MagicMock(wraps=embedding_function)
+    ctx.migrated_collections = set()
+    try:
+        yield collection
+    finally:
+        store.delete_collection(collection_name)
+        ctx.is_initialized = original_is_initialized
+        ctx.vector_store = original_vector_store
+        ctx.code_collection = original_code_collection
+        ctx.embedding_function = original_embedding_function
+        ctx.migrated_collections = original_migrated_collections
+
+
+@pytest.fixture
+def chroma_collection():
+    """Fixture that sets a real in-memory ChromaDB collection and a deterministic embedding function"""
+    import chromadb
+
+    with _code_collection(ChromaVectorStore(chromadb.EphemeralClient()), f"test_{uuid.uuid4().hex}") as collection:
+        yield collection
 
 
 # ========== Tests for list_dir ==========
@@ -287,6 +383,26 @@ def test_codebase_search_initialized(setup_code_directory, mock_chroma_db):
     assert "relevance_score" in result_json["results"][0], "Results should have relevance scores"
 
 
+def test_codebase_search_caches_query_embeddings(mock_chroma_db):
+    """Test that codebase_search embeds a repeated query once, whatever its whitespace"""
+    original_query_embedding_cache = ctx.query_embedding_cache
+    ctx.query_embedding_cache = QueryEmbeddingCache(model_name="model", max_entries=16)
+    try:
+        first_json = json.loads(codebase_search("search function"))
+        second_json = json.loads(codebase_search("  search   function "))
+
+        assert ctx.embedding_function.call_count == 1
+        assert second_json["results"] == first_json["results"]
+        assert json.loads(get_initialization_status())["query_cache"] == {
+            "vectors": 1,
+            "max_entries": 16,
+            "hits": 1,
+            "misses": 1,
+        }
+    finally:
+        ctx.query_embedding_cache = original_query_embedding_cache
+
+
 # ========== Tests for index_repository ==========
 
 def test_index_repository_uninitialized():
@@ -327,26 +443,1744 @@ def test_index_repository_nonexistent_dir(mock_chroma_db):
 
 def test_index_repository_with_force_reindex(setup_code_directory, mock_chroma_db):
     """Test index_repository with force_reindex=True"""
-    # Mock the code collection's add and update methods
-    orig_add = ctx.code_collection.add
-    orig_update = ctx.code_collection.update
-    
+    # Call the function with force_reindex=True
+    result = index_repository([setup_code_directory], force_reindex=True)
+    result_json = json.loads(result)
+
+    # Verify the result
+    assert "status" in result_json, "Result should include a status field"
+    assert result_json["status"] == "success", "Operation should succeed"
+
+    # In force_reindex mode, we should see some calls to upsert
+    assert ctx.code_collection.upsert.call_count > 0, "Should have called upsert with force_reindex=True"
+
+
+def test_index_repository_skips_unchanged_files(setup_code_directory, chroma_collection):
+    """Test that index_repository only re-embeds files whose fingerprint changed"""
+    # First run indexes everything and records the fingerprints
+    index_repository([setup_code_directory])
+    stored = chroma_collection.get(include=["metadatas"])
+    assert len({metadata["file_path"] for metadata in stored["metadatas"]}) == 3, "All code files should be indexed"
+    assert all("content_hash" in metadata for metadata in stored["metadatas"]), "Metadata should carry a hash"
+
+    # Second run, after one file has been edited
+    ctx.embedding_function.reset_mock()
+    edited_file = os.path.join(setup_code_directory, "sample.py")
+    with open(edited_file, "a") as f:
+        f.write("\ndef new_function():\n    return 42\n")
+    os.utime(edited_file, (0, 12345))
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["files_updated"] == 1, "Only the edited file should be re-embedded"
+    assert result_json["statistics"]["files_skipped"] == 2, "Unchanged files should be skipped"
+    embedded_documents = ctx.embedding_function.call_args.args[0]
+    assert len(embedded_documents) == 1 and "new_function" in embedded_documents[0]
+    stored = chroma_collection.get(where={"file_path": edited_file})
+    assert len(stored["ids"]) == 1, "The previous version of the file should be replaced"
+    assert "new_function" in stored["documents"][0]
+
+
+def test_index_repository_touched_file_is_not_reembedded(setup_code_directory, chroma_collection):
+    """Test that a file with a new mtime but identical content only gets its fingerprint refreshed"""
+    index_repository([setup_code_directory])
+    ctx.embedding_function.reset_mock()
+    touched_file = os.path.join(setup_code_directory, "sample.js")
+    os.utime(touched_file, (0, 12345))
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["files_updated"] == 0, "Touched file should not be re-embedded"
+    assert ctx.embedding_function.call_count == 0, "Nothing should be embedded"
+    stored = chroma_collection.get(where={"file_path": touched_file}, include=["metadatas"])
+    assert stored["metadatas"][0]["last_modified"] == 12345, "The fingerprint should be refreshed"
+
+
+def test_index_repository_batches_embeddings_and_writes(setup_code_directory, mock_chroma_db):
+    """Test that index_repository embeds and writes files in batches rather than one call per file"""
+    ctx.code_collection.count.return_value = 0
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["files_indexed"] == 3
+    assert ctx.embedding_function.call_count == 1, "All files should be embedded with a single model call"
+    assert ctx.code_collection.upsert.call_count == 1, "All files should be written with a single upsert"
+    assert len(ctx.code_collection.upsert.call_args.kwargs["embeddings"]) == 3
+
+
+def test_index_repository_respects_batch_limits(setup_code_directory, mock_chroma_db):
+    """Test that batches are flushed by document count and by token budget"""
+    ctx.code_collection.count.return_value = 0
+
+    with patch("windtools_mcp.server.INDEX_BATCH_SIZE", 2):
+        index_repository([setup_code_directory])
+    assert [len(call.kwargs["ids"]) for call in ctx.code_collection.upsert.call_args_list] == [2, 1]
+
+    ctx.code_collection.upsert.reset_mock()
+    with patch("windtools_mcp.server.INDEX_BATCH_MAX_TOKENS", 1):
+        index_repository([setup_code_directory], force_reindex=True)
+    assert ctx.code_collection.upsert.call_count == 3, "Each file exceeds the token budget on its own"
+
+
+
+def test_plan_length_sorted_batches():
+    """Test that model calls group documents of similar length under the padded token budget"""
+    documents = ["x" * 400, "x" * 8, "x" * 40, "x" * 12, "x" * 4000, "x" * 44]
+
+    batches = plan_length_sorted_batches(documents, max_padded_tokens=100)
+
+    assert sorted(index for batch in batches for index in batch) == list(range(len(documents)))
+    assert batches == [[1, 3, 2, 5], [0], [4]]
+    for batch in batches[:-1]:
+        assert len(batch) * max(len(documents[i]) // 4 for i in batch) <= 100
+    assert plan_length_sorted_batches(documents, max_padded_tokens=0) == [list(range(len(documents)))]
+
+
+def test_index_pipeline_restores_order_after_length_sorting(setup_code_directory):
+    """Test that vectors computed in length-sorted model calls are written next to their own documents"""
+    collection = MagicMock()
+    embedding_function = MagicMock(side_effect=lambda documents: [[float(len(d))] for d in documents])
+    pipeline = IndexPipeline(
+        collection=collection,
+        embedding_function=embedding_function,
+        existing_fingerprints={},
+        embedding_max_tokens=30,
+    )
+
+    stats = pipeline.run([setup_code_directory])
+
+    assert stats["embedding_calls"] == embedding_function.call_count > 1
+    for call in embedding_function.call_args_list:
+        lengths = [len(document) for document in call.args[0]]
+        assert lengths == sorted(lengths), "Each model call should be sorted by length"
+    upsert = collection.upsert.call_args.kwargs
+    assert upsert["embeddings"] == [[float(len(document))] for document in upsert["documents"]]
+
+
+# ========== Tests for the indexing pipeline ==========
+
+def test_index_pipeline_with_small_queues(setup_code_directory):
+    """Test that the pipeline indexes every file when its queues and reader pool are minimal"""
+    collection = MagicMock()
+    pipeline = IndexPipeline(
+        collection=collection,
+        embedding_function=lambda documents: [[0.0] for _ in documents],
+        existing_fingerprints={},
+        batch_size=1,
+        read_workers=1,
+        queue_size=1,
+    )
+
+    stats = pipeline.run([setup_code_directory])
+
+    assert stats["files_indexed"] == 3
+    assert collection.upsert.call_count == 3
+    written = [call.kwargs["ids"][0] for call in collection.upsert.call_args_list]
+    assert sorted(written) == sorted(set(written)), "Each file should be written exactly once"
+
+
+def test_index_pipeline_embedding_errors_are_counted(setup_code_directory):
+    """Test that a failing embedding stage is reported as errors instead of stalling the pipeline"""
+    collection = MagicMock()
+    embedding_function = MagicMock(side_effect=RuntimeError("model crashed"))
+    pipeline = IndexPipeline(
+        collection=collection,
+        embedding_function=embedding_function,
+        existing_fingerprints={},
+        batch_size=2,
+    )
+
+    stats = pipeline.run([setup_code_directory])
+
+    assert stats["errors"] == 3, "Every file of the failed batches should count as an error"
+    assert stats["files_indexed"] == 0
+    assert collection.upsert.call_count == 0
+
+
+
+def test_index_pipeline_pages_file_lookups(setup_code_directory, chroma_collection):
+    """Test that the chunks of updated and touched files are looked up a page of paths at a time"""
+    index_repository([setup_code_directory])
+    with open(os.path.join(setup_code_directory, "sample.py"), "a") as f:
+        f.write("\ndef goodbye():\n    return 'bye'\n")
+    touched_at = time.time() + 60
+    for path in ("sample.js", os.path.join("src", "utils.py")):
+        os.utime(os.path.join(setup_code_directory, path), (touched_at, touched_at))
+
+    with (
+        patch("windtools_mcp.indexing.FILTER_PAGE_SIZE", 1),
+        patch.object(chroma_collection, "get", wraps=chroma_collection.get) as get,
+    ):
+        index_repository([setup_code_directory])
+
+    path_filters = [
+        call.kwargs["where"]["file_path"]["$in"]
+        for call in get.call_args_list
+        if "file_path" in (call.kwargs.get("where") or {})
+    ]
+    assert path_filters and all(len(paths) == 1 for paths in path_filters)
+    metadata = chroma_collection.get(where={"file_path": os.path.join(setup_code_directory, "sample.js")})["metadatas"]
+    assert metadata[0]["last_modified"] == touched_at
+
+# ========== Tests for chunking ==========
+
+def test_chunk_lines_small_file_is_one_chunk():
+    """Test that content shorter than a window is kept as a single chunk"""
+    chunks = chunk_lines("a = 1\nb = 2\n", max_lines=10, overlap=2)
+
+    assert len(chunks) == 1
+    assert (chunks[0].start_line, chunks[0].end_line) == (1, 2)
+
+
+def test_chunk_lines_overlapping_windows_cover_file():
+    """Test that long content is split into overlapping windows that cover every line"""
+    content = "".join(f"    line_{i} = {i}\n" for i in range(1, 101))
+
+    chunks = chunk_lines(content, max_lines=30, overlap=5)
+
+    assert chunks[0].start_line == 1 and chunks[-1].end_line == 100
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.start_line == previous.end_line - 4, "Consecutive chunks should share the overlap"
+    assert all(chunk.end_line - chunk.start_line < 30 for chunk in chunks)
+
+
+def test_chunk_lines_prefers_top_level_boundaries():
+    """Test that windows are cut right before a top-level definition"""
+    function = "def f{i}():\n" + "".join("    x = 1\n" for _ in range(7))
+    content = "".join(function.format(i=i) for i in range(10))
+
+    chunks = chunk_lines(content, max_lines=20, overlap=0)
+
+    assert all(chunk.text.startswith("def ") for chunk in chunks), "Chunks should start at a definition"
+
+
+def test_index_repository_stores_chunks(setup_code_directory, chroma_collection):
+    """Test that long files are indexed as several chunks and searched as chunk hits"""
+    long_file = os.path.join(setup_code_directory, "long_module.py")
+    with open(long_file, "w") as f:
+        for i in range(200):
+            f.write(f"def function_{i}():\n    return {i}\n\n")
+
+    with patch("windtools_mcp.server.INDEX_CHUNK_LINES", 60), patch("windtools_mcp.server.INDEX_CHUNK_OVERLAP", 10):
+        result_json = json.loads(index_repository([setup_code_directory]))
+
+    stored = chroma_collection.get(where={"file_path": long_file}, include=["metadatas"])
+    assert len(stored["ids"]) > 1, "A long file should be split into several chunks"
+    assert result_json["statistics"]["chunks_indexed"] == chroma_collection.count()
+    line_ranges = sorted((metadata["start_line"], metadata["end_line"]) for metadata in stored["metadatas"])
+    assert line_ranges[0][0] == 1 and line_ranges[-1][1] == 600
+    assert all("chunk_hash" in metadata for metadata in stored["metadatas"])
+
+    search_json = json.loads(codebase_search("function_150", limit=50, min_relevance=-1000))
+    hit = next(result for result in search_json["results"] if result["file_path"] == long_file)
+    assert hit["start_line"] >= 1 and hit["end_line"] <= 600
+
+
+# ========== Tests for the embedding cache ==========
+
+def test_embedding_cache_round_trip(temp_folder):
+    """Test that cached vectors are returned per model and persist across instances"""
+    cache = EmbeddingCache(temp_folder, model_name="model-a", max_bytes=1024 * 1024)
+    cache.put_many({"hash1": [0.5, 1.5, 2.5]})
+
+    found = cache.get_many(["hash1", "hash2"])
+    assert list(found) == ["hash1"]
+    assert found["hash1"].tolist() == [0.5, 1.5, 2.5]
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+    cache.close()
+
+    reopened = EmbeddingCache(temp_folder, model_name="model-a", max_bytes=1024 * 1024)
+    assert "hash1" in reopened.get_many(["hash1"]), "Vectors should persist on disk"
+    other_model = EmbeddingCache(temp_folder, model_name="model-b", max_bytes=1024 * 1024)
+    assert other_model.get_many(["hash1"]) == {}, "Vectors should be keyed by model"
+
+
+def test_embedding_cache_evicts_least_recently_used(temp_folder):
+    """Test that the cache evicts the least recently used vectors when it exceeds its size limit"""
+    # Room for three 4-dimensional float32 vectors
+    cache = EmbeddingCache(temp_folder, model_name="model", max_bytes=48)
+    cache.put_many({"old": [0.0] * 4})
+    cache.put_many({"recent": [1.0] * 4})
+    cache.get_many(["old"])
+    cache.put_many({"new1": [2.0] * 4, "new2": [3.0] * 4})
+
+    remaining = cache.get_many(["old", "recent", "new1", "new2"])
+    assert "recent" not in remaining, "The least recently used vector should be evicted"
+    assert cache.stats()["size_bytes"] <= 48
+
+
+def test_embedding_cache_keeps_a_running_size(temp_folder):
+    """Test that the size kept in memory follows inserts, replacements and evictions without scanning the table"""
+    cache = EmbeddingCache(temp_folder, model_name="model", max_bytes=48)
+    cache.put_many({"a": [0.0] * 4, "b": [1.0] * 4})
+    cache.put_many({"a": [2.0] * 4})
+    assert cache._total_bytes == cache.stats()["size_bytes"] == 32
+
+    cache.put_many({"c": [3.0] * 4, "d": [4.0] * 4})
+    assert cache._total_bytes == cache.stats()["size_bytes"] <= 48
+    cache.close()
+    assert EmbeddingCache(temp_folder, model_name="model", max_bytes=48)._total_bytes == cache._total_bytes
+
+
+def test_query_embedding_cache_evicts_least_recently_used():
+    """Test that the query cache is keyed by model and normalized query and evicts the least recently used vectors"""
+    cache = QueryEmbeddingCache(model_name="model-a", max_entries=2)
+    cache.put("find the parser", [1.0])
+    cache.put("open a file", [2.0])
+    assert cache.get(" find  the\tparser") == [1.0]
+    cache.put("close a file", [3.0])
+
+    assert cache.get("open a file") is None, "The least recently used vector should be evicted"
+    assert cache.get("close a file") == [3.0]
+    assert cache.stats() == {"vectors": 2, "max_entries": 2, "hits": 2, "misses": 1}
+    cache.model_name = "model-b"
+    assert cache.get("find the parser") is None, "Vectors of another model should not be returned"
+
+
+def test_index_pipeline_reuses_cached_embeddings(setup_code_directory, temp_folder):
+    """Test that content already in the embedding cache is not embedded again"""
+    cache = EmbeddingCache(temp_folder, model_name="model", max_bytes=1024 * 1024)
+    embedding_function = MagicMock(side_effect=lambda documents: [[1.0, 2.0] for _ in documents])
+
+    def run_pipeline():
+        pipeline = IndexPipeline(
+            collection=MagicMock(),
+            embedding_function=embedding_function,
+            existing_fingerprints={},
+            embedding_cache=cache,
+        )
+        return pipeline.run([setup_code_directory])
+
+    first_stats = run_pipeline()
+    assert first_stats["chunks_from_cache"] == 0
+    assert embedding_function.call_count == 1
+
+    second_stats = run_pipeline()
+    assert second_stats["chunks_from_cache"] == second_stats["chunks_indexed"] == 3
+    assert embedding_function.call_count == 1, "Cached content should not be embedded again"
+
+
+# ========== Tests for background index jobs ==========
+
+@pytest.mark.asyncio
+async def test_index_repository_background_job(setup_code_directory, chroma_collection):
+    """Test that index_repository can run as a background job reported by get_index_job_status"""
+    result_json = json.loads(index_repository([setup_code_directory], background=True))
+
+    assert result_json["status"] == "started"
+    job_id = result_json["job_id"]
+    await ctx.index_jobs[job_id].task
+
+    status_json = json.loads(get_index_job_status(job_id))
+    assert status_json["status"] == "completed"
+    assert status_json["files_done"] == 3
+    assert status_json["files_remaining"] == 0
+    assert status_json["errors"] == 0
+    assert status_json["statistics"]["files_indexed"] == 3
+    assert chroma_collection.count() == 3
+    assert job_id in [job["job_id"] for job in json.loads(get_index_job_status())["jobs"]]
+
+
+@pytest.mark.asyncio
+async def test_cancel_index_job(setup_code_directory, chroma_collection):
+    """Test that cancel_index_job stops a background job"""
+    job_id = json.loads(index_repository([setup_code_directory], background=True))["job_id"]
+
+    cancel_json = json.loads(cancel_index_job(job_id))
+    assert cancel_json["status"] == "cancelling"
+    await ctx.index_jobs[job_id].task
+
+    assert json.loads(get_index_job_status(job_id))["status"] == "cancelled"
+    assert "error" in json.loads(cancel_index_job(job_id)), "A finished job cannot be cancelled again"
+
+
+def test_get_index_job_status_unknown_job():
+    """Test that get_index_job_status reports unknown job IDs"""
+    result_json = json.loads(get_index_job_status("does-not-exist"))
+
+    assert "error" in result_json
+    assert "not found" in result_json["error"]
+
+
+# ========== Tests for watch mode ==========
+
+def _wait_for(condition, timeout=10.0):
+    """Poll a condition until it is true or the timeout expires"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_directory_watcher_polling_reports_changes(setup_code_directory):
+    """Test that the polling watcher reports debounced changed and deleted code files"""
+    batches = []
+    received = threading.Event()
+
+    def on_changes(changed, deleted):
+        batches.append((changed, deleted))
+        received.set()
+
+    watcher = DirectoryWatcher(
+        [setup_code_directory], on_changes=on_changes, debounce_seconds=0.1, poll_seconds=0.05, backend="poll"
+    )
+    watcher.start()
     try:
-        ctx.code_collection.add = MagicMock()
-        ctx.code_collection.update = MagicMock()
-        
-        # Call the function with force_reindex=True
-        result = index_repository([setup_code_directory], force_reindex=True)
-        result_json = json.loads(result)
-        
-        # Verify the result
-        assert "status" in result_json, "Result should include a status field"
-        assert result_json["status"] == "success", "Operation should succeed"
-        
-        # In force_reindex mode, we should see some calls to add/update
-        assert ctx.code_collection.add.call_count > 0 or ctx.code_collection.update.call_count > 0, \
-            "Should have called add or update with force_reindex=True"
+        time.sleep(0.1)
+        with open(os.path.join(setup_code_directory, "added.py"), "w") as f:
+            f.write("def added():\n    return 1\n")
+        with open(os.path.join(setup_code_directory, "notes.txt"), "w") as f:
+            f.write("not code")
+        os.remove(os.path.join(setup_code_directory, "sample.js"))
+
+        assert received.wait(10), "The watcher should report the changes"
+    finally:
+        watcher.stop(timeout=5)
+
+    changed = set().union(*(batch[0] for batch in batches))
+    deleted = set().union(*(batch[1] for batch in batches))
+    assert changed == {os.path.join(setup_code_directory, "added.py")}
+    assert deleted == {os.path.join(setup_code_directory, "sample.js")}
+
+
+def test_index_repository_watch_mode(setup_code_directory, chroma_collection):
+    """Test that watched directories are re-indexed when files change or are deleted"""
+    with (
+        patch("windtools_mcp.server.INDEX_WATCH_BACKEND", "poll"),
+        patch("windtools_mcp.server.INDEX_WATCH_POLL_SECONDS", 0.05),
+        patch("windtools_mcp.server.INDEX_WATCH_DEBOUNCE_SECONDS", 0.1),
+    ):
+        result_json = json.loads(index_repository([setup_code_directory], watch=True))
+    try:
+        assert setup_code_directory in result_json["watched_directories"]
+
+        new_file = os.path.join(setup_code_directory, "watched.py")
+        with open(new_file, "w") as f:
+            f.write("def watched():\n    return 1\n")
+        deleted_file = os.path.join(setup_code_directory, "sample.js")
+        os.remove(deleted_file)
+
+        assert _wait_for(lambda: chroma_collection.get(where={"file_path": new_file})["ids"]), "New file indexed"
+        assert _wait_for(lambda: not chroma_collection.get(where={"file_path": deleted_file})["ids"]), "Deleted"
+    finally:
+        stop_json = json.loads(stop_watching([setup_code_directory]))
+
+    assert stop_json["stopped"] == [setup_code_directory]
+    assert setup_code_directory not in stop_json["watched_directories"]
+
+
+# ========== Tests for git delta indexing ==========
+
+def _git(directory, *args):
+    subprocess.run(
+        ["git", "-C", directory, "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+def git_state_store(temp_folder):
+    """Fixture that enables git delta indexing with a temporary state file"""
+    original_git_state_store = ctx.git_state_store
+    ctx.git_state_store = GitStateStore(os.path.join(temp_folder, "git_state.json"))
+
+    yield ctx.git_state_store
+
+    ctx.git_state_store = original_git_state_store
+
+
+def test_index_repository_git_delta(setup_code_directory, chroma_collection, git_state_store):
+    """Test that a git work tree indexed before is re-indexed from the git delta instead of a full walk"""
+    _git(setup_code_directory, "init", "-q")
+    _git(setup_code_directory, "add", "-A")
+    _git(setup_code_directory, "commit", "-q", "-m", "initial")
+
+    first_json = json.loads(index_repository([setup_code_directory]))
+    assert first_json["statistics"]["git_delta_directories"] == [], "The first run walks the directory"
+    assert git_state_store.get(chroma_collection.name, setup_code_directory) is not None
+
+    # A committed change, a deleted file and an untracked file
+    with open(os.path.join(setup_code_directory, "src", "utils.py"), "a") as f:
+        f.write("\ndef committed_change():\n    return 1\n")
+    _git(setup_code_directory, "commit", "-q", "-am", "change utils")
+    os.remove(os.path.join(setup_code_directory, "sample.js"))
+    with open(os.path.join(setup_code_directory, "untracked.py"), "w") as f:
+        f.write("def untracked():\n    return 2\n")
+
+    second_json = json.loads(index_repository([setup_code_directory]))
+
+    statistics = second_json["statistics"]
+    assert statistics["git_delta_directories"] == [setup_code_directory]
+    assert statistics["files_scanned"] == 2, "Only the changed and untracked files should be looked at"
+    assert statistics["files_updated"] == 1
+    assert statistics["files_indexed"] == 1
+    assert statistics["files_deleted"] == 1
+    indexed_paths = {metadata["file_path"] for metadata in chroma_collection.get(include=["metadatas"])["metadatas"]}
+    assert os.path.join(setup_code_directory, "sample.js") not in indexed_paths
+    assert os.path.join(setup_code_directory, "untracked.py") in indexed_paths
+
+
+# ========== Tests for deleted file garbage collection ==========
+
+def test_index_repository_deletes_missing_files(setup_code_directory, chroma_collection):
+    """Test that files deleted or renamed since the last run are removed from the index by the walk"""
+    index_repository([setup_code_directory])
+    os.remove(os.path.join(setup_code_directory, "sample.js"))
+    os.rename(
+        os.path.join(setup_code_directory, "src", "utils.py"), os.path.join(setup_code_directory, "src", "helpers.py")
+    )
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["files_deleted"] == 2
+    indexed_paths = {metadata["file_path"] for metadata in chroma_collection.get(include=["metadatas"])["metadatas"]}
+    assert indexed_paths == {
+        os.path.join(setup_code_directory, "sample.py"),
+        os.path.join(setup_code_directory, "src", "helpers.py"),
+    }
+
+
+def test_prune_index(setup_code_directory, chroma_collection, temp_folder):
+    """Test that prune_index removes missing files under the target directories only"""
+    with open(os.path.join(temp_folder, "other.py"), "w") as f:
+        f.write("def other():\n    return 1\n")
+    index_repository([setup_code_directory, temp_folder])
+    os.remove(os.path.join(setup_code_directory, "sample.js"))
+    os.remove(os.path.join(temp_folder, "other.py"))
+    collection_size = chroma_collection.count()
+
+    result_json = json.loads(prune_index([setup_code_directory]))
+
+    assert result_json["status"] == "success"
+    assert result_json["files_checked"] == 3
+    assert result_json["files_deleted"] == 1
+    assert result_json["chunks_deleted"] == 1
+    assert result_json["collection_size"] == collection_size - 1
+    indexed_paths = {metadata["file_path"] for metadata in chroma_collection.get(include=["metadatas"])["metadatas"]}
+    assert os.path.join(temp_folder, "other.py") in indexed_paths, "Other directories should be left alone"
+
+    # Without target directories every indexed file is checked
+    assert json.loads(prune_index())["files_deleted"] == 1
+
+
+def test_prune_index_not_initialized():
+    """Test prune_index when resources aren't initialized"""
+    ctx.is_initialized = False
+
+    result_json = json.loads(prune_index())
+
+    assert "error" in result_json
+    assert "not yet initialized" in result_json["error"]
+
+
+# ========== Tests for indexed file scans ==========
+
+def test_parse_chunk_id():
+    """Test that the file path is recovered from chunk IDs, including paths containing '#L'"""
+    assert parse_chunk_id("file:/repo/src/app.py#L1-60") == "/repo/src/app.py"
+    assert parse_chunk_id("file:/repo/notes#Lx/app.py#L51-90") == "/repo/notes#Lx/app.py"
+    assert parse_chunk_id("other:/repo/src/app.py") is None
+
+
+def test_indexed_file_scans_are_paginated(setup_code_directory, chroma_collection):
+    """Test that scans page through one record per file without fetching documents"""
+    with open(os.path.join(setup_code_directory, "long_module.py"), "w") as f:
+        f.write("\n".join(f"value_{i} = {i}" for i in range(200)))
+    index_repository([setup_code_directory])
+    assert chroma_collection.count() > 4, "The long module should be split into several chunks"
+
+    expected_paths = {
+        os.path.join(setup_code_directory, "sample.py"),
+        os.path.join(setup_code_directory, "sample.js"),
+        os.path.join(setup_code_directory, "src", "utils.py"),
+        os.path.join(setup_code_directory, "long_module.py"),
+    }
+    with patch("windtools_mcp.indexing.SCAN_PAGE_SIZE", 3), patch.object(
+        chroma_collection, "get", wraps=chroma_collection.get
+    ) as get_mock:
+        fingerprints = list(iter_indexed_fingerprints(chroma_collection))
+        file_paths = list(iter_indexed_file_paths(chroma_collection))
+        selected = list(iter_indexed_fingerprints(chroma_collection, [os.path.join(setup_code_directory, "sample.py")]))
+
+    assert sorted(metadata["file_path"] for metadata in fingerprints) == sorted(expected_paths)
+    assert all("content_hash" in metadata for metadata in fingerprints)
+    assert sorted(file_paths) == sorted(expected_paths)
+    assert [metadata["file_path"] for metadata in selected] == [os.path.join(setup_code_directory, "sample.py")]
+    for call in get_mock.call_args_list:
+        assert "documents" not in call.kwargs["include"], "Scans should never fetch documents"
+        assert call.kwargs["limit"] == 3
+    assert all(call.kwargs["include"] == [] for call in get_mock.call_args_list[2:4]), "Path scans read IDs only"
+
+
+# ========== Tests for the file manifest ==========
+
+@pytest.fixture
+def file_manifest(temp_folder):
+    """Fixture that enables the file manifest with a temporary database"""
+    original_file_manifest = ctx.file_manifest
+    ctx.file_manifest = FileManifest(os.path.join(temp_folder, "manifest.sqlite3"))
+
+    yield ctx.file_manifest
+
+    ctx.file_manifest.close()
+    ctx.file_manifest = original_file_manifest
+
+
+def test_file_manifest_records(file_manifest):
+    """Test that manifest records are stored per collection and found by path and by directory"""
+    file_manifest.put_files(
+        "collection-a",
+        [
+            {"file_path": "/repo/src/app.py", "file_size": 10, "last_modified": 1.5, "inode": 7,
+             "content_hash": "h1", "chunk_ids": ["c1", "c2"], "embedding_model": "model-a"},
+            {"file_path": "/repo/src2/other.py", "file_size": 20, "last_modified": 2.5, "inode": 8,
+             "content_hash": "h2", "chunk_ids": ["c3"], "embedding_model": "model-a"},
+        ],
+    )
+    file_manifest.put_files("collection-b", [{"file_path": "/repo/src/app.py", "chunk_ids": ["c9"]}])
+
+    assert list(file_manifest.get_files("collection-a", directory="/repo/src")) == ["/repo/src/app.py"]
+    assert list(file_manifest.get_files("collection-a", file_paths=["/repo/src2/other.py", "/missing.py"])) == [
+        "/repo/src2/other.py"
+    ]
+    record = file_manifest.get_files("collection-a")["/repo/src/app.py"]
+    assert (record["last_modified"], record["inode"], record["chunk_ids"]) == (1.5, 7, ["c1", "c2"])
+
+    file_manifest.update_fingerprints("collection-a", {"/repo/src/app.py": {"file_size": 11, "last_modified": 3.5}})
+    record = file_manifest.get_files("collection-a", file_paths=["/repo/src/app.py"])["/repo/src/app.py"]
+    assert (record["file_size"], record["chunk_ids"]) == (11, ["c1", "c2"]), "Chunks are kept on fingerprint updates"
+
+    stats = file_manifest.stats("collection-a")
+    assert (stats["files"], stats["chunks"], stats["size_bytes"]) == (2, 3, 31)
+    assert stats["files_per_model"] == {"model-a": 2}
+
+    file_manifest.delete_files("collection-a", ["/repo/src/app.py"])
+    assert file_manifest.count("collection-a") == 1
+    assert file_manifest.count("collection-b") == 1
+
+
+def test_index_repository_with_manifest(setup_code_directory, chroma_collection, file_manifest):
+    """Test that index decisions come from the manifest and that it follows the collection"""
+    first_json = json.loads(index_repository([setup_code_directory]))
+    assert first_json["indexed_files"]["files"] == 3
+    assert first_json["indexed_files"]["chunks"] == chroma_collection.count()
+
+    # Unchanged files are skipped from the manifest alone, without reading the collection
+    with patch.object(chroma_collection, "get", wraps=chroma_collection.get) as get_mock:
+        second_json = json.loads(index_repository([setup_code_directory]))
+    assert second_json["statistics"]["files_skipped"] == 3
+    get_mock.assert_not_called()
+
+    # A file growing into more chunks gets its chunk IDs replaced in the manifest
+    utils_path = os.path.join(setup_code_directory, "src", "utils.py")
+    with open(utils_path, "w") as f:
+        f.write("\n".join(f"value_{i} = {i}" for i in range(150)))
+    third_json = json.loads(index_repository([setup_code_directory]))
+
+    assert third_json["statistics"]["files_updated"] == 1
+    chunk_ids = file_manifest.get_files(chroma_collection.name, [utils_path])[utils_path]["chunk_ids"]
+    assert sorted(chunk_ids) == sorted(chroma_collection.get(where={"file_path": utils_path}, include=[])["ids"])
+    assert len(chunk_ids) > 1
+
+
+def test_manifest_reembeds_files_of_another_model(setup_code_directory, chroma_collection, file_manifest):
+    """Test that files embedded with another model are re-embedded even if unchanged"""
+    index_repository([setup_code_directory])
+
+    with patch.object(ctx, "embedding_model", "another-model"):
+        result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["files_updated"] == 3
+    assert result_json["indexed_files"]["files_per_model"] == {"another-model": 3}
+
+
+def test_manifest_is_built_from_existing_collection(setup_code_directory, chroma_collection, file_manifest):
+    """Test that a collection indexed before the manifest existed fills it on the next run"""
+    original_file_manifest = ctx.file_manifest
+    ctx.file_manifest = None
+    index_repository([setup_code_directory])
+    ctx.file_manifest = original_file_manifest
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["files_skipped"] == 3, "Fingerprints imported from the collection are reused"
+    assert result_json["indexed_files"]["files"] == 3
+    assert result_json["indexed_files"]["chunks"] == chroma_collection.count()
+
+
+def test_manifest_follows_a_recreated_collection(setup_code_directory, chroma_collection, file_manifest):
+    """Test that files recorded in the manifest are re-embedded once the collection lost their chunks"""
+    index_repository([setup_code_directory])
+    sample_path = os.path.join(setup_code_directory, "sample.py")
+
+    # Chunks missing from the collection, e.g. after a crash between the two writes
+    chroma_collection.delete(where={"file_path": sample_path})
+    result_json = json.loads(index_repository([setup_code_directory]))
+    assert result_json["statistics"]["files_indexed"] == 1
+    assert result_json["statistics"]["files_skipped"] == 2
+    assert result_json["indexed_files"]["chunks"] == chroma_collection.count() == 3
+
+    # An emptied collection, as after deleting the vector store
+    chroma_collection.delete(ids=chroma_collection.get(include=[])["ids"])
+    result_json = json.loads(index_repository([setup_code_directory]))
+    assert result_json["statistics"]["files_indexed"] == 3
+    assert result_json["indexed_files"]["chunks"] == chroma_collection.count() == 3
+
+
+# ========== Tests for binary, oversized and minified files ==========
+
+def test_index_repository_skips_binary_oversized_and_minified_files(setup_code_directory, chroma_collection):
+    """Test that unsuitable files are detected before being read in full and are not embedded"""
+    with open(os.path.join(setup_code_directory, "bundle.js"), "w") as f:
+        f.write("var a=1;" * 2000)
+    with open(os.path.join(setup_code_directory, "huge.py"), "w") as f:
+        f.write("x = 1\n" * 50000)
+    with open(os.path.join(setup_code_directory, "blob.c"), "wb") as f:
+        f.write(b"\x7fELF\x00\x00" + bytes(range(256)) * 10)
+
+    with patch("windtools_mcp.server.INDEX_MAX_FILE_BYTES", 100 * 1024), patch(
+        "windtools_mcp.server.INDEX_MAX_AVERAGE_LINE_LENGTH", 300
+    ):
+        result_json = json.loads(index_repository([setup_code_directory]))
+
+    statistics = result_json["statistics"]
+    assert statistics["files_indexed"] == 3, "Only the original code files should be indexed"
+    assert (statistics["files_too_large"], statistics["files_binary"], statistics["files_minified"]) == (1, 1, 1)
+    assert statistics["files_skipped"] == 3
+    indexed_paths = {metadata["file_path"] for metadata in chroma_collection.get(include=["metadatas"])["metadatas"]}
+    assert not indexed_paths & {os.path.join(setup_code_directory, name) for name in ("bundle.js", "huge.py", "blob.c")}
+
+
+def test_index_repository_removes_files_that_became_minified(setup_code_directory, chroma_collection):
+    """Test that an indexed file is removed from the index once it gets minified"""
+    index_repository([setup_code_directory])
+    sample_path = os.path.join(setup_code_directory, "sample.js")
+    with open(sample_path, "w") as f:
+        f.write("function a(){return 1};" * 200)
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["files_minified"] == 1
+    assert result_json["statistics"]["files_deleted"] == 1
+    assert chroma_collection.get(where={"file_path": sample_path}, include=[])["ids"] == []
+
+
+# ========== Tests for embedding worker processes ==========
+
+def _create_fake_embedding_function():
+    """Factory run in each embedding worker process"""
+    return _FakeEmbeddingFunction()
+
+
+class _FailingEmbeddingFunction:
+    def __call__(self, input):
+        if any("fail" in document for document in input):
+            raise ValueError("model crashed")
+        return [[1.0, 2.0, 3.0] for _ in input]
+
+
+def _create_failing_embedding_function():
+    return _FailingEmbeddingFunction()
+
+
+def test_embedding_worker_pool_keeps_document_order():
+    """Test that documents embedded across worker processes come back in their original order"""
+    documents = [f"def function_{i}():\n    return {'x' * i}" for i in range(11)]
+    pool = EmbeddingWorkerPool(_create_fake_embedding_function, processes=3)
+    try:
+        vectors = pool(documents)
+        assert pool([]) == []
+    finally:
+        pool.close()
+
+    assert [vector.tolist() for vector in vectors] == _FakeEmbeddingFunction()(documents)
+
+
+class _PidEmbeddingFunction:
+    def __call__(self, input):
+        time.sleep(0.2)
+        return [[float(os.getpid())] for _ in input]
+
+
+def _create_pid_embedding_function():
+    return _PidEmbeddingFunction()
+
+
+def test_embedding_worker_pool_keeps_several_calls_in_flight():
+    """Test that submitted calls run whole on one worker each and are spread over the workers"""
+    pool = EmbeddingWorkerPool(_create_pid_embedding_function, processes=2)
+    try:
+        futures = [pool.submit([f"document {i}", f"other {i}"]) for i in range(6)]
+        results = [future.result() for future in futures]
+    finally:
+        pool.close()
+
+    assert all(len({vector[0] for vector in vectors}) == 1 for vectors in results), "Each call runs on one worker"
+    assert len({vectors[0][0] for vectors in results}) == 2, "The calls are spread over the workers"
+
+
+def test_embedding_workers_do_not_import_the_server():
+    """Test that the module run by the worker processes can be imported without building the server"""
+    script = "import sys, windtools_mcp.embedding_workers; print('windtools_mcp.server' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+
+    assert output.strip() == "False"
+
+
+def test_embedding_worker_pool_raises_worker_errors():
+    """Test that an error in a worker is raised by the call it belongs to"""
+    pool = EmbeddingWorkerPool(_create_failing_embedding_function, processes=2)
+    try:
+        with pytest.raises(ValueError, match="model crashed"):
+            pool(["ok", "ok", "fail", "ok"])
+        assert len(pool(["ok", "ok"])) == 2, "The pool keeps working after an error"
+    finally:
+        pool.close()
+
+
+def test_index_repository_with_embedding_workers(setup_code_directory, chroma_collection):
+    """Test that indexing embeds through the worker pool when it is enabled"""
+    pool = EmbeddingWorkerPool(_create_fake_embedding_function, processes=2)
+    try:
+        with patch.object(ctx, "embedding_function", pool):
+            result_json = json.loads(index_repository([setup_code_directory]))
+    finally:
+        pool.close()
+
+    assert result_json["statistics"]["files_indexed"] == 3
+    assert result_json["statistics"]["errors"] == 0
+    stored = chroma_collection.get(include=["documents", "embeddings"])
+    assert [list(vector) for vector in stored["embeddings"]] == _FakeEmbeddingFunction()(stored["documents"])
+
+
+# ========== Tests for the quantized ONNX backend ==========
+
+def test_pool_embeddings():
+    """Test that token embeddings are pooled over real tokens only, like the sentence transformer"""
+    hidden_states = np.array([[[1.0, 0.0], [3.0, 4.0], [100.0, 100.0]]], dtype=np.float32)
+    attention_mask = np.array([[1, 1, 0]])
+
+    assert pool_embeddings(hidden_states, attention_mask, "mean", False).tolist() == [[2.0, 2.0]]
+    assert pool_embeddings(hidden_states, attention_mask, "cls", False).tolist() == [[1.0, 0.0]]
+    normalized = pool_embeddings(hidden_states, attention_mask, "mean", True)
+    assert np.allclose(np.linalg.norm(normalized, axis=1), 1.0)
+
+
+def test_measure_neighbor_recall():
+    """Test that recall is perfect for a faithful embedding function and drops for an unrelated one"""
+    documents = [f"def function_{i}():\n    return {i}" + " " * i for i in range(30)]
+    rng = np.random.default_rng(0)
+    reference = {document: rng.normal(size=8) for document in documents}
+    noisy = {document: vector + rng.normal(scale=0.01, size=8) for document, vector in reference.items()}
+    unrelated = {document: rng.normal(size=8) for document in documents}
+
+    def embed_with(vectors):
+        return lambda batch: [vectors[document] for document in batch]
+
+    assert measure_neighbor_recall(embed_with(reference), embed_with(reference), documents) == 1.0
+    assert measure_neighbor_recall(embed_with(reference), embed_with(noisy), documents) > 0.9
+    assert measure_neighbor_recall(embed_with(reference), embed_with(unrelated), documents) < 0.6
+
+
+def test_onnx_backend_falls_back_on_low_recall(tmp_path):
+    """Test that a quantized model failing the recall check is not used"""
+    from windtools_mcp.server import _get_recall_sample_documents, _load_onnx_embedding_function
+
+    with open(tmp_path / "recall.json", "w") as f:
+        json.dump({"recall": 0.42, "k": 10}, f)
+
+    with patch("windtools_mcp.server.ONNX_MODEL_FOLDER", str(tmp_path)), patch(
+        "windtools_mcp.server.EMBEDDING_ONNX_MIN_RECALL", 0.9
+    ):
+        assert _load_onnx_embedding_function() is None
+    assert len(_get_recall_sample_documents()) > 50, "The recall check needs enough documents to be meaningful"
+
+
+def _add_whole_file_document(collection, file_path):
+    """Add a document the way files were indexed before they were split into chunks"""
+    metadata = {"file_path": file_path, "file_type": "py", "file_size": 10, "last_modified": 0.0, "indexed_at": 0.0}
+    collection.add(ids=[f"file:{file_path}"], documents=["def legacy():\n    pass\n"], metadatas=[metadata])
+
+
+def test_index_repository_replaces_whole_file_documents(setup_code_directory, chroma_collection, git_state_store):
+    """Test that documents indexed before files were split into chunks are replaced by the chunks of their file"""
+    _git(setup_code_directory, "init", "-q")
+    _git(setup_code_directory, "add", "-A")
+    _git(setup_code_directory, "commit", "-q", "-m", "initial")
+    git_state_store.set(chroma_collection.name, setup_code_directory, get_head_commit(setup_code_directory), set())
+    sample_path = os.path.join(setup_code_directory, "sample.py")
+    _add_whole_file_document(chroma_collection, sample_path)
+    _add_whole_file_document(chroma_collection, os.path.join(setup_code_directory, "deleted.py"))
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["git_delta_directories"] == [], "The files of deleted documents need a walk"
+    assert result_json["statistics"]["files_indexed"] == 3
+    ids = chroma_collection.get(include=[])["ids"]
+    assert len(ids) == 3
+    assert all(parse_chunk_id(doc_id) is not None for doc_id in ids)
+    assert any(parse_chunk_id(doc_id) == sample_path for doc_id in ids)
+
+
+def test_prune_index_deletes_whole_file_documents(setup_code_directory, chroma_collection):
+    """Test that prune_index sees documents indexed before files were split into chunks"""
+    index_repository([setup_code_directory])
+    _add_whole_file_document(chroma_collection, os.path.join(setup_code_directory, "deleted.py"))
+    ctx.migrated_collections.discard(chroma_collection.name)
+
+    result_json = json.loads(prune_index([setup_code_directory]))
+
+    assert result_json["status"] == "success"
+    assert result_json["collection_size"] == 3
+    assert all(parse_chunk_id(doc_id) is not None for doc_id in chroma_collection.get(include=[])["ids"])
+
+
+# ========== Tests for ignore rules ==========
+
+@pytest.mark.parametrize(
+    "pattern, path, matches",
+    [
+        ("*.min.js", "static/app.min.js", True),
+        ("*.min.js", "static/app.js", False),
+        ("/generated", "generated", True),
+        ("/generated", "src/generated", False),
+        ("docs/*.py", "docs/conf.py", True),
+        ("docs/*.py", "docs/api/conf.py", False),
+        ("**/fixtures", "tests/unit/fixtures", True),
+        ("logs/**", "logs/2024/app.py", True),
+        ("file[0-9].py", "file7.py", True),
+        ("# comment", "# comment", None),
+    ],
+)
+def test_compile_ignore_pattern(pattern, path, matches):
+    """Test that gitignore patterns are translated with gitignore semantics"""
+    rule = compile_ignore_pattern(pattern)
+
+    if matches is None:
+        assert rule is None, "Comments should not produce a rule"
+    else:
+        assert bool(rule.regex.match(path)) == matches
+
+
+def test_ignore_rules_nested_files_and_negation(setup_code_directory):
+    """Test that nested .gitignore and .ignore files apply to their subtree, with negations"""
+    with open(os.path.join(setup_code_directory, ".gitignore"), "w") as f:
+        f.write("*.gen.py\nout/\n")
+    with open(os.path.join(setup_code_directory, "src", ".ignore"), "w") as f:
+        f.write("!keep.gen.py\n")
+    rules = IgnoreRules(["node_modules"])
+
+    assert rules.is_ignored(os.path.join(setup_code_directory, "node_modules"), True, setup_code_directory)
+    assert rules.is_ignored(os.path.join(setup_code_directory, "out"), True, setup_code_directory)
+    assert not rules.is_ignored(os.path.join(setup_code_directory, "out"), False, setup_code_directory)
+    assert rules.is_file_ignored(os.path.join(setup_code_directory, "src", "model.gen.py"), setup_code_directory)
+    assert not rules.is_file_ignored(os.path.join(setup_code_directory, "src", "keep.gen.py"), setup_code_directory)
+    assert rules.is_file_ignored(os.path.join(setup_code_directory, "out", "module.py"), setup_code_directory)
+    assert not rules.is_file_ignored(os.path.join(setup_code_directory, "src", "utils.py"), setup_code_directory)
+
+
+def test_index_repository_prunes_ignored_directories(setup_code_directory, chroma_collection):
+    """Test that excluded and gitignored directories are never entered by the index walk"""
+    for ignored_dir in ("node_modules", "generated"):
+        os.makedirs(os.path.join(setup_code_directory, ignored_dir, "deep"))
+        with open(os.path.join(setup_code_directory, ignored_dir, "deep", "lib.js"), "w") as f:
+            f.write("module.exports = {};\n")
+    with open(os.path.join(setup_code_directory, ".gitignore"), "w") as f:
+        f.write("generated/\n")
+    # Generic names like build are only skipped when the repository ignores them
+    os.makedirs(os.path.join(setup_code_directory, "build"))
+    with open(os.path.join(setup_code_directory, "build", "backend.py"), "w") as f:
+        f.write("def build_wheel():\n    return 'wheel'\n")
+
+    walked = []
+    original_walk = os.walk
+
+    def recording_walk(top, *args, **kwargs):
+        for root, dirs, files in original_walk(top, *args, **kwargs):
+            walked.append(root)
+            yield root, dirs, files
+
+    with patch("windtools_mcp.indexing.os.walk", recording_walk):
+        result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["files_indexed"] == 4, "Only the original code files and build/ are indexed"
+    assert result_json["statistics"]["directories_pruned"] == 2
+    assert not any("node_modules" in root or "generated" in root for root in walked), "Pruned dirs are not entered"
+
+
+# ========== Tests for resumable indexing ==========
+
+@pytest.fixture
+def checkpoint_store(temp_folder):
+    """Fixture that enables index checkpoints with a temporary file"""
+    original_checkpoint_store = ctx.checkpoint_store
+    ctx.checkpoint_store = CheckpointStore(os.path.join(temp_folder, "checkpoints.json"))
+
+    yield ctx.checkpoint_store
+
+    ctx.checkpoint_store = original_checkpoint_store
+
+
+def test_index_pipeline_checkpoints_follow_walk_order(setup_code_directory):
+    """Test that the checkpoint cursor advances through the files in walk order, files before subdirectories"""
+    cursors = []
+    pipeline = IndexPipeline(
+        collection=MagicMock(),
+        embedding_function=lambda documents: [[0.0] for _ in documents],
+        existing_fingerprints={},
+        batch_size=1,
+        on_checkpoint=cursors.append,
+        checkpoint_interval=0,
+    )
+
+    pipeline.run([setup_code_directory])
+
+    expected = [os.path.join(setup_code_directory, name) for name in ("sample.js", "sample.py", "src/utils.py")]
+    assert cursors[:3] == expected
+    assert pipeline.checkpoint_cursor == expected[-1]
+
+
+def test_index_pipeline_resumes_after_cursor(setup_code_directory):
+    """Test that a resumed walk neither reads the files before the cursor nor enters the directories done"""
+    collection = MagicMock()
+    pipeline = IndexPipeline(
+        collection=collection,
+        embedding_function=lambda documents: [[0.0] for _ in documents],
+        existing_fingerprints={},
+        resume_after=os.path.join(setup_code_directory, "sample.py"),
+    )
+    with patch("windtools_mcp.indexing.read_candidate", wraps=read_candidate) as read:
+        stats = pipeline.run([setup_code_directory])
+
+    assert stats["files_scanned"] == stats["files_indexed"] == 1
+    assert [call.args[0].file_path for call in read.call_args_list] == [
+        os.path.join(setup_code_directory, "src", "utils.py")
+    ]
+
+    with open(os.path.join(setup_code_directory, "src", "late.py"), "w") as f:
+        f.write("def late():\n    return 1\n")
+    pipeline = IndexPipeline(
+        collection=MagicMock(),
+        embedding_function=lambda documents: [[0.0] for _ in documents],
+        existing_fingerprints={},
+        resume_after=os.path.join(setup_code_directory, "src", "utils.py"),
+    )
+    assert pipeline.run([setup_code_directory])["files_scanned"] == 0, "Nothing is left after the last file"
+
+
+def test_index_pipeline_resumes_without_losing_files(temp_folder):
+    """Test that the cursor follows the walk order across directories and never passes unwritten touched files"""
+    nested_directory = os.path.join(temp_folder, "a", "b")
+    dashed_directory = os.path.join(temp_folder, "a-b")
+    os.makedirs(nested_directory)
+    os.makedirs(dashed_directory)
+    contents = {
+        os.path.join(nested_directory, "1_touched.py"): "def touched():\n    return 1\n",
+        os.path.join(nested_directory, "2_large.py"): "def large():\n    return 2\n" * 20,
+        os.path.join(nested_directory, "3_changed.py"): "def changed():\n    return 3\n",
+        os.path.join(dashed_directory, "4_changed.py"): "def other():\n    return 4\n",
+    }
+    for path, content in contents.items():
+        with open(path, "w") as f:
+            f.write(content)
+    touched_path, large_path, changed_path, other_path = contents
+
+    events = []
+    collection = MagicMock()
+    collection.get.return_value = {"ids": ["touched"], "metadatas": [{"file_path": touched_path}]}
+    collection.update.side_effect = lambda **kwargs: events.append("touched written")
+    collection.delete.side_effect = lambda **kwargs: events.append("rejected deleted")
+    pipeline = IndexPipeline(
+        collection=collection,
+        embedding_function=lambda documents: [[0.0] for _ in documents],
+        existing_fingerprints={
+            touched_path: {"content_hash": compute_content_hash(contents[touched_path].encode("utf-8"))},
+            large_path: {"content_hash": "previous"},
+        },
+        batch_size=1,
+        max_file_bytes=100,
+        on_checkpoint=events.append,
+        checkpoint_interval=0,
+    )
+    # Sorted as strings, a-b would be walked before a/b
+    pipeline.run([dashed_directory, nested_directory])
+
+    assert events[:3] == ["touched written", "rejected deleted", changed_path], "Written before the cursor passes"
+    assert pipeline.checkpoint_cursor == other_path
+
+    resumed = IndexPipeline(
+        collection=MagicMock(),
+        embedding_function=lambda documents: [[0.0] for _ in documents],
+        existing_fingerprints={},
+        resume_after=changed_path,
+    )
+    assert resumed.run([dashed_directory, nested_directory])["files_scanned"] == 1, "Only a-b is left"
+
+
+def test_index_pipeline_checkpoint_stops_at_errors(setup_code_directory):
+    """Test that the checkpoint never moves past a file that failed, so that it is retried on resume"""
+    cursors = []
+    calls = []
+
+    def embedding_function(documents):
+        calls.append(documents)
+        if len(calls) == 2:
+            # Let the writer record the first batch, the error freezes the checkpoint
+            checkpointed.wait(timeout=10)
+            raise RuntimeError("model crashed")
+        return [[0.0] for _ in documents]
+
+    def on_checkpoint(cursor):
+        cursors.append(cursor)
+        checkpointed.set()
+
+    checkpointed = threading.Event()
+    pipeline = IndexPipeline(
+        collection=MagicMock(),
+        embedding_function=embedding_function,
+        existing_fingerprints={},
+        batch_size=1,
+        on_checkpoint=on_checkpoint,
+        checkpoint_interval=0,
+    )
+    stats = pipeline.run([setup_code_directory])
+
+    assert stats["errors"] == 1
+    assert set(cursors) == {os.path.join(setup_code_directory, "sample.js")}
+
+
+def test_index_repository_resumes_interrupted_run(setup_code_directory, chroma_collection, checkpoint_store):
+    """Test that index_repository resumes after the checkpoint of an interrupted run and then forgets it"""
+    cursor = os.path.join(setup_code_directory, "sample.py")
+    checkpoint_store.set(chroma_collection.name, [setup_code_directory], cursor, False, {})
+    assert checkpoint_store.get(chroma_collection.name, [setup_code_directory + "-other"]) is None
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["statistics"]["resumed_after"] == [cursor]
+    assert result_json["statistics"]["files_indexed"] == 1
+    assert checkpoint_store.get(chroma_collection.name, [setup_code_directory]) is None
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+    assert result_json["statistics"]["resumed_after"] == []
+    assert result_json["statistics"]["files_indexed"] == 2, "The next run walks everything again"
+
+
+@pytest.mark.asyncio
+async def test_cancelled_index_job_leaves_checkpoint(setup_code_directory, chroma_collection, checkpoint_store):
+    """Test that a cancelled job saves its checkpoint and that the next run only indexes the files after it"""
+    with patch("windtools_mcp.server.INDEX_BATCH_SIZE", 1), patch("windtools_mcp.server.INDEX_CHECKPOINT_SECONDS", 0):
+        job_id = json.loads(index_repository([setup_code_directory], background=True))["job_id"]
+        job = ctx.index_jobs[job_id]
+        embedding_function = ctx.embedding_function
+
+        calls = []
+
+        def cancel_after_first_file(documents):
+            # Cancel while embedding the second file, once the first one is written and checkpointed
+            calls.append(documents)
+            if len(calls) == 2:
+                assert _wait_for(lambda: checkpoint_store.get(chroma_collection.name, [setup_code_directory]))
+                job.cancel()
+            return embedding_function(documents)
+
+        ctx.embedding_function = cancel_after_first_file
+        try:
+            await job.task
+        finally:
+            ctx.embedding_function = embedding_function
+
+    checkpoint = checkpoint_store.get(chroma_collection.name, [setup_code_directory])
+    assert checkpoint["cursor"] == os.path.join(setup_code_directory, "sample.js")
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+    assert result_json["statistics"]["resumed_after"] == [checkpoint["cursor"]]
+    assert result_json["statistics"]["files_indexed"] == 2
+    assert chroma_collection.count() == 3
+
+
+# ========== Tests for per-repository collections ==========
+
+@pytest.fixture
+def repository_registry(chroma_collection, temp_folder):
+    """Fixture that enables per-repository collections with a temporary registry"""
+    original_repository_registry = ctx.repository_registry
+    ctx.repository_registry = RepositoryRegistry(os.path.join(temp_folder, "repositories.json"))
+    ctx.repository_collections = {}
+
+    yield ctx.repository_registry
+
+    for collection_name in ctx.repository_collections:
+        ctx.vector_store.delete_collection(collection_name)
+    ctx.repository_collections = {}
+    ctx.repository_registry = original_repository_registry
+
+
+@pytest.fixture
+def second_code_directory():
+    """Fixture that creates another small repository"""
+    temp_dir = tempfile.mkdtemp()
+    with open(os.path.join(temp_dir, "billing.py"), "w") as f:
+        f.write("def compute_invoice_total(lines):\n    return sum(line.amount for line in lines)\n")
+
+    yield temp_dir
+
+    import shutil
+    shutil.rmtree(temp_dir)
+
+
+@pytest.mark.asyncio
+async def test_background_job_sums_repositories(setup_code_directory, second_code_directory, repository_registry):
+    """Test that a background job over several repositories reports the work done on all of them"""
+    job_id = json.loads(index_repository([setup_code_directory, second_code_directory], background=True))["job_id"]
+    await ctx.index_jobs[job_id].task
+
+    status_json = json.loads(get_index_job_status(job_id))
+    assert status_json["status"] == "completed"
+    assert status_json["files_done"] == 4
+    assert status_json["walk_complete"]
+    assert status_json["statistics"]["files_indexed"] == 4
+    assert [r["root"] for r in status_json["statistics"]["repositories"]] == [
+        setup_code_directory,
+        second_code_directory,
+    ]
+
+
+def test_make_collection_name():
+    """Test that repository collection names are valid ChromaDB names and unique per root"""
+    name = make_collection_name("/home/user/My Project!")
+    assert name.startswith("repo_My_Project_")
+    assert 3 <= len(name) <= 63
+    assert make_collection_name("/a/" + "x" * 200) != make_collection_name("/b/" + "x" * 200)
+    assert len(make_collection_name("/a/" + "x" * 200)) <= 63
+    assert make_collection_name("/").startswith("repo_root_")
+
+
+def test_index_repository_per_repository_collections(
+    setup_code_directory, second_code_directory, repository_registry, chroma_collection
+):
+    """Test that each indexed directory gets its own collection and that searches can be scoped"""
+    result_json = json.loads(index_repository([setup_code_directory, second_code_directory]))
+
+    repositories = {repository["root"]: repository for repository in result_json["statistics"]["repositories"]}
+    assert set(repositories) == {setup_code_directory, second_code_directory}
+    assert repositories[setup_code_directory]["collection_size"] == 3
+    assert repositories[second_code_directory]["collection_size"] == 1
+    assert result_json["collection_size"] == 4
+    assert chroma_collection.count() == 0, "Nothing goes to the shared code collection"
+
+    listed = json.loads(list_repositories())["repositories"]
+    assert {repository["root"] for repository in listed} == set(repositories)
+
+    search_json = json.loads(codebase_search("invoice", limit=10, min_relevance=-1e9))
+    assert {result["repository"] for result in search_json["results"]} == set(repositories)
+
+    scoped_json = json.loads(
+        codebase_search("invoice", limit=10, min_relevance=-1e9, repositories=[second_code_directory])
+    )
+    assert [result["file_path"] for result in scoped_json["results"]] == [
+        os.path.join(second_code_directory, "billing.py")
+    ]
+    by_name_json = json.loads(
+        codebase_search("invoice", min_relevance=-1e9, repositories=[os.path.basename(setup_code_directory)])
+    )
+    assert {result["repository"] for result in by_name_json["results"]} == {setup_code_directory}
+
+    assert "error" in json.loads(codebase_search("invoice", repositories=["/not/indexed"]))
+
+
+def test_index_repository_nonexistent_dir_with_repositories(repository_registry):
+    """Test that a run without any repository to index still reports every counter"""
+    nonexistent_dir = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))
+
+    result_json = json.loads(index_repository([nonexistent_dir]))
+
+    assert result_json["status"] == "success"
+    assert result_json["statistics"]["files_scanned"] == 0
+    assert result_json["statistics"]["files_indexed"] == 0
+    assert result_json["statistics"]["errors"] == 0
+    assert result_json["statistics"]["repositories"] == []
+    assert list(repository_registry.list()) == [], "Missing directories are not registered"
+
+
+def test_index_repository_reuses_enclosing_repository(setup_code_directory, repository_registry):
+    """Test that subdirectories go to the collection of their repository and that enclosing roots replace inner ones"""
+    src_directory = os.path.join(setup_code_directory, "src")
+    json.loads(index_repository([src_directory]))
+    assert list(repository_registry.list()) == [src_directory]
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+    assert list(repository_registry.list()) == [setup_code_directory], "The inner repository is replaced"
+    assert result_json["collection_size"] == 3
+
+    result_json = json.loads(index_repository([src_directory]))
+    assert result_json["statistics"]["repositories"] == [
+        {
+            "root": setup_code_directory,
+            "collection": repository_registry.list()[setup_code_directory]["collection"],
+            "collection_size": 3,
+        }
+    ]
+    assert len(ctx.repository_collections) == 1
+
+
+
+def test_prune_index_parent_directory_of_repositories(
+    setup_code_directory, second_code_directory, repository_registry, temp_folder
+):
+    """Test that prune_index cleans up every repository inside a directory that is not itself indexed"""
+    import shutil
+
+    first_repository = shutil.copytree(setup_code_directory, os.path.join(temp_folder, "first"))
+    second_repository = shutil.copytree(second_code_directory, os.path.join(temp_folder, "second"))
+    index_repository([first_repository, second_repository])
+    os.remove(os.path.join(first_repository, "sample.js"))
+    os.remove(os.path.join(second_repository, "billing.py"))
+
+    result_json = json.loads(prune_index([temp_folder]))
+
+    assert result_json["status"] == "success"
+    assert result_json["files_checked"] == 4
+    assert result_json["files_deleted"] == 2
+    assert "error" in json.loads(export_index(temp_folder, os.path.join(temp_folder, "index.zip")))
+    assert "error" in json.loads(prune_index([os.path.join(setup_code_directory, "not_indexed")]))
+
+
+def test_index_repository_moves_files_out_of_shared_collection(
+    setup_code_directory, repository_registry, chroma_collection
+):
+    """Test that files indexed into the shared collection move to the collection of their repository"""
+    ctx.repository_registry = None
+    try:
+        index_repository([setup_code_directory])
     finally:
-        # Restore original methods
-        ctx.code_collection.add = orig_add
-        ctx.code_collection.update = orig_update
+        ctx.repository_registry = repository_registry
+    assert chroma_collection.count() == 3
+
+    search_json = json.loads(codebase_search("hello", min_relevance=-1e9))
+    assert {result["repository"] for result in search_json["results"]} == {None}
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+    assert result_json["collection_size"] == 3
+    assert chroma_collection.count() == 0
+
+
+def test_index_repository_moves_whole_file_documents_out_of_shared_collection(
+    setup_code_directory, repository_registry, chroma_collection
+):
+    """Test that documents indexed into the shared collection before files were split into chunks are removed too"""
+    for file_name in ("sample.py", "sample.js", os.path.join("src", "utils.py")):
+        _add_whole_file_document(chroma_collection, os.path.join(setup_code_directory, file_name))
+    # Skip the migration of whole-file documents, so that only the removal of the repository's files can find them
+    ctx.migrated_collections.add(chroma_collection.name)
+
+    result_json = json.loads(index_repository([setup_code_directory]))
+
+    assert result_json["collection_size"] == 3
+    assert chroma_collection.count() == 0
+
+
+# ========== Tests for HNSW parameters ==========
+
+@pytest.fixture
+def hnsw_config_store(temp_folder):
+    """Fixture that saves the HNSW parameters set at runtime to a temporary file"""
+    original_hnsw_config_store = ctx.hnsw_config_store
+    original_hnsw_config = ctx.hnsw_config
+    ctx.hnsw_config_store = HnswConfigStore(os.path.join(temp_folder, "hnsw_config.json"))
+    ctx.hnsw_config = {}
+
+    yield ctx.hnsw_config_store
+
+    ctx.hnsw_config_store = original_hnsw_config_store
+    ctx.hnsw_config = original_hnsw_config
+
+
+def test_validate_hnsw_config():
+    """Test that HNSW parameters read from strings are converted and invalid ones rejected"""
+    assert validate_hnsw_config({"M": "32", "space": "cosine"}) == {"M": 32, "space": "cosine"}
+    with pytest.raises(ValueError):
+        validate_hnsw_config({"space": "manhattan"})
+    with pytest.raises(ValueError):
+        validate_hnsw_config({"search_ef": "many"})
+    with pytest.raises(ValueError):
+        validate_hnsw_config({"sync_threshold": 2})
+    with pytest.raises(ValueError):
+        validate_hnsw_config({"ef": 10})
+
+
+def test_configure_index_applies_to_new_collections(
+    setup_code_directory, second_code_directory, repository_registry, hnsw_config_store
+):
+    """Test that HNSW parameters set with configure_index are saved and used by the collections created afterwards"""
+    index_repository([setup_code_directory])
+
+    result_json = json.loads(configure_index(M=32, construction_ef=200, space="cosine"))
+    assert result_json["config"]["M"] == 32
+    assert result_json["config"]["search_ef"] == 100, "Parameters not set keep ChromaDB's defaults"
+    assert [collection["matches_config"] for collection in result_json["collections"]] == [False]
+    assert hnsw_config_store.load() == {"M": 32, "construction_ef": 200, "space": "cosine"}
+
+    index_repository([second_code_directory])
+    collections = {
+        collection["repository"]: collection for collection in json.loads(configure_index())["collections"]
+    }
+    assert collections[second_code_directory]["matches_config"]
+    assert collections[second_code_directory]["hnsw"]["space"] == "cosine"
+    assert collections[setup_code_directory]["hnsw"]["M"] == 16, "Existing collections keep their parameters"
+
+    assert "error" in json.loads(configure_index(space="manhattan"))
+
+
+def test_codebase_search_search_ef(mock_chroma_db):
+    """Test that a higher search_ef fetches more candidates from the index but returns at most limit results"""
+    result_json = json.loads(codebase_search("search function", limit=2, search_ef=40))
+
+    assert ctx.code_collection.query.call_args.kwargs["n_results"] == 40
+    assert len(result_json["results"]) == 2
+
+
+# ========== Tests for index compaction ==========
+
+def test_rebuild_collection_reclaims_space(temp_folder):
+    """Test that rebuilding a collection keeps its live records only and that vacuuming shrinks the database"""
+    import chromadb
+
+    store = ChromaVectorStore(chromadb.PersistentClient(path=temp_folder))
+    collection = store.create_collection(name="compaction_test", embedding_function=None)
+    rng = np.random.default_rng(0)
+    ids = [str(i) for i in range(2000)]
+    for _ in range(3):
+        collection.upsert(ids=ids, embeddings=rng.random((len(ids), 32)).tolist(), documents=["x" * 100] * len(ids))
+    collection.delete(ids=ids[200:])
+    live = collection.get(include=["embeddings", "documents"])
+    size_before = get_directory_size(temp_folder)
+
+    rebuilt = rebuild_collection(store, collection, {"hnsw:M": 8})
+    store.vacuum()
+
+    assert rebuilt.name == "compaction_test"
+    assert rebuilt.metadata == {"hnsw:M": 8}
+    assert store.list_collections() == ["compaction_test"]
+    copied = rebuilt.get(ids=live["ids"], include=["embeddings", "documents"])
+    assert sorted(copied["ids"]) == sorted(live["ids"])
+    assert get_directory_size(temp_folder) < size_before
+
+
+def test_rebuild_collection_recovers_interrupted_rebuilds():
+    """Test that the collections left over by an interrupted rebuild are cleaned up or finish the swap"""
+    import chromadb
+
+    store = ChromaVectorStore(chromadb.EphemeralClient())
+    name = f"recovery_{uuid.uuid4().hex}"
+    collection = store.create_collection(name=name, embedding_function=None)
+    collection.add(ids=["a", "b"], embeddings=[[0.0, 1.0], [1.0, 0.0]], documents=["a", "b"])
+
+    # Interrupted while copying: the partial copy is dropped
+    store.create_collection(name=f"{name}_new", embedding_function=None).add(ids=["a"], embeddings=[[0.0, 1.0]])
+    rebuilt = rebuild_collection(store, collection)
+    assert sorted(rebuilt.get()["ids"]) == ["a", "b"]
+    assert [n for n in store.list_collections() if n.startswith(name)] == [name]
+
+    # Interrupted between the renames: the complete copy takes the name
+    rebuilt.modify(name=f"{name}_old")
+    copy = store.create_collection(name=f"{name}_new", embedding_function=None)
+    copy.add(ids=["a", "b"], embeddings=[[0.0, 1.0], [1.0, 0.0]], documents=["a", "b"])
+    recover_rebuild(store, name)
+    assert [n for n in store.list_collections() if n.startswith(name)] == [name]
+    assert sorted(store.get_collection(name).get()["ids"]) == ["a", "b"]
+
+    store.delete_collection(name)
+
+
+def test_compact_index(setup_code_directory, repository_registry):
+    """Test that compact_index rebuilds the collections without changing search results"""
+    index_repository([setup_code_directory])
+    search_before = json.loads(codebase_search("hello", min_relevance=-1e9))
+
+    result_json = json.loads(compact_index())
+
+    assert result_json["status"] == "success"
+    [collection] = result_json["collections"]
+    assert collection["repository"] == setup_code_directory
+    assert collection["records"] == 3
+    assert collection["latency_before_ms"] is not None and collection["latency_after_ms"] is not None
+    assert ctx.repository_collections[collection["collection"]].count() == 3
+    search_after = json.loads(codebase_search("hello", min_relevance=-1e9))
+    assert [r["id"] for r in search_after["results"]] == [r["id"] for r in search_before["results"]]
+
+
+def test_compact_index_refuses_while_watching(setup_code_directory, repository_registry):
+    """Test that compact_index does not replace collections that watchers are writing to"""
+    with (
+        patch("windtools_mcp.server.INDEX_WATCH_BACKEND", "poll"),
+        patch("windtools_mcp.server.INDEX_WATCH_POLL_SECONDS", 0.05),
+    ):
+        index_repository([setup_code_directory], watch=True)
+    try:
+        assert "error" in json.loads(compact_index())
+    finally:
+        stop_watching([setup_code_directory])
+
+    assert json.loads(compact_index())["status"] == "success"
+
+
+def test_compact_index_reclaims_space_of_a_persistent_client(temp_folder):
+    """Test that compacting a persistent database shrinks it and deletes the index folder of the old collection"""
+    import chromadb
+
+    persist_directory = os.path.join(temp_folder, "chromadb")
+    store = ChromaVectorStore(chromadb.PersistentClient(path=persist_directory))
+    with _code_collection(store, f"test_{uuid.uuid4().hex}") as collection:
+        ids = [f"id{i}" for i in range(2000)]
+        collection.add(ids=ids, embeddings=np.random.rand(len(ids), 8).tolist(), documents=["x" * 500] * len(ids))
+        collection.delete(ids=ids[:1800])
+        folders_before = {entry.name for entry in os.scandir(persist_directory) if entry.is_dir()}
+
+        result_json = json.loads(compact_index())
+
+        folders_after = {entry.name for entry in os.scandir(persist_directory) if entry.is_dir()}
+        assert ctx.code_collection.count() == 200
+
+    assert result_json["status"] == "success"
+    assert result_json["bytes_reclaimed"] > 0
+    assert folders_before and not folders_before & folders_after, "The index folder of the old collection is deleted"
+
+
+def test_compact_index_refuses_while_indexing(mock_chroma_db):
+    """Test that compact_index does not run while a background index job is running"""
+    from windtools_mcp.jobs import JOB_RUNNING, IndexJob
+
+    job = IndexJob(target_directories=["/repo"], status=JOB_RUNNING)
+    ctx.index_jobs[job.job_id] = job
+    try:
+        assert "error" in json.loads(compact_index())
+    finally:
+        del ctx.index_jobs[job.job_id]
+
+
+
+# ========== Tests for index snapshots ==========
+
+def test_export_and_import_index(setup_code_directory, repository_registry, file_manifest, temp_folder):
+    """Test that a snapshot imported into another checkout is searchable and needs no embedding"""
+    import shutil
+
+    index_repository([setup_code_directory])
+    checkout = os.path.join(temp_folder, "checkout")
+    shutil.copytree(setup_code_directory, checkout)
+    snapshot_path = os.path.join(temp_folder, "index.zip")
+    export_json = json.loads(export_index(setup_code_directory, snapshot_path))
+    assert export_json["snapshot"]["repository"] == setup_code_directory
+    assert export_json["snapshot"]["records"] == 3
+
+    import_json = json.loads(import_index(snapshot_path, target_directory=checkout))
+    assert import_json["repository"] == checkout
+    assert import_json["collection_size"] == 3
+    assert import_json["indexed_files"] == 3
+
+    search_json = json.loads(codebase_search("hello", min_relevance=-1e9, repositories=[checkout]))
+    assert search_json["results"]
+    assert all(result["file_path"].startswith(os.path.join(checkout, "")) for result in search_json["results"])
+    records = file_manifest.get_files(import_json["collection"])
+    assert all(file_path.startswith(os.path.join(checkout, "")) for file_path in records)
+
+    ctx.embedding_function.reset_mock()
+    result_json = json.loads(index_repository([checkout]))
+    assert result_json["statistics"]["files_indexed"] == 0
+    ctx.embedding_function.assert_not_called()
+
+
+def test_import_index_twice_into_the_same_directory(setup_code_directory, repository_registry, temp_folder):
+    """Test that importing a snapshot into an indexed directory replaces its collection"""
+    index_repository([setup_code_directory])
+    snapshot_path = os.path.join(temp_folder, "index.zip")
+    export_index(setup_code_directory, snapshot_path)
+
+    for _ in range(2):
+        import_json = json.loads(import_index(snapshot_path, target_directory=setup_code_directory))
+        assert import_json["repository"] == setup_code_directory
+        assert import_json["collection_size"] == 3
+
+    assert list(repository_registry.list()) == [setup_code_directory]
+    assert json.loads(codebase_search("hello", min_relevance=-1e9))["results"]
+
+
+def test_import_index_rejects_other_embedding_model(setup_code_directory, repository_registry, temp_folder):
+    """Test that a snapshot embedded with another model is not imported"""
+    index_repository([setup_code_directory])
+    snapshot_path = os.path.join(temp_folder, "index.zip")
+    original_embedding_model = ctx.embedding_model
+    try:
+        export_index(setup_code_directory, snapshot_path)
+        ctx.embedding_model = "another-model"
+        assert "error" in json.loads(import_index(snapshot_path))
+        assert "error" in json.loads(import_index(os.path.join(temp_folder, "missing.zip")))
+    finally:
+        ctx.embedding_model = original_embedding_model
+
+
+# ========== Tests for the flat vector store ==========
+
+@pytest.fixture
+def flat_collection(temp_folder):
+    """Fixture that sets a flat vector store collection in a temporary folder and a deterministic embedding function"""
+    with _code_collection(FlatVectorStore(temp_folder), "code_collection") as collection:
+        yield collection
+
+
+@pytest.mark.parametrize("space", ["l2", "cosine", "ip"])
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_flat_collection_exact_search(space, dtype, temp_folder):
+    """Test that flat collections find the exact neighbours of live records, with ChromaDB's distances"""
+    rng = np.random.default_rng(0)
+    vectors = rng.random((500, 16)).astype(np.float32)
+    ids = [f"file:/repo/f{i % 50}.py#L{i}-{i}" for i in range(500)]
+    metadatas = [{"file_path": f"/repo/f{i % 50}.py", "chunk_index": i // 50} for i in range(500)]
+
+    collection = FlatVectorStore(temp_folder, dtype=dtype).create_collection(
+        "flat_test", metadata={"hnsw:space": space}
+    )
+    collection.upsert(ids=ids, embeddings=vectors, documents=ids, metadatas=metadatas)
+    vectors[:10] = rng.random((10, 16))
+    collection.upsert(ids=ids[:10], embeddings=vectors[:10], documents=ids[:10], metadatas=metadatas[:10])
+    collection.delete(where={"file_path": {"$in": ["/repo/f20.py"]}})
+
+    # A new store maps the same files
+    collection = FlatVectorStore(temp_folder, dtype=dtype).get_collection("flat_test")
+    assert collection.count() == 490
+    assert len(collection.get(where={"chunk_index": 0}, include=[])["ids"]) == 49
+
+    stored = vectors.astype(dtype).astype(np.float32)
+    query = rng.random(16).astype(np.float32)
+    if space == "l2":
+        expected = ((stored - query) ** 2).sum(axis=1)
+    elif space == "cosine":
+        expected = 1 - stored @ query / (np.linalg.norm(stored, axis=1) * np.linalg.norm(query))
+    else:
+        expected = 1 - stored @ query
+    live = [i for i in range(500) if metadatas[i]["file_path"] != "/repo/f20.py"]
+    nearest = sorted(live, key=lambda i: expected[i])[:5]
+
+    results = collection.query(query_embeddings=[query], n_results=5)
+    assert results["ids"][0] == [ids[i] for i in nearest]
+    np.testing.assert_allclose(results["distances"][0], expected[nearest], rtol=1e-4, atol=1e-4)
+    assert results["metadatas"][0][0] == metadatas[nearest[0]]
+
+
+def test_index_repository_with_flat_store(setup_code_directory, flat_collection):
+    """Test that indexing, searching and compaction work on the flat vector store"""
+    result_json = json.loads(index_repository([setup_code_directory]))
+    assert result_json["collection_size"] == 3
+
+    sample_path = os.path.join(setup_code_directory, "sample.py")
+    with open(sample_path, "a") as f:
+        f.write("\ndef goodbye():\n    return 'bye'\n")
+    os.remove(os.path.join(setup_code_directory, "src", "utils.py"))
+    index_repository([setup_code_directory])
+    assert flat_collection.count() == 2
+
+    search_json = json.loads(codebase_search("goodbye", min_relevance=-1e9))
+    assert {result["file_path"] for result in search_json["results"]} == {
+        sample_path,
+        os.path.join(setup_code_directory, "sample.js"),
+    }
+
+    compact_json = json.loads(compact_index())
+    assert compact_json["collections"][0]["records"] == 2
+    assert ctx.code_collection.name == "code_collection"
+    assert ctx.vector_store.list_collections() == ["code_collection"]
+    compacted_json = json.loads(codebase_search("goodbye", min_relevance=-1e9))
+    assert [r["id"] for r in compacted_json["results"]] == [r["id"] for r in search_json["results"]]
+
+
+@pytest.mark.parametrize("space", ["l2", "cosine"])
+def test_flat_collection_binary_quantization(space, temp_folder):
+    """Test that binary codes find the candidates of a search and that they are reranked with exact distances"""
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(2000, 64)).astype(np.float32)
+    ids = [str(i) for i in range(2000)]
+
+    codes = binarize(vectors)
+    assert codes.shape == (2000, 8)
+    expected_hamming = ((vectors > 0) != (vectors[0] > 0)).sum(axis=1)
+    np.testing.assert_array_equal(hamming_distances(codes, codes[0]), expected_hamming)
+
+    store = FlatVectorStore(temp_folder, quantization="binary", rerank_factor=10)
+    collection = store.create_collection("quantized_test", metadata={"hnsw:space": space})
+    collection.upsert(ids=ids[:1000], embeddings=vectors[:1000])
+    collection.find_nearest(vectors[0], 5, rerank_factor=10)
+    # Rows appended once the codes are in memory get their codes too
+    collection.upsert(ids=ids[1000:], embeddings=vectors[1000:])
+    collection.delete(ids=ids[1500:1510])
+
+    query = vectors[1505] + rng.normal(scale=0.05, size=64).astype(np.float32)
+    assert "1505" not in collection.query(query_embeddings=[query], n_results=5)["ids"][0]
+    query = vectors[1800] + rng.normal(scale=0.05, size=64).astype(np.float32)
+    exact_rows, _ = collection.find_nearest(query, 5)
+    results = collection.query(query_embeddings=[query], n_results=5)
+    assert results["ids"][0][0] == "1800"
+    assert results["ids"][0][0] == ids[exact_rows[0]]
+    rows = [ids.index(chunk_id) for chunk_id in results["ids"][0]]
+    np.testing.assert_allclose(
+        results["distances"][0], collection._compute_distances(query, np.array(rows)), rtol=1e-5, atol=1e-5
+    )
+    # Enough candidates to cover the whole collection gives the exact results
+    np.testing.assert_array_equal(collection.find_nearest(query, 5, rerank_factor=400)[0], exact_rows)
+    assert collection.stats()["code_bytes"] == 2000 * 8
+
+
+def test_measure_quantization(setup_code_directory, flat_collection):
+    """Test that measure_quantization reports the recall and latency of quantized searches of each collection"""
+    index_repository([setup_code_directory])
+
+    result_json = json.loads(measure_quantization())
+
+    assert result_json["quantization"] == "none"
+    [report] = result_json["collections"]
+    assert report["records"] == 3
+    assert report["vector_bytes"] > report["code_bytes"] > 0
+    assert [entry["rerank_factor"] for entry in report["quantized"]] == [2, 5, 10, 20]
+    # Three records are fewer than the candidates of any rerank factor, so that the search is exact
+    assert all(entry["recall"] == 1.0 for entry in report["quantized"])
+
+
+def test_measure_quantization_needs_flat_store(mock_chroma_db):
+    """Test that measure_quantization returns an error with ChromaDB"""
+    ctx.vector_store.backend = "chroma"
+    result_json = json.loads(measure_quantization())
+    assert "error" in result_json
+
+
+# ========== Tests for the vector store interface ==========
+
+@pytest.mark.parametrize("backend", ["chroma", "flat"])
+def test_vector_store_interface(backend, temp_folder):
+    """Test that every vector store implements the same upsert, delete, iteration and statistics behaviour"""
+    import chromadb
+
+    if backend == "chroma":
+        store = ChromaVectorStore(chromadb.PersistentClient(path=temp_folder))
+    else:
+        store = FlatVectorStore(temp_folder)
+    collection = store.get_or_create_collection("interface_test")
+    rng = np.random.default_rng(0)
+    ids = [f"file:/repo/f{i % 10}.py#L{i}-{i}" for i in range(120)]
+    metadatas = [{"file_path": f"/repo/f{i % 10}.py", "chunk_index": i // 10} for i in range(120)]
+    collection.upsert(ids=ids, embeddings=rng.random((120, 8)).tolist(), documents=ids, metadatas=metadatas)
+    collection.delete(where={"file_path": "/repo/f0.py"})
+
+    with patch("windtools_mcp.vector_store.ID_SCAN_PAGE_SIZE", 25):
+        assert sorted(collection.iter_ids()) == sorted(ids[i] for i in range(120) if i % 10)
+        assert len(list(collection.iter_ids(where={"chunk_index": 0}))) == 9
+    assert collection.stats()["records"] == 108
+    assert store.stats() == {"backend": backend, "persist_directory": temp_folder, "collections": 1}
+    assert store.get_or_create_collection("interface_test").count() == 108
+    with pytest.raises(ValueError):
+        store.get_collection("missing")
+
+    store.delete_collection("interface_test")
+    assert store.list_collections() == []